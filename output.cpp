@@ -0,0 +1,126 @@
+void DFProto::describe_job_handler(dfproto::job_handler* proto, df::job_handler* dfhack) {
+    auto describe_T_anon_1 = [](dfproto::job_handler_T_anon_1* proto, df::job_handler::T_anon_1* dfhack) {
+      proto->set_anon_1(dfhack->anon_1);
+    };
+  for (size_t i=0; i<dfhack->anon_1.size(); i++) {
+    if (dfhack->anon_1[i] != NULL) {
+describe_T_anon_1(proto->add_anon_1(), dfhack->anon_1[i]);
+
+}
+  }
+  auto describe_T_anon_2 = [](dfproto::job_handler_T_anon_2* proto, df::job_handler::T_anon_2* dfhack) {
+    proto->set_anon_1(dfhack->anon_1);
+  };
+  for (size_t i=0; i<2000; i++) {
+    describe_T_anon_2(proto->add_anon_2(), &dfhack->anon_2[i]);
+  }
+}
+void DFProto::describe_job_handler(dfproto::job_handler* proto, df::job_handler* dfhack) {
+    if (dfhack->anon_1 != NULL) {
+describe_unit(proto->mutable_anon_1(), dfhack->anon_1);
+
+}
+    proto->set_anon_2(dfhack->anon_2);
+}
+void DFProto::describe_general_ref(dfproto::general_ref* proto, df::general_ref* dfhack) {
+}
+void DFProto::describe_mytype(dfproto::mytype* proto, df::mytype* dfhack) {
+  proto->set_id(dfhack->id);
+}
+void DFProto::describe_job_list_link(dfproto::job_list_link* proto, df::job_list_link* dfhack) {
+proto->set_next_id(dfhack->next->id);
+}
+void DFProto::describe_entity_position_raw(dfproto::entity_position_raw* proto, df::entity_position_raw* dfhack) {
+  proto->set_squad_sz(dfhack->squad_size);
+}
+void DFProto::describe_adventure_movement_optionst(dfproto::adventure_movement_optionst* proto, df::adventure_movement_optionst* dfhack) {
+  describe_coord(proto->mutable_dest(), &dfhack->dest);
+  describe_coord(proto->mutable_source(), &dfhack->source);
+}
+void DFProto::describe_item(dfproto::item* proto, df::item* dfhack) {
+  proto->set_id(dfhack->id);
+df::item_type df_type = dfhack->getType();
+dfproto::item_type type;
+describe_item_type(&type, &df_type);
+proto->set_type(type);
+   proto->set_subtype(dfhack->getSubtype());
+}
+void DFProto::describe_ui_advmode_menu(dfproto::ui_advmode_menu* proto, df::ui_advmode_menu* dfhack) {
+  *proto = static_cast<dfproto::ui_advmode_menu>(*dfhack);
+}
+void DFProto::describe_conflict_level(dfproto::conflict_level* proto, df::conflict_level* dfhack) {
+  *proto = static_cast<dfproto::conflict_level>(*dfhack);
+}
+void DFProto::describe_campfire(dfproto::campfire* proto, df::campfire* dfhack) {
+  describe_coord(proto->mutable_pos(), &dfhack->pos);
+  proto->set_timer(dfhack->timer);
+}
+void DFProto::describe_entity_site_link(dfproto::entity_site_link* proto, df::entity_site_link* dfhack) {
+  proto->set_target(dfhack->target);
+  proto->set_entity_id(dfhack->entity_id);
+  proto->set_anon_1(dfhack->anon_1);
+  proto->set_anon_2(dfhack->anon_2);
+}
+void DFProto::describe_conversation(dfproto::conversation* proto, df::conversation* dfhack) {
+  for (size_t i=0; i<dfhack->nem_54.size(); i++) {
+    if (dfhack->nem_54[i] != NULL) {
+describe_nemesis_record(proto->add_nem_54(), dfhack->nem_54[i]);
+
+}
+  }
+}
+void DFProto::describe_history_event_reason_info(dfproto::history_event_reason_info* proto, df::history_event_reason_info* dfhack) {
+  dfproto::history_event_reason type;
+describe_history_event_reason(&type, &dfhack->type);
+proto->set_type(type);
+  switch (dfhack->type) {
+    case ::df::enums::history_event_reason::glorify_hf:
+      proto->set_glorify_hf(dfhack->data.glorify_hf);
+      break;
+    case ::df::enums::history_event_reason::artifact_is_heirloom_of_family_hfid:
+      proto->set_artifact_is_heirloom_of_family_hfid(dfhack->data.artifact_is_heirloom_of_family_hfid);
+      break;
+    default:
+      proto->clear_data();
+  }
+}
+void DFProto::describe_adventure_item(dfproto::adventure_item* proto, df::adventure_item* dfhack) {
+  describe_adventure_item_interact_choicest(proto->mutable_parent(), dfhack);
+  if (dfhack->anon_1 != NULL) {
+describe_item(proto->mutable_anon_1(), dfhack->anon_1);
+
+}
+}
+void DFProto::describe_entity_site_link(dfproto::entity_site_link* proto, df::entity_site_link* dfhack) {
+  proto->set_anon_1(dfhack->anon_1);
+  auto describe_T_flags = [](dfproto::entity_site_link_T_flags* proto, df::entity_site_link::T_flags* dfhack) {
+  proto->set_flags(dfhack->whole);
+};
+  describe_T_flags(proto->mutable_flags(), &dfhack->flags);
+  proto->set_anon_2(dfhack->anon_2);
+}
+void DFProto::describe_conversation1(dfproto::conversation1* proto, df::conversation1* dfhack) {
+  proto->set_conv_title(dfhack->conv_title);
+  proto->set_num_30(dfhack->num_30);
+}
+void DFProto::describe_entity_claim_mask(dfproto::entity_claim_mask* proto, df::entity_claim_mask* dfhack) {
+    auto describe_T_map = [](dfproto::entity_claim_mask_T_map* proto, df::entity_claim_mask::T_map* dfhack) {
+      for (size_t i=0; i<dfhack->entities.size(); i++) {
+        proto->add_entities(dfhack->entities[i]);
+      }
+    };
+    if (dfhack->map != NULL) {
+describe_T_map(proto->mutable_map(), dfhack->map);
+
+}
+}
+void DFProto::describe_historical_entity(dfproto::historical_entity* proto, df::historical_entity* dfhack) {
+  auto describe_T_resources = [](dfproto::historical_entity_T_resources* proto, df::historical_entity::T_resources* dfhack) {
+    auto describe_T_metal = [](dfproto::historical_entity_T_resources_T_metal* proto, df::historical_entity::T_resources::T_metal* dfhack) {
+      describe_material_vec_ref(proto->mutable_pick(), &dfhack->pick);
+      describe_material_vec_ref(proto->mutable_weapon(), &dfhack->weapon);
+    };
+    describe_T_metal(proto->mutable_metal(), &dfhack->metal);
+  };
+  describe_T_resources(proto->mutable_resources(), &dfhack->resources);
+}
@@ -1,5 +1,90 @@
 from collections import defaultdict
 
+from exception_rules import ResolvedExceptions
+
+
+class Fragments:
+    """Sink for rendered code.
+
+    Strings and other sinks added to a sink are only referenced, and all
+    pieces are joined once when converted to str, so the code of nested
+    types is not copied again into each enclosing type.
+    """
+
+    def __init__(self, *parts):
+        self.parts = list(parts)
+
+    def __iadd__(self, other):
+        self.parts.append(other)
+        return self
+
+    def __add__(self, other):
+        return Fragments(self, other)
+
+    def __radd__(self, other):
+        return Fragments(other, self)
+
+    def __bool__(self):
+        return any(self.parts)
+
+    def first(self):
+        # first non-blank piece, left-stripped
+        for part in self.parts:
+            text = part.first() if isinstance(part, Fragments) else part.lstrip()
+            if text:
+                return text
+        return ''
+
+    def last(self):
+        # last non-blank piece, right-stripped
+        for part in reversed(self.parts):
+            text = part.last() if isinstance(part, Fragments) else part.rstrip()
+            if text:
+                return text
+        return ''
+
+    def write(self, out):
+        # write all pieces to a list or a stream
+        for part in self.parts:
+            if isinstance(part, Fragments):
+                part.write(out)
+            elif hasattr(out, 'append'):
+                out.append(part)
+            else:
+                out.write(part)
+
+    def __str__(self):
+        out = []
+        self.write(out)
+        return ''.join(out)
+
+
+class ExportedFields:
+    """Fields exported with all their sub-elements.
+
+    Rendering a field exports its whole subtree: rendered fields are
+    recorded here, and the export flag inherited by an element is looked
+    up from its ancestors, so the xml tree shared by renderers is never
+    modified.
+    """
+
+    def __init__(self):
+        self.rendered = set()
+        # elements known to inherit export; exports are never withdrawn
+        self.inherited = set()
+
+    def add(self, xml):
+        self.rendered.add(xml)
+
+    def is_inherited(self, xml):
+        node = xml
+        while node is not None:
+            if node in self.inherited or node in self.rendered:
+                self.inherited.add(xml)
+                return True
+            node = node.getparent()
+        return False
+
 
 class AbstractRenderer:
 
@@ -13,10 +98,14 @@ class AbstractRenderer:
         self.anon_xml = None
         self.anon_id = 0
         # rules for special elements
-        self.exceptions_rename = []
-        self.exceptions_ignore = []
-        self.exceptions_index = []
-        self.exceptions_enum = []
+        self.exceptions_rename = ()
+        self.exceptions_ignore = ()
+        self.exceptions_index = ()
+        self.exceptions_enum = ()
+        # rules above resolved against the current document
+        self.exceptions_resolved = ResolvedExceptions()
+        # fields exported with their sub-elements
+        self.exported = ExportedFields()
         # ignore fields with no attribute 'export' ?
         self.ignore_no_export = True
         # generate comment for ignored fields ?
@@ -35,6 +124,8 @@ class AbstractRenderer:
         target.exceptions_rename = self.exceptions_rename
         target.exceptions_index = self.exceptions_index
         target.exceptions_enum = self.exceptions_enum
+        target.exceptions_resolved = self.exceptions_resolved
+        target.exported = self.exported
         target.ignore_no_export = self.ignore_no_export
         target.comment_ignored = self.comment_ignored
 
@@ -67,20 +158,41 @@ class AbstractRenderer:
     def is_primitive_type(typ):
         return typ in AbstractRenderer.TYPES.keys()
 
+    def set_exception_rules(self, rules):
+        # rules are shared, add_exception_*() make new lists
+        self.exceptions_rename = rules.rename
+        self.exceptions_ignore = rules.ignore
+        self.exceptions_index = rules.index
+        self.exceptions_enum = rules.enum
+        return self
+
+    def set_resolved_exceptions(self, resolved):
+        self.exceptions_resolved = resolved
+        return self
+
+    def set_exported_fields(self, exported):
+        self.exported = exported
+        return self
+
     def add_exception_rename(self, xpath, new_name):
-        self.exceptions_rename.append((xpath, new_name))
+        self.exceptions_rename = [*self.exceptions_rename, (xpath, new_name)]
         return self
 
     def add_exception_ignore(self, xpath):
-        self.exceptions_ignore.append(xpath)
+        self.exceptions_ignore = [*self.exceptions_ignore, xpath]
         return self
 
+    def resolve_exceptions(self, xml):
+        return self.exceptions_resolved.resolve(
+            xml, self.ns[1:-1], self.exceptions_ignore, self.exceptions_rename
+        )
+
     def add_exception_index(self, tname, field):
-        self.exceptions_index.append((tname, field))
+        self.exceptions_index = [*self.exceptions_index, (tname, field)]
         return self
 
     def add_exception_enum(self, tname):
-        self.exceptions_enum.append(tname)
+        self.exceptions_enum = [*self.exceptions_enum, tname]
         return self
 
     def ident(self, xml, extra_ident=0):
@@ -89,12 +201,10 @@ class AbstractRenderer:
 
     def get_name(self, xml):
         dfname = xml.get('name')
+        # renamed protobuf name ?
         pbname = None
-        for k,v in iter(self.exceptions_rename):
-            found = xml.getroottree().xpath(k, namespaces={'ld': self.ns[1:-1]})
-            if found and found[0] is xml:
-                # rename protobuf name
-                pbname = v
+        if self.exceptions_rename:
+            pbname = self.resolve_exceptions(xml).get_rename(xml)
         if not dfname:
             dfname = xml.get(f'{self.ns}anon-name')
         if not dfname:
@@ -139,7 +249,7 @@ class AbstractRenderer:
             ctx = self.create_context()
         if not tname:
             tname = xml.get('type-name')
-        out = self._render_struct_header(xml, tname, ctx)
+        out = Fragments(self._render_struct_header(xml, tname, ctx))
         value = 1
         parent = xml.get('inherits-from')
         if parent:
@@ -165,7 +275,7 @@ class AbstractRenderer:
             return '', value
         ctx = self.create_context()
         ctx.value = value
-        field = self.render_field(xml, ctx)
+        field = self.emit_field(xml, ctx)
         value += 1
         return field, value
     
@@ -187,7 +297,7 @@ class AbstractRenderer:
     def render_field_impl(self, xml, ctx):
         ignore = False        
         name = xml.get('name')
-        export = xml.get('export')
+        export = 'true' if self.exported.is_inherited(xml) else xml.get('export')
         export_as = xml.get('export-as')
         if export_as:
             # convert type
@@ -198,15 +308,8 @@ class AbstractRenderer:
             ignore = True
 
         # if (name and name.startswith('unk_')) or export!='true':
-        else:
-            for k in self.exceptions_ignore:
-                found = xml.getroottree().xpath(k, namespaces={
-                    'ld': self.ns[1:-1],
-                    're': 'http://exslt.org/regular-expressions'
-                })
-                if found and xml in found:
-                    ignore = True
-                    break
+        elif self.exceptions_ignore:
+            ignore = self.resolve_exceptions(xml).is_ignored(xml)
         if ignore:
             # ignore this field
             if self.comment_ignored:
@@ -215,8 +318,7 @@ class AbstractRenderer:
                 return ''
         else:
             # export all sub-elements
-            for sub in xml.iter():
-                sub.set('export', 'true')
+            self.exported.add(xml)
         meta = xml.get(f'{self.ns}meta')
         if not meta and xml.tag == 'vmethod':
             return self.render_field_method(xml, ctx)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Time rendering of large synthetic global types, with Fragments sinks
+# and with the plain string concatenation they replaced
+
+import sys
+import argparse
+import time
+import contextlib
+from lxml import etree
+
+import abstract_renderer
+import proto_renderer
+import cpp_renderer
+from abstract_renderer import Fragments
+from proto_renderer import ProtoRenderer
+from cpp_renderer import CppRenderer
+
+
+class Concatenated(str):
+    # baseline sink: the code of nested types is copied into each enclosing type
+    def __new__(cls, *parts):
+        return str.__new__(cls, ''.join(str(part) for part in parts))
+
+    def __add__(self, other):
+        return Concatenated(self, other)
+
+    def __radd__(self, other):
+        return Concatenated(other, self)
+
+    def first(self):
+        return self.lstrip()
+
+    def last(self):
+        return self.rstrip()
+
+@contextlib.contextmanager
+def baseline():
+    # render with strings instead of Fragments
+    modules = [abstract_renderer, proto_renderer, cpp_renderer]
+    try:
+        for module in modules:
+            module.Fragments = Concatenated
+        yield
+    finally:
+        for module in modules:
+            module.Fragments = Fragments
+
+
+def make_compound(depth, width, level, name):
+    # nested anonymous compounds, each with 'width' numbers and a vector
+    out = '<ld:field name="%s" ld:level="%d" ld:meta="compound" ld:typedef-name="T_%s">\n' % (name, level, name)
+    for i in range(width):
+        out += '<ld:field name="f%d" ld:level="%d" ld:meta="number" ld:subtype="int32_t" comment="field %d"/>\n' % (i, level+1, i)
+    out += '<ld:field name="vals" ld:level="%d" ld:meta="container" ld:subtype="stl-vector">' % (level+1)
+    out += '<ld:item ld:level="%d" ld:meta="number" ld:subtype="int16_t"/></ld:field>\n' % (level+2)
+    if depth > 0:
+        for i in range(2):
+            out += make_compound(depth-1, width, level+1, '%s_%d' % (name, i))
+    out += '</ld:field>\n'
+    return out
+
+def make_type(depth, width):
+    out  = '<ld:data-definition xmlns:ld="ns">\n'
+    out += '<ld:global-type ld:meta="struct-type" ld:level="0" type-name="bench_type">\n'
+    out += make_compound(depth, width, 1, 'c')
+    out += '</ld:global-type>\n'
+    out += '</ld:data-definition>\n'
+    return etree.fromstring(out)[0]
+
+def best_time(render, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = render()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def bench(name, render, repeat):
+    with baseline():
+        old, expected = best_time(render, repeat)
+    new, out = best_time(render, repeat)
+    assert out == expected, '%s: different code rendered with Fragments' % (name)
+    sys.stdout.write('%-6s %8.1f ms %8.1f ms %6.1fx %10d bytes\n' % (name, old*1000, new*1000, old/new, len(out)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Time renderers on synthetic nested types, with strings and with Fragments.')
+    parser.add_argument('--depth', metavar='N', type=int, nargs='+', default=[4, 6, 8],
+                        help='nesting depths of compounds (default=4 6 8)')
+    parser.add_argument('--width', metavar='N', type=int, default=20,
+                        help='number of fields per compound (default=20)')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='keep best time of N runs (default=3)')
+    args = parser.parse_args()
+
+    for depth in args.depth:
+        xml = make_type(depth, args.width)
+        sys.stdout.write('depth %d, %d elements\n' % (depth, sum(1 for _ in xml.iter())))
+        sys.stdout.write('%-6s %11s %11s %7s\n' % ('', 'strings', 'fragments', 'speedup'))
+        bench('proto', lambda: ProtoRenderer('ns').set_ignore_no_export(False).render_type(xml), args.repeat)
+        bench('cpp', lambda: CppRenderer('ns', 'dfproto', 'DFProto').set_ignore_no_export(False).render_type(xml), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
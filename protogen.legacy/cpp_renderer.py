@@ -2,7 +2,7 @@ import sys
 import traceback
 import copy
 
-from abstract_renderer import AbstractRenderer
+from abstract_renderer import AbstractRenderer, Fragments
 
 
 class Context:
@@ -222,7 +222,7 @@ class CppRenderer(AbstractRenderer):
                 self.dfproto_imports.add(tname)
                 return self._convert_simple( (ctx.names[0]+'_'+v, ctx.names[1]+'->'+v) )
         if len(xml):
-            out = self.render_field(xml[0], ctx.set_deref(True).dec_ident())
+            out = self.emit_field(xml[0], ctx.set_deref(True).dec_ident())
             meta = xml[0].get(f'{self.ns}meta')
             if meta=='static-array' or meta=='container':
                 # pointer to container
@@ -309,7 +309,7 @@ class CppRenderer(AbstractRenderer):
                 else:
                     tname = xml[0].get('type-name')
                     if self.is_primitive_type(tname):
-                        return self.render_field(xml[0], Context(names[0]))
+                        return self.emit_field(xml[0], Context(names[0]))
                     self.imports.add(tname)
                     self.dfproto_imports.add(tname)
                     item_str = self._convert_field_compound(
@@ -342,8 +342,8 @@ class CppRenderer(AbstractRenderer):
         return self.ident(xml) + '  describe_%s(proto->mutable_parent(), dfhack);\n' % ( parent )
 
     def _render_struct_field(self, item, value, ctx):
-        field = self.render_field(item, Context(value, ident=ctx.ident))
-        if field.lstrip().startswith('/*'):
+        field = self.emit_field(item, Context(value, ident=ctx.ident))
+        if field.first().startswith('/*'):
             field = ''
             value += 1
         return field, value
@@ -376,7 +376,7 @@ class CppRenderer(AbstractRenderer):
             tname, rdr.outer_proto_tname(), rdr.outer_dfhack_tname()
         )
         for item in xml.findall(f'{self.ns}field'):
-            out += rdr.render_field(item)
+            out += rdr.emit_field(item)
         out += self.ident(xml) + '};\n'
         return out
 
@@ -448,14 +448,17 @@ class CppRenderer(AbstractRenderer):
 
     # main renderer
 
-    def render_field(self, xml, ctx=None):
+    def emit_field(self, xml, ctx=None):
         if not ctx:
             ctx = Context()
-        return self.render_field_impl(xml, ctx)
+        return Fragments(self.render_field_impl(xml, ctx))
+
+    def render_field(self, xml, ctx=None):
+        return str(self.emit_field(xml, ctx))
 
     def render_type(self, xml):
         self.outer_types.append(xml.get('type-name'))
-        return self.render_type_impl(xml)
+        return str(self.render_type_impl(xml))
     
     def render_prototype(self, xml):
         tname = xml.get('type-name')
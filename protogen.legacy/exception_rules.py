@@ -0,0 +1,124 @@
+from functools import lru_cache
+from lxml import etree
+
+
+REGEX_NS = 'http://exslt.org/regular-expressions'
+
+
+@lru_cache(maxsize=None)
+def compile_xpath(xpath, ns):
+    # xpath compiled once per namespace, shared by all renderers
+    return etree.XPath(xpath, namespaces={'ld': ns, 're': REGEX_NS})
+
+
+class ExceptionRules:
+    """Rules of an exceptions file, parsed once and shared by all renderers.
+
+    The rule set is immutable: renderers copy the rules they need, and
+    xpaths are compiled once per namespace by compile_xpath().
+    """
+
+    def __init__(self, rename=(), ignore=(), index=(), enum=(), depends=()):
+        # (xpath, new name) of fields to rename
+        self.rename = tuple(rename)
+        # xpath of types & fields to ignore
+        self.ignore = tuple(ignore)
+        # (type name, field) of pointers converted to ids
+        self.index = tuple(index)
+        # names of types handled as enums
+        self.enum = tuple(enum)
+        # (type name, dependency) of hidden dependencies
+        self.depends = tuple(depends)
+
+    @staticmethod
+    def from_file(fname):
+        with open(fname, 'r') as fil:
+            return ExceptionRules.parse(fil)
+
+    @staticmethod
+    def parse(lines):
+        rename, ignore, index, enum, depends = [], [], [], [], []
+        for line in lines:
+            tokens = line.strip().split(' ')
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            if tokens[0] == 'rename':
+                rename.append((tokens[1], tokens[2]))
+            elif tokens[0] == 'index':
+                index.append((tokens[1], tokens[2]))
+            elif tokens[0] == 'ignore':
+                ignore.append(tokens[1])
+            elif tokens[0] == 'enum':
+                enum.append(tokens[1])
+            elif tokens[0] == 'depends':
+                depends.append((tokens[1], tokens[2]))
+        return ExceptionRules(rename, ignore, index, enum, depends)
+
+    def compile(self, ns):
+        # build xpaths of the rules for this namespace ahead of rendering
+        for xpath in self.ignore:
+            compile_xpath(xpath, ns)
+        for xpath, _ in self.rename:
+            compile_xpath(xpath, ns)
+        return self
+
+
+class ResolvedExceptions:
+    """Ignore and rename rules evaluated once against a whole document.
+
+    Matched elements are kept in identity-keyed containers, so that
+    renderers can check a field in O(1) instead of re-running every
+    xpath for every field.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.ignore = None
+        self.rename = None
+        self.ignored = set()
+        self.renamed = {}
+        # (rule as in the exceptions file, elements it applies to)
+        self.matches = []
+
+    def resolve(self, xml, ns, ignore, rename):
+        # rules are never modified in place, so identity is enough to
+        # detect that they changed
+        root = xml.getroottree().getroot()
+        if self.root is root and self.ignore is ignore and self.rename is rename:
+            return self
+        tree = root.getroottree()
+        self.ignored = set()
+        self.matches = []
+        for xpath in ignore:
+            found = compile_xpath(xpath, ns)(tree)
+            self.ignored.update(found)
+            self.matches.append(('ignore %s' % (xpath), found))
+        self.renamed = {}
+        for xpath, new_name in rename:
+            found = compile_xpath(xpath, ns)(tree)
+            if found:
+                self.renamed[found[0]] = new_name
+                self.matches.append(('rename %s %s' % (xpath, new_name), found[:1]))
+        self.root = root
+        self.ignore = ignore
+        self.rename = rename
+        return self
+
+    def is_ignored(self, xml):
+        return xml in self.ignored
+
+    def get_rename(self, xml):
+        return self.renamed.get(xml)
+
+    def matched_rules(self, xml, rules):
+        # rules that apply to a global type, as lines of the exceptions file:
+        # ignore and rename rules matching elements of its subtree, index and
+        # enum rules of the types it refers to, and its hidden dependencies
+        elements = set(xml.iter())
+        tnames = {e.get('type-name') for e in elements}
+        matched = [rule for rule, found in self.matches if any(e in elements for e in found)]
+        matched += ['index %s %s' % (t, f) for t, f in rules.index if t in tnames]
+        matched += ['enum %s' % (t) for t in rules.enum if t in tnames]
+        tname = xml.get('type-name') or xml.get('name')
+        matched += ['depends %s %s' % (t, d) for t, d in rules.depends if t == tname]
+        return matched
@@ -1,5 +1,44 @@
+import os
+import hashlib
+from lxml import etree
+
+from exception_rules import ExceptionRules, ResolvedExceptions
+from abstract_renderer import ExportedFields
 from proto_renderer import ProtoRenderer
 from cpp_renderer import CppRenderer
+from profiler import Profile
+
+# part of the manifest of rendered types, increment when the generated code changes
+RENDERER_VERSION = 1
+
+# sha256 of the renderer modules, computed once
+_sources_digest = None
+
+
+def write_if_changed(fname, content):
+    # keep existing file (and its mtime) if content is unchanged
+    try:
+        with open(fname, 'r') as fil:
+            if fil.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(fname, 'w') as fil:
+        fil.write(content)
+    return True
+
+def sources_digest():
+    # hash of the renderer modules, so that manifests of rendered types are
+    # outdated by changes of the renderers, even without a new RENDERER_VERSION
+    global _sources_digest
+    if _sources_digest is None:
+        h = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in ['abstract_renderer', 'proto_renderer', 'cpp_renderer', 'global_type_renderer', 'exception_rules']:
+            with open(os.path.join(here, name + '.py'), 'rb') as fil:
+                h.update(hashlib.sha256(fil.read()).digest())
+        _sources_digest = h.hexdigest()
+    return _sources_digest
 
 
 class GlobalTypeRenderer:
@@ -8,14 +47,17 @@ class GlobalTypeRenderer:
         self.ns = ns
         self.proto_ns = proto_ns
         self.version = 2
-        self.exceptions_rename = []
-        self.exceptions_ignore = []
-        self.exceptions_index = []
-        self.exceptions_enum = []
-        self.exceptions_depends = []
+        self.exceptions = ExceptionRules()
+        self.exceptions_resolved = ResolvedExceptions()
+        # fields exported by the proto pass are also exported by the c++ passes
+        self.exported = ExportedFields()
         self.ignore_no_export = True
         self.comment_ignored = False
         self.xml = xml
+        # files actually written by render_to_files
+        self.updated = []
+        # timings and output sizes of render_to_files
+        self.profile = Profile(self.xml.get('type-name') or self.xml.get('name'))
         assert self.xml.tag == '{%s}global-type' % (self.ns)
 
     def set_proto_version(self, ver):
@@ -23,22 +65,18 @@ class GlobalTypeRenderer:
         return self
 
     def set_exceptions_file(self, fname):
-        with open(fname, 'r') as fil:
-            for line in fil:
-                tokens = line.strip().split(' ')
-                if not tokens or tokens[0].startswith('#'):
-                    continue
-                if tokens[0] == 'rename':
-                    self.exceptions_rename.append(tokens)
-                elif tokens[0] == 'index':
-                    self.exceptions_index.append(tokens)
-                elif tokens[0] == 'ignore':
-                    self.exceptions_ignore.append(tokens)
-                elif tokens[0] == 'enum':
-                    self.exceptions_enum.append(tokens)
-                elif tokens[0] == 'depends':
-                    self.exceptions_depends.append((tokens[1], tokens[2]))
-    
+        return self.set_exception_rules(ExceptionRules.from_file(fname))
+
+    def set_exception_rules(self, rules):
+        # rules may be shared with other types
+        self.exceptions = rules
+        return self
+
+    def set_resolved_exceptions(self, resolved):
+        # share rules resolved against the document with other types
+        self.exceptions_resolved = resolved
+        return self
+
     def set_ignore_no_export(self, b):
         self.ignore_no_export = b
         return self
@@ -46,6 +84,10 @@ class GlobalTypeRenderer:
     def set_comment_ignored(self, b):
         self.comment_ignored = b
         return self
+
+    def set_profile(self, profile):
+        self.profile = profile
+        return self
     
     def get_type_name(self):
         tname = self.xml.get('type-name')
@@ -61,22 +103,32 @@ class GlobalTypeRenderer:
         return self.xml.get('instance-vector')        
     
 
+    def manifest(self):
+        # inputs of the code generated for this type: same manifest, same files
+        resolved = self.exceptions_resolved.resolve(
+            self.xml, self.ns, self.exceptions.ignore, self.exceptions.rename
+        )
+        return {
+            'type': self.get_type_name(),
+            'renderer': [RENDERER_VERSION, sources_digest()],
+            'options': [self.version, self.ignore_no_export, self.comment_ignored, self.proto_ns],
+            'xml': hashlib.sha256(etree.tostring(self.xml, with_tail=False)).hexdigest(),
+            'exceptions': resolved.matched_rules(self.xml, self.exceptions),
+        }
+
+
     # main renderer
 
     def render_proto(self):
         rdr = ProtoRenderer(self.ns, self.proto_ns).set_version(self.version)
+        rdr.set_resolved_exceptions(self.exceptions_resolved).set_exported_fields(self.exported)
         rdr.set_comment_ignored(self.comment_ignored).set_ignore_no_export(self.ignore_no_export)
-        for tokens in self.exceptions_rename:
-            rdr.add_exception_rename(tokens[1], tokens[2])
-        for tokens in self.exceptions_ignore:
-            rdr.add_exception_ignore(tokens[1])
-        for tokens in self.exceptions_index:
-            rdr.add_exception_index(tokens[1], tokens[2])
+        rdr.set_exception_rules(self.exceptions)
         typout = rdr.render_type(self.xml)
         out  = '/* THIS FILE WAS GENERATED. DO NOT EDIT. */\n'
         out += 'syntax = "proto%d";\n' % (self.version)
         out += 'option optimize_for = LITE_RUNTIME;\n'
-        for imp in rdr.imports:
+        for imp in sorted(rdr.imports):
             if imp != self.get_type_name():
                 out += 'import \"%s.proto\";\n' % (imp)
         out += '\n' + typout
@@ -84,28 +136,22 @@ class GlobalTypeRenderer:
 
     def render_cpp(self):
         rdr = CppRenderer(self.ns, self.proto_ns, 'DFProto')
+        rdr.set_resolved_exceptions(self.exceptions_resolved).set_exported_fields(self.exported)
         rdr.set_comment_ignored(self.comment_ignored).set_ignore_no_export(self.ignore_no_export)
-        for tokens in self.exceptions_rename:
-            rdr.add_exception_rename(tokens[1], tokens[2])
-        for tokens in self.exceptions_index:
-            rdr.add_exception_index(tokens[1], tokens[2])
-        for tokens in self.exceptions_ignore:
-            rdr.add_exception_ignore(tokens[1])
-        for tokens in self.exceptions_enum:
-            rdr.add_exception_enum(tokens[1])
+        rdr.set_exception_rules(self.exceptions)
         typout = rdr.render_type(self.xml)
         out  = '/* THIS FILE WAS GENERATED. DO NOT EDIT. */\n'
         # this type may have hidden dependencies
-        for k,v in self.exceptions_depends:
+        for k,v in self.exceptions.depends:
             if k == self.get_type_name():
                 out += '#include \"%s.h\"\n' % (v)
         out += '#include \"%s.h\"\n' % (self.get_type_name())
         # protobuf and dfhack dependencies
-        for imp in rdr.imports:
+        for imp in sorted(rdr.imports):
             out += '#include \"df/%s.h\"\n' % (imp)
             out += '#include \"%s.pb.h\"\n' % (imp)
         # conversion code for other types
-        for imp in rdr.dfproto_imports:
+        for imp in sorted(rdr.dfproto_imports):
             out += '#include \"%s.h\"\n' % (imp)
         out += '\n' + typout
         return out
@@ -123,26 +169,31 @@ class GlobalTypeRenderer:
         out += '}\n'
         return out
 
+    def _render_file(self, phase, render, outdir, fname):
+        with self.profile.phase(phase):
+            out = render()
+        self.profile.add_output(phase, out)
+        with self.profile.phase('write'):
+            if write_if_changed(outdir + '/' + fname, out):
+                self.updated.append(fname)
+
     def render_to_files(self, proto_out, cpp_out, h_out):
-        for k in self.exceptions_ignore:
-            found = self.xml.getroottree().xpath(k[1], namespaces={
-                'ld': self.ns,
-                're': 'http://exslt.org/regular-expressions'
-            })
-            if found and self.xml in found:
-                # ignore this type
-                return None
+        with self.profile.phase('exceptions'):
+            resolved = self.exceptions_resolved.resolve(
+                self.xml, self.ns, self.exceptions.ignore, self.exceptions.rename
+            )
+        if resolved.is_ignored(self.xml):
+            # ignore this type
+            return None
 
         # generate code 
+        self.updated = []
         proto_name = self.get_type_name() + '.proto'
-        with open(proto_out + '/' + proto_name, 'w') as fil:
-            fil.write(self.render_proto())
+        self._render_file('proto', self.render_proto, proto_out, proto_name)
         if self.get_meta_type() in ['struct-type', 'class-type', 'enum-type', 'bitfield-type']:
             cpp_name = self.get_type_name() + '.cpp'
-            with open(cpp_out + '/' + cpp_name, 'w') as fil:
-                fil.write(self.render_cpp())
+            self._render_file('cpp', self.render_cpp, cpp_out, cpp_name)
             h_name = self.get_type_name() + '.h'
-            with open(h_out + '/' + h_name, 'w') as fil:
-                fil.write(self.render_h())
+            self._render_file('h', self.render_h, h_out, h_name)
             return (proto_name, cpp_name, h_name)
         return [proto_name]
@@ -21,6 +21,9 @@ def main():
                         default='proto', help='type proto|h|cpp (default=proto)')
     parser.add_argument('--separator', metavar='SEP', type=str,
                         default='\n', help='separator (default=\n)')
+    parser.add_argument('--registry', metavar='FILE', type=str,
+                        default=None, help='read types from the registry of global types (protogen/registry.py) '
+                        'if it is up to date with INFILE (default=<none>)')
     args = parser.parse_args()
 
     # input dir
@@ -36,6 +39,17 @@ def main():
 
     # collect types and convert to filenames
     rc = 0
+    if args.registry:
+        # shared with the scripts of protogen/
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protogen'))
+        from registry import Registry
+        registry = Registry.load(args.registry)
+        if registry.is_current(infile):
+            for sym in registry.symbols(infile):
+                if sym['meta'] in ['struct-type', 'class-type', 'enum-type', 'bitfield-type', 'df-linked-list-type'] \
+                   and sym['export'] != 'false':
+                    sys.stdout.write(outdir+sym['name']+'.'+args.type+args.separator)
+            return
     xml = etree.parse(infile)
     for item in xml.getroot():
         try:
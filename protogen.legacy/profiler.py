@@ -0,0 +1,103 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profile:
+    """Wall time and output size of the phases of one input file or type."""
+
+    def __init__(self, name, fname=None, fields=0):
+        self.name = name
+        self.file = fname
+        self.fields = fields
+        # phase -> seconds
+        self.seconds = {}
+        # phase -> bytes of output
+        self.bytes = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start
+
+    def add_output(self, phase, content):
+        self.bytes[phase] = self.bytes.get(phase, 0) + len(content.encode())
+        return self
+
+    def total_seconds(self):
+        return sum(self.seconds.values())
+
+    def total_bytes(self):
+        return sum(self.bytes.values())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'file': self.file,
+            'fields': self.fields,
+            'seconds': self.total_seconds(),
+            'bytes': self.total_bytes(),
+            'phases': {
+                phase: {'seconds': seconds, 'bytes': self.bytes.get(phase, 0)}
+                for phase, seconds in self.seconds.items()
+            }
+        }
+
+
+class ProfileReport:
+    """Profiles of all input files and types of a protogen run."""
+
+    PHASES = ['parse', 'transform', 'exceptions', 'proto', 'cpp', 'h', 'write']
+
+    def __init__(self):
+        self.files = []
+        self.types = []
+
+    def add_file(self, profile):
+        self.files.append(profile)
+        return self
+
+    def add_type(self, profile):
+        self.types.append(profile)
+        return self
+
+    def phases(self):
+        # total seconds per phase, for all files and types
+        totals = dict.fromkeys(self.PHASES, 0)
+        for profile in self.files + self.types:
+            for phase, seconds in profile.seconds.items():
+                totals[phase] = totals.get(phase, 0) + seconds
+        return totals
+
+    def top_types(self, count=None):
+        # most expensive types first
+        types = sorted(self.types, key=lambda p: (-p.total_seconds(), p.name))
+        return types[:count] if count else types
+
+    def to_dict(self):
+        return {
+            'phases': self.phases(),
+            'files': [p.to_dict() for p in self.files],
+            'types': [p.to_dict() for p in self.top_types()],
+        }
+
+    def write(self, fname):
+        with open(fname, 'w') as fil:
+            json.dump(self.to_dict(), fil, indent=2)
+
+    def summary(self, count=20):
+        phases = ['proto', 'cpp', 'h', 'write']
+        out = 'phase totals:\n'
+        for phase, seconds in self.phases().items():
+            out += '  %-12s %9.1f ms\n' % (phase, seconds*1000)
+        out += 'top %d of %d type(s):\n' % (min(count, len(self.types)), len(self.types))
+        out += '  %-40s %9s' % ('type', 'total ms') + ''.join(' %8s' % (p) for p in phases)
+        out += ' %9s %7s\n' % ('bytes', 'fields')
+        for p in self.top_types(count):
+            out += '  %-40s %9.1f' % (p.name, p.total_seconds()*1000)
+            out += ''.join(' %8.1f' % (p.seconds.get(phase, 0)*1000) for phase in phases)
+            out += ' %9d %7d\n' % (p.total_bytes(), p.fields)
+        return out
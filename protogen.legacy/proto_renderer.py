@@ -2,7 +2,7 @@ from collections import defaultdict
 import sys
 import traceback
 
-from abstract_renderer import AbstractRenderer
+from abstract_renderer import AbstractRenderer, Fragments
 
 
 class Context:
@@ -207,7 +207,7 @@ class ProtoRenderer(AbstractRenderer):
         tname = xml.get('type-name')
         if tname == None:
             if len(xml):
-                return self.render_field(xml[0], ctx)
+                return self.emit_field(xml[0], ctx)
             else:
                 return self.ident(xml) + '/* ignored pointer to unknown type */\n'
         if self.is_primitive_type(tname):
@@ -218,7 +218,7 @@ class ProtoRenderer(AbstractRenderer):
             if k == tname:
                 key = '_'+v
                 return self._render_line(xml, 'int32', ctx.set_name(ctx.name+key))
-        return self.render_field(xml[0], ctx)
+        return self.emit_field(xml[0], ctx)
 
     def render_field_container(self, xml, ctx):
         if not ctx.name:
@@ -263,7 +263,7 @@ class ProtoRenderer(AbstractRenderer):
             tname = self._convert_tname(tname)
             return self._render_line(xml, tname, ctx.set_keyword('repeated'))
         elif len(xml):
-            return self.render_field(xml[0], ctx.set_keyword('repeated'))
+            return self.emit_field(xml[0], ctx.set_keyword('repeated'))
         # container of unknown type
         return '  /* ignored container %s */\n' % (ctx.name)
         
@@ -285,7 +285,7 @@ class ProtoRenderer(AbstractRenderer):
         return out
 
     def _render_struct_field(self, item, value, ctx):
-        field = self.render_field(item, Context(value, ident=ctx.ident))
+        field = self.emit_field(item, Context(value, ident=ctx.ident))
         if item.get('is-union'):
             value += len(item)
         else:
@@ -331,8 +331,8 @@ class ProtoRenderer(AbstractRenderer):
     # unions
 
     def render_field_union(self, xml, tname, value=1):
-        fields = ''
-        predecl = []
+        fields = Fragments()
+        predecl = Fragments()
         for item in xml.findall(f'{self.ns}field'):
             ctx = Context(value, keyword='')
             meta = item.get(f'{self.ns}meta')
@@ -343,9 +343,7 @@ class ProtoRenderer(AbstractRenderer):
             else:
                 fields += self.render_field_simple(item, ctx)
             value += 1
-        out = ''
-        for decl in predecl:
-            out += decl
+        out = predecl
         out += self.ident(xml) + 'oneof ' + tname + ' {\n'
         out += fields
         out += self.ident(xml) + '}\n'
@@ -354,15 +352,18 @@ class ProtoRenderer(AbstractRenderer):
 
     # main renderer
 
-    def render_field(self, xml, ctx=None):
+    def emit_field(self, xml, ctx=None):
         if not ctx:
             ctx = Context()
-        field = self.render_field_impl(xml, ctx)
-        if len(field) and not field.rstrip().endswith('*/') and xml.get('comment'):
+        field = Fragments(self.render_field_impl(xml, ctx))
+        if field and not field.last().endswith('*/') and xml.get('comment'):
             comment = self.ident(xml) + self.append_comment(xml)
-            return self.ident(xml, ctx.ident) + '%s%s' % (comment, field)
+            return Fragments(self.ident(xml, ctx.ident), comment, field)
         return field
 
+    def render_field(self, xml, ctx=None):
+        return str(self.emit_field(xml, ctx))
+
     def render_type(self, xml):
         if self.proto_ns:
             out = 'package ' + self.proto_ns + ';\n'
@@ -370,4 +371,4 @@ class ProtoRenderer(AbstractRenderer):
             out = ''
         if xml.get('comment'):
             out = self.append_comment(xml, out)
-        return out + self.render_type_impl(xml)
+        return str(out + self.render_type_impl(xml))
@@ -10,9 +10,14 @@ import argparse
 import re
 import os
 import glob
+import json
+import hashlib
+import multiprocessing
 from lxml import etree
 
-from global_type_renderer import GlobalTypeRenderer
+from exception_rules import ExceptionRules, ResolvedExceptions
+from global_type_renderer import GlobalTypeRenderer, write_if_changed
+from profiler import Profile, ProfileReport
 
 COLOR_OKBLUE = '\033[94m'
 COLOR_FAIL = '\033[91m'
@@ -32,12 +37,170 @@ def luaToCpp(string):
     string = string.replace('world_data.', 'world_data->')
     return string
 
+def transforms_digest(fnames):
+    # hash of the transforms, part of the key of cached lowered trees
+    h = hashlib.sha256()
+    for fname in fnames:
+        with open(fname, 'rb') as fil:
+            h.update(hashlib.sha256(fil.read()).digest())
+    return h.digest()
+
+def lower_xml(fname, transforms, digest, cache_dir=None, profile=None):
+    # apply transforms to xml file, or reload the result from the cache
+    # return (lowered tree, True if found in cache)
+    profile = profile or Profile(fname)
+    if cache_dir:
+        h = hashlib.sha256(digest)
+        with open(fname, 'rb') as fil:
+            h.update(fil.read())
+        cached = os.path.join(cache_dir, h.hexdigest() + '.xml')
+        if os.path.exists(cached):
+            with profile.phase('parse'):
+                return etree.parse(cached), True
+    with profile.phase('parse'):
+        xml = etree.parse(fname)
+    with profile.phase('transform'):
+        for t in transforms:
+            xml = t(xml)
+    if cache_dir:
+        tmp = '%s.%d.tmp' % (cached, os.getpid())
+        xml.write(tmp)
+        os.replace(tmp, cached)
+    return xml, False
+
+def load_registry(fname):
+    # registry of global types, shared with the scripts of protogen/
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protogen'))
+    from registry import Registry
+    return Registry.load(fname)
+
+def render_methods(instance_vectors):
+    # macros declaring RPC methods
+    out = ''
+    for v in instance_vectors:
+        out += """
+#ifndef DFPROTO_INCLUDED
+#include "%s.h"
+#endif
+METHOD_GET_LIST(%s, %s, %s)
+                    """ % ( v[0], snakeToCamelCase(v[0]),
+                            v[0], luaToCpp(v[1])
+                    )
+    return out
+
+def render_grpc(instance_vectors):
+    # proto types for remote procedures
+    out = ''
+    for v in instance_vectors:
+        out += """
+import "%s.proto";
+message %sList {
+    repeated dfproto.%s list = 1;
+}
+                    """ % (v[0], snakeToCamelCase(v[0]), v[0])
+    return out
+
+def output_path(args, fname):
+    # generated file of a type, in the output directory of its kind
+    outdir = {'.proto': args.proto_out, '.cpp': args.cpp_out, '.h': args.h_out}[os.path.splitext(fname)[1]]
+    return os.path.join(outdir, fname)
+
+def read_manifest(fname):
+    try:
+        with open(fname) as fil:
+            return json.load(fil)
+    except (OSError, ValueError):
+        return None
+
+def depfile_path(path):
+    # path escaped for make and ninja depfiles
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+def render_depfile(rules):
+    # one rule per structure file: generated files, then files they were generated from
+    out = ''
+    for outputs, inputs in rules:
+        out += ' \\\n'.join(depfile_path(f) for f in outputs) + ':'
+        out += ''.join(' \\\n  ' + depfile_path(f) for f in inputs) + '\n'
+    return out
+
+def render_type(item, ns, args, rules, resolved, fname=None):
+    # render one global type to files, unless its manifest is unchanged (--manifest_out)
+    # return (name, instance vector, files, updated files, profile, error)
+    tname = item.get('type-name') or item.get('name')
+    profile = None
+    if args.profile:
+        profile = Profile(tname, fname, sum(1 for _ in item.iter('{%s}field' % (ns))))
+    try:
+        rdr = GlobalTypeRenderer(item, ns)
+        if profile:
+            rdr.set_profile(profile)
+        rdr.set_proto_version(args.version)
+        if args.debug:
+            rdr.set_comment_ignored(True)
+        rdr.set_exception_rules(rules).set_resolved_exceptions(resolved)
+        if args.manifest_out:
+            manifest = rdr.manifest()
+            mfile = os.path.join(args.manifest_out, rdr.get_type_name() + '.manifest')
+            previous = read_manifest(mfile)
+            if previous and dict(previous, outputs=None) == dict(manifest, outputs=None) \
+               and all(os.path.exists(output_path(args, f)) for f in previous['outputs'] or []):
+                return rdr.get_type_name(), rdr.get_instance_vector(), previous['outputs'], [], profile, None
+        fnames = rdr.render_to_files(args.proto_out, args.cpp_out, args.h_out)
+        if args.manifest_out:
+            # the manifest is only rewritten if the type changed, as a stamp of its generated files
+            manifest['outputs'] = list(fnames) if fnames else None
+            write_if_changed(mfile, json.dumps(manifest, indent=1) + '\n')
+        return rdr.get_type_name(), rdr.get_instance_vector(), fnames, rdr.updated, profile, None
+    except Exception as e:
+        error = 'error rendering type %s at line %d: %s\n' % (tname, item.sourceline if item.sourceline else 0, e)
+        return tname, None, None, [], profile, error + traceback.format_exc()
+
+
+# state of worker processes (--jobs), shared by all input files
+_worker = {}
+
+def _init_worker(args, rules):
+    _worker['args'] = args
+    _worker['rules'] = rules
+    _worker['path'] = None
+
+def _render_worker(task):
+    # task: (lowered xml file, structure file, index of the type in the document),
+    # each worker parses a lowered file once, for the first of its types it renders
+    path, fname, index = task
+    if _worker['path'] != path:
+        root = etree.parse(path).getroot()
+        ns = re.match(r'{(.*)}', root.tag).group(1)
+        _worker['rules'].compile(ns)
+        _worker.update(path=path, root=root, ns=ns, resolved=ResolvedExceptions())
+    return render_type(_worker['root'][index], _worker['ns'], _worker['args'],
+                       _worker['rules'], _worker['resolved'], fname)
+
+
+def write_xml_procedures(f, xml_vectors, args):
+    # per-xml macros and procedures, return their file names
+    fname = os.path.basename(f)
+    outputs = []
+    if args.methods_out:
+        methods = os.path.join(args.methods_out, fname + '.inc')
+        if write_if_changed(methods, render_methods(xml_vectors)) and not args.quiet:
+            sys.stdout.write('created %s\n' % (methods))
+        outputs.append(methods)
+    if args.grpc_out:
+        grpc = os.path.join(args.grpc_out, fname + '.rpc.proto')
+        if write_if_changed(grpc, render_grpc(xml_vectors)) and not args.quiet:
+            sys.stdout.write('created %s\n' % (grpc))
+        outputs.append(grpc)
+    return outputs
+
 def main():
     
     # parse args
-    parser = argparse.ArgumentParser(description='Generate protobuf and conversion code from dfhack structures.')
-    parser.add_argument('input', metavar='DIR|FILE', type=str,
-                        help='input directory or xml file (default=.)')
+    parser = argparse.ArgumentParser(description='Generate protobuf and conversion code from dfhack structures.',
+                                     fromfile_prefix_chars='@')
+    parser.add_argument('inputs', metavar='DIR|FILE', type=str, nargs='+',
+                        help='input directories or xml files, or @MANIFEST listing them')
     parser.add_argument('--proto_out', metavar='PROTODIR', type=str,
                         default='./protogen',
                         help='output directory for protobuf files (default=./protogen)')
@@ -53,6 +216,12 @@ def main():
     parser.add_argument('--grpc', metavar='FILE', type=str,
                         default='./protogen/grpc.proto',
                         help='generate protobuf procedures for querying instances (default=./protogen/grpc.proto)')
+    parser.add_argument('--methods_out', metavar='DIR', type=str,
+                        default=None,
+                        help='also generate one macro file DIR/<xml>.inc per input xml (default=<none>)')
+    parser.add_argument('--grpc_out', metavar='DIR', type=str,
+                        default=None,
+                        help='also generate one procedures file DIR/<xml>.rpc.proto per input xml (default=<none>)')
     parser.add_argument('--version', '-v', metavar='2|3', type=int,
                         default='2', help='protobuf version (default=2)')
     parser.add_argument('--quiet', '-q', action='store_true',
@@ -65,33 +234,84 @@ def main():
     parser.add_argument('--transform', metavar='XSLT', type=str, action='append',
                         default=[],
                         help='apply this transform before processing xml (default=<none>)')
+    parser.add_argument('--cache', metavar='CACHEDIR', type=str,
+                        default=None,
+                        help='cache transformed xml in this directory (default=<none>)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        default=1, help='render types with N worker processes (default=1)')
+    parser.add_argument('--profile', metavar='FILE', type=str,
+                        default=None,
+                        help='write timings and output sizes per phase and type to json FILE (default=<none>)')
+    parser.add_argument('--profile_top', metavar='N', type=int,
+                        default=20, help='show the N most expensive types with --profile (default=20)')
+    parser.add_argument('--registry', metavar='FILE', type=str,
+                        default=None,
+                        help='registry of global types (protogen/registry.py), structure files '
+                        'without exported type are not parsed (default=<none>)')
+    parser.add_argument('--manifest_out', metavar='DIR', type=str,
+                        default=None,
+                        help='write the inputs of each type to DIR/<type>.manifest, types with '
+                        'an unchanged manifest are not rendered again (default=<none>)')
+    parser.add_argument('--depfile', metavar='FILE', type=str,
+                        default=None,
+                        help='write generated files and their inputs to a make/ninja depfile (default=<none>)')
+    parser.add_argument('--depfile_target', metavar='FILE', type=str,
+                        default=None,
+                        help='write a single rule for FILE in the depfile, e.g. a stamp file '
+                        '(default: one rule per structure file)')
     args = parser.parse_args()
 
-    # input dir
-    indir = args.input
-    assert os.path.exists(indir)
-    if os.path.isdir(indir) and not indir.endswith('/'):
-        indir += '/'
+    # input files
+    inputs = []
+    for indir in args.inputs:
+        assert os.path.exists(indir), indir
+        if os.path.isdir(indir):
+            inputs.extend(sorted(glob.glob(os.path.join(indir, 'df.*.xml'))))
+        else:
+            inputs.append(indir)
     
     # output dir
-    for outdir in [args.proto_out, args.cpp_out, args.h_out]:
-        if not os.path.exists(outdir):
-            os.mkdir(outdir)
+    for outdir in [args.proto_out, args.cpp_out, args.h_out, args.methods_out, args.grpc_out, args.cache, args.manifest_out]:
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
             if not args.quiet:
                 sys.stdout.write('created %s\n' % (outdir))
 
-    # collect types
+    # collect types (transforms are compiled once for all inputs)
     transforms = [
         etree.XSLT(etree.parse(f)) for f in args.transform
     ]
     if transforms and not args.quiet:
         sys.stdout.write(COLOR_OKBLUE + 'using %s\n' % (', '.join(args.transform)) + COLOR_ENDC)
+    digest = transforms_digest(args.transform)
+    # exceptions are parsed once and shared by all types
+    rules = ExceptionRules()
+    if args.exceptions:
+        rules = ExceptionRules.from_file(args.exceptions)
+    # structure files without exported type, per the registry
+    skipped = []
+    if args.registry:
+        registry = load_registry(args.registry)
+        skipped = [f for f in inputs if registry.is_current(f) and not registry.exported(f)]
+        inputs = [f for f in inputs if f not in skipped]
+    # (generated files, inputs) of each structure file, for --depfile
+    depends = list(args.transform)
+    if args.exceptions:
+        depends.append(args.exceptions)
+    dep_rules = []
+    for f in skipped:
+        if not args.quiet:
+            sys.stdout.write('skipped %s, no exported type\n' % (f))
+        dep_rules.append((write_xml_procedures(f, [], args), [f]))
+    cache_hits = 0
+    cache_misses = 0
     instance_vectors = []
-    filt = indir
-    if os.path.isdir(indir):
-        filt = indir+'df.*.xml'
+    report = ProfileReport()
     rc = 0
-    for f in glob.glob(filt):
+    pool = None
+    count_files = 0
+    count_updated = 0
+    for f in inputs:
         if not args.quiet:
             sys.stdout.write(COLOR_OKBLUE + 'processing %s...\n' % (f) + COLOR_ENDC)
 
@@ -100,39 +320,64 @@ def main():
         outxml = open(args.proto_out+'/df.%s.out.xml' % (struct_name), 'wb')
         assert struct_name, outxml
         
-        xml = etree.parse(f)
-        for t in transforms:
-            xml = t(xml)
+        profile = Profile(os.path.basename(f), f)
+        xml, cached = lower_xml(f, transforms, digest, args.cache, profile)
+        report.add_file(profile)
+        if cached:
+            cache_hits += 1
+            if not args.quiet and args.debug:
+                sys.stdout.write('reloaded transformed %s from cache\n' % (f))
+        elif args.cache:
+            cache_misses += 1
         ns = re.match(r'{(.*)}', xml.getroot().tag).group(1)
-        xml.write(outxml)
-        for item in xml.getroot():
-            try:
-                export = item.get('export')
-                if export!='true' or 'global-type' not in item.tag:
-                    if not args.quiet and args.debug:
-                        sys.stdout.write('skipped type '+item.get('type-name') + '\n')
-                    continue
-                rdr = GlobalTypeRenderer(item, ns)
-                rdr.set_proto_version(args.version)
-                if args.debug:
-                    rdr.set_comment_ignored(True)
-                if args.exceptions:
-                    rdr.set_exceptions_file(args.exceptions)
-                fnames = rdr.render_to_files(args.proto_out, args.cpp_out, args.h_out)
-                vector = rdr.get_instance_vector()
-                if vector:
-                    instance_vectors.append((rdr.get_type_name(), vector))
-                if not args.quiet:
-                    if fnames:
-                        sys.stdout.write('created %s\n' % (', '.join(fnames)))
-                    else:
-                        sys.stdout.write('ignored type %s\n' % (rdr.get_type_name()))
-            except Exception as e:
-                _,_,tb = sys.exc_info()
-                sys.stderr.write(COLOR_FAIL + 'error rendering type %s at line %d: %s\n' % (rdr.get_type_name(), item.sourceline if item.sourceline else 0, e) + COLOR_ENDC)
-                traceback.print_tb(tb)
+        with profile.phase('write'):
+            xml.write(outxml)
+        # global types to render
+        xml_vectors = []
+        items = []
+        for index, item in enumerate(xml.getroot()):
+            export = item.get('export')
+            if export!='true' or 'global-type' not in item.tag:
+                if not args.quiet and args.debug:
+                    sys.stdout.write('skipped type '+str(item.get('type-name')) + '\n')
+                continue
+            items.append((index, item))
+        if args.jobs > 1 and len(items) > 1:
+            # render types in worker processes, started once for all input files,
+            # each worker reads the lowered tree from the file written above
+            if pool is None:
+                pool = multiprocessing.Pool(args.jobs, _init_worker, (args, rules))
+            outxml.flush()
+            results = pool.map(_render_worker, [(outxml.name, f, index) for index, _ in items])
+        else:
+            # exceptions are resolved once for all types of the document
+            rules.compile(ns)
+            resolved = ResolvedExceptions()
+            results = (render_type(item, ns, args, rules, resolved, f) for _, item in items)
+        # gather results in document order
+        outputs = []
+        for tname, vector, fnames, updated, profile, error in results:
+            if profile:
+                report.add_type(profile)
+            if error:
+                msg, _, trace = error.partition('\n')
+                sys.stderr.write(COLOR_FAIL + msg + COLOR_ENDC + '\n' + trace)
                 rc = 1
                 break
+            if vector:
+                xml_vectors.append((tname, vector))
+            count_files += len(fnames or [])
+            outputs.extend(output_path(args, f) for f in fnames or [])
+            if args.manifest_out:
+                outputs.append(os.path.join(args.manifest_out, tname + '.manifest'))
+            count_updated += len(updated)
+            if not args.quiet:
+                if updated:
+                    sys.stdout.write('created %s\n' % (', '.join(updated)))
+                elif fnames:
+                    sys.stdout.write('unchanged %s\n' % (', '.join(fnames)))
+                else:
+                    sys.stdout.write('ignored type %s\n' % (tname))
 
         outxml.close()
         if not args.quiet:
@@ -140,35 +385,49 @@ def main():
         if rc:
             break
 
-        # macros declaring RPC methods
-        if args.methods:
-            with open(args.methods, 'w') as fp:
-                for v in instance_vectors:
-                    fp.write("""
-#ifndef DFPROTO_INCLUDED
-#include "%s.h"
-#endif
-METHOD_GET_LIST(%s, %s, %s)
-                    """ % ( v[0], snakeToCamelCase(v[0]),
-                            v[0], luaToCpp(v[1])
-                    ))
-            if not args.quiet:
-                sys.stdout.write('created %s\n' % (args.methods))
+        instance_vectors.extend(xml_vectors)
+        outputs.extend(write_xml_procedures(f, xml_vectors, args))
+        dep_rules.append((outputs, [f]))
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    # macros declaring RPC methods
+    if args.methods and not rc:
+        if write_if_changed(args.methods, render_methods(instance_vectors)) and not args.quiet:
+            sys.stdout.write('created %s\n' % (args.methods))
 
-        # proto types for remote procedures
+    # proto types for remote procedures
+    if args.grpc and not rc:
+        if write_if_changed(args.grpc, render_grpc(instance_vectors)) and not args.quiet:
+            sys.stdout.write('created %s\n' % (args.grpc))
+
+    # generated files depend on the structure files, the transforms, the exceptions
+    # file and the modules of protogen that were actually loaded
+    if args.depfile and not rc:
+        here = os.path.dirname(os.path.abspath(__file__))
+        depends += sorted(set(os.path.abspath(m.__file__) for m in list(sys.modules.values())
+                              if getattr(m, '__file__', None) and os.path.dirname(os.path.abspath(m.__file__)) == here))
+        inputs = [f for _, fnames in dep_rules for f in fnames]
+        if args.methods:
+            dep_rules.append(([args.methods], inputs))
         if args.grpc:
-            with open(args.grpc, 'w') as fp:
-                for v in instance_vectors:
-                    fp.write("""
-import "%s.proto";
-message %sList {
-    repeated dfproto.%s list = 1;
-}
-                    """ % (v[0], snakeToCamelCase(v[0]), v[0])
-                    )
-            if not args.quiet:
-                sys.stdout.write('created %s\n' % (args.grpc))
-        
+            dep_rules.append(([args.grpc], inputs))
+        dep_rules = [(o, i + depends) for o, i in dep_rules if o]
+        if args.depfile_target:
+            dep_rules = [([args.depfile_target], sorted(set(f for _, fnames in dep_rules for f in fnames)))]
+        write_if_changed(args.depfile, render_depfile(dep_rules))
+
+    if args.cache and not args.quiet:
+        sys.stdout.write('transform cache: %d hit(s), %d miss(es)\n' % (cache_hits, cache_misses))
+    if not args.quiet:
+        sys.stdout.write('%d of %d generated file(s) updated\n' % (count_updated, count_files))
+    if args.profile:
+        report.write(args.profile)
+        if not args.quiet:
+            sys.stdout.write(report.summary(args.profile_top))
+            sys.stdout.write('created %s\n' % (args.profile))
     sys.exit(rc)
 
 
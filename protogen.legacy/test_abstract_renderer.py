@@ -0,0 +1,52 @@
+#!/bin/python3
+
+import io
+import unittest
+
+from abstract_renderer import Fragments
+
+
+class TestFragments(unittest.TestCase):
+
+    def test_operators(self):
+        out = Fragments('a')
+        out += 'b'
+        out += Fragments('c', Fragments('d'))
+        self.assertEqual(str(out), 'abcd')
+        self.assertEqual(str(out + 'e'), 'abcde')
+        self.assertEqual(str('z' + out), 'zabcd')
+        # operands are referenced, not copied
+        inner = Fragments('x')
+        outer = 'w' + inner + 'y'
+        inner += 'x'
+        self.assertEqual(str(outer), 'wxxy')
+
+    def test_same_as_str(self):
+        # same code as concatenated strings
+        parts = ['message t {\n', '  ', 'required int32 a = 1;\n', '', '}\n']
+        text = ''
+        out = Fragments()
+        for part in parts:
+            text += part
+            out += part
+        self.assertEqual(str(out), text)
+        self.assertEqual(str(Fragments() + text), text)
+        stream = io.StringIO()
+        out.write(stream)
+        self.assertEqual(stream.getvalue(), text)
+
+    def test_bool(self):
+        self.assertFalse(Fragments())
+        self.assertFalse(Fragments('', Fragments('')))
+        self.assertTrue(Fragments('', Fragments(' ')))
+
+    def test_first_last(self):
+        out = Fragments('  ', Fragments('', '\n  int32 a;'), ' b  ', Fragments(Fragments('\n'), ' '))
+        self.assertEqual(out.first(), 'int32 a;')
+        self.assertEqual(out.last(), ' b')
+        self.assertEqual(Fragments(' ').first(), '')
+        self.assertEqual(Fragments().last(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/bin/python3
+
+import unittest
+from lxml import etree
+
+from exception_rules import ExceptionRules, ResolvedExceptions
+from global_type_renderer import GlobalTypeRenderer
+
+
+class TestExceptionRules(unittest.TestCase):
+
+    def setUp(self):
+        self.XML = """
+        <ld:data-definition xmlns:ld="ns">
+        <ld:global-type ld:meta="struct-type" ld:level="0" type-name="type_a">
+          <ld:field name="squad_size" ld:level="1" ld:meta="number" ld:subtype="int16_t" ld:bits="16"/>
+          <ld:field name="civ" ld:level="1" ld:meta="number" ld:subtype="int32_t" ld:bits="32"/>
+        </ld:global-type>
+        <ld:global-type ld:meta="struct-type" ld:level="0" type-name="type_b">
+          <ld:field name="civ" ld:level="1" ld:meta="number" ld:subtype="int32_t" ld:bits="32"/>
+        </ld:global-type>
+        </ld:data-definition>
+        """
+        self.EXCEPTIONS = """
+        # comment
+        rename ld:global-type[@type-name="type_a"]/ld:field[@name="squad_size"] squad_sz
+        ignore ld:global-type/ld:field[@name="civ"]
+        index historical_figure id
+        enum interaction_effect_location_hint
+        depends coord2d coord
+        """
+        self.sut = ExceptionRules.parse(self.EXCEPTIONS.splitlines())
+        self.root = etree.fromstring(self.XML)
+
+    def test_parse(self):
+        self.assertEqual(self.sut.rename, (('ld:global-type[@type-name="type_a"]/ld:field[@name="squad_size"]', 'squad_sz'),))
+        self.assertEqual(self.sut.ignore, ('ld:global-type/ld:field[@name="civ"]',))
+        self.assertEqual(self.sut.index, (('historical_figure', 'id'),))
+        self.assertEqual(self.sut.enum, ('interaction_effect_location_hint',))
+        self.assertEqual(self.sut.depends, (('coord2d', 'coord'),))
+
+    def test_resolve(self):
+        resolved = ResolvedExceptions().resolve(self.root[0], 'ns', self.sut.ignore, self.sut.rename)
+        self.assertTrue(resolved.is_ignored(self.root[0][1]))
+        self.assertTrue(resolved.is_ignored(self.root[1][0]))
+        self.assertFalse(resolved.is_ignored(self.root[0][0]))
+        self.assertEqual(resolved.get_rename(self.root[0][0]), 'squad_sz')
+        self.assertIsNone(resolved.get_rename(self.root[1][0]))
+
+    def test_shared_by_types(self):
+        resolved = ResolvedExceptions()
+        outputs = []
+        for item in self.root:
+            rdr = GlobalTypeRenderer(item, 'ns').set_exception_rules(self.sut).set_ignore_no_export(False)
+            rdr.set_resolved_exceptions(resolved)
+            outputs.append(rdr.render_proto())
+        # rules are resolved only once for both types
+        ignored = resolved.ignored
+        self.assertIs(resolved.resolve(self.root[1], 'ns', self.sut.ignore, self.sut.rename).ignored, ignored)
+        self.assertIn('squad_sz', outputs[0])
+        self.assertNotIn('civ', outputs[0])
+        self.assertNotIn('civ', outputs[1])
+
+    def test_matched_rules(self):
+        resolved = ResolvedExceptions().resolve(self.root[0], 'ns', self.sut.ignore, self.sut.rename)
+        self.assertEqual(resolved.matched_rules(self.root[0], self.sut), [
+            'ignore ld:global-type/ld:field[@name="civ"]',
+            'rename ld:global-type[@type-name="type_a"]/ld:field[@name="squad_size"] squad_sz',
+        ])
+        self.assertEqual(resolved.matched_rules(self.root[1], self.sut), [
+            'ignore ld:global-type/ld:field[@name="civ"]',
+        ])
+        # rules of referenced types and hidden dependencies
+        self.root[1][0].set('type-name', 'historical_figure')
+        self.root[1].set('type-name', 'coord2d')
+        self.assertEqual(resolved.matched_rules(self.root[1], self.sut), [
+            'ignore ld:global-type/ld:field[@name="civ"]',
+            'index historical_figure id',
+            'depends coord2d coord',
+        ])
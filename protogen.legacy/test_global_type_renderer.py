@@ -5,6 +5,7 @@ import os
 from lxml import etree
 
 from global_type_renderer import GlobalTypeRenderer
+from profiler import Profile
 
 
 class TestGlobalTypeRenderer(unittest.TestCase):
@@ -142,3 +143,35 @@ class TestGlobalTypeRenderer(unittest.TestCase):
         sut = GlobalTypeRenderer(root[0], 'ns')
         sut.set_exceptions_file(self.delete_me[0])
         self.assertFalse(sut.render_to_files('./', './', './'))
+
+    def test_render_to_files_unchanged(self):
+        fnames = self.sut.render_to_files('./', './', './')
+        self.delete_me.extend(fnames)
+        self.assertEqual(self.sut.updated, list(fnames))
+        mtimes = [os.stat(f).st_mtime_ns for f in fnames]
+        # same content: files are not rewritten
+        self.assertEqual(self.sut.render_to_files('./', './', './'), fnames)
+        self.assertEqual(self.sut.updated, [])
+        self.assertEqual([os.stat(f).st_mtime_ns for f in fnames], mtimes)
+
+    def test_manifest(self):
+        manifest = self.sut.manifest()
+        self.assertEqual(manifest['type'], 'history_event_reason_info')
+        self.assertEqual(manifest['exceptions'], [
+            'ignore /ld:data-definition/ld:global-type/ld:field[@name="ignore_me"]',
+            'rename /ld:data-definition/ld:global-type/ld:field/ld:field[@name="glorify_hf"] glorify_hfid',
+        ])
+        self.assertEqual(self.sut.manifest(), manifest)
+        # changed by the subtree of the type and by options
+        self.sut.xml[2].set('name', 'renamed')
+        changed = self.sut.manifest()
+        self.assertNotEqual(changed['xml'], manifest['xml'])
+        self.assertNotEqual(self.sut.set_proto_version(3).manifest()['options'], manifest['options'])
+
+    def test_render_to_files_profile(self):
+        profile = Profile('reasons')
+        fnames = self.sut.set_profile(profile).render_to_files('./', './', './')
+        self.delete_me.extend(fnames)
+        self.assertEqual(set(profile.seconds), {'exceptions', 'proto', 'cpp', 'h', 'write'})
+        for phase, fname in zip(['proto', 'cpp', 'h'], fnames):
+            self.assertEqual(profile.bytes[phase], os.stat(fname).st_size)
@@ -0,0 +1,125 @@
+#!/bin/python3
+
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+from lxml import etree
+
+from protogen import lower_xml, transforms_digest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestProtogen(unittest.TestCase):
+
+    # already lowered structure file: no transform is needed
+    XML = """<ld:data-definition xmlns:ld="ns">
+    <ld:global-type ld:meta="struct-type" ld:level="0" type-name="first_type" export="true">
+      <ld:field name="id" ld:level="1" ld:meta="number" ld:subtype="int32_t" ld:bits="32" export="true"/>
+    </ld:global-type>
+    <ld:global-type ld:meta="struct-type" ld:level="0" type-name="second_type" export="true" instance-vector="$global.world.seconds">
+      <ld:field name="name" ld:level="1" ld:meta="primitive" ld:subtype="stl-string" export="true"/>
+      <ld:field name="count" ld:level="1" ld:meta="number" ld:subtype="int16_t" ld:bits="16" export="true"/>
+    </ld:global-type>
+    <ld:global-type ld:meta="struct-type" ld:level="0" type-name="hidden_type">
+      <ld:field name="id" ld:level="1" ld:meta="number" ld:subtype="int32_t" ld:bits="32"/>
+    </ld:global-type>
+</ld:data-definition>
+"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, 'df.test.xml')
+        with open(self.fname, 'w') as fil:
+            fil.write(self.XML)
+        self.inputs = [self.fname]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def protogen(self, outdir, *options):
+        # run protogen.py, return {relative path: content} of the generated files
+        outdir = os.path.join(self.tmp.name, outdir)
+        subprocess.run([sys.executable, os.path.join(HERE, 'protogen.py')] + self.inputs + [
+                        '--proto_out', outdir, '--cpp_out', outdir, '--h_out', outdir,
+                        '--methods', os.path.join(outdir, 'methods.inc'),
+                        '--grpc', os.path.join(outdir, 'grpc.proto'), '-q'] + list(options),
+                       check=True, capture_output=True, text=True)
+        files = {}
+        for fname in sorted(os.listdir(outdir)):
+            with open(os.path.join(outdir, fname)) as fil:
+                files[fname] = fil.read()
+        return files
+
+    def test_jobs(self):
+        # worker processes generate the same files as a single process
+        serial = self.protogen('serial', '--jobs', '1')
+        self.assertIn('first_type.proto', serial)
+        self.assertIn('second_type.cpp', serial)
+        self.assertNotIn('hidden_type.proto', serial)
+        self.assertIn('second_type', serial['methods.inc'])
+        self.assertDictEqual(self.protogen('parallel', '--jobs', '2'), serial)
+        # several structure files rendered by the same workers
+        other = os.path.join(self.tmp.name, 'df.other.xml')
+        with open(other, 'w') as fil:
+            fil.write(self.XML.replace('first_type', 'third_type').replace('second_type', 'fourth_type'))
+        self.inputs.append(other)
+        serial = self.protogen('serial2', '--jobs', '1')
+        self.assertIn('first_type.proto', serial)
+        self.assertIn('fourth_type.cpp', serial)
+        self.assertIn('fourth_type', serial['methods.inc'])
+        self.assertDictEqual(self.protogen('parallel2', '--jobs', '2'), serial)
+
+    def test_lower_xml_cache(self):
+        cache = os.path.join(self.tmp.name, 'cache')
+        os.makedirs(cache)
+        xslt = os.path.join(self.tmp.name, 'rename.xslt')
+        def transform(name):
+            # transform renaming the first type
+            with open(xslt, 'w') as fil:
+                fil.write('<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">'
+                          '<xsl:template match="@*|node()"><xsl:copy><xsl:apply-templates select="@*|node()"/></xsl:copy></xsl:template>'
+                          '<xsl:template match="@type-name[.=\'first_type\']"><xsl:attribute name="type-name">%s</xsl:attribute></xsl:template>'
+                          '</xsl:stylesheet>' % (name))
+            return [etree.XSLT(etree.parse(xslt))], transforms_digest([xslt])
+        transforms, digest = transform('renamed')
+        xml, cached = lower_xml(self.fname, transforms, digest, cache)
+        self.assertFalse(cached)
+        self.assertEqual(xml.getroot()[0].get('type-name'), 'renamed')
+        # same tree from the cache
+        hit, cached = lower_xml(self.fname, transforms, digest, cache)
+        self.assertTrue(cached)
+        self.assertEqual(etree.tostring(hit), etree.tostring(xml))
+        # changed transform or changed xml: transformed again
+        transforms, digest = transform('other')
+        xml, cached = lower_xml(self.fname, transforms, digest, cache)
+        self.assertFalse(cached)
+        self.assertEqual(xml.getroot()[0].get('type-name'), 'other')
+        with open(self.fname, 'w') as fil:
+            fil.write(self.XML.replace('second_type', 'new_type'))
+        xml, cached = lower_xml(self.fname, transforms, digest, cache)
+        self.assertFalse(cached)
+        self.assertEqual(xml.getroot()[1].get('type-name'), 'new_type')
+        self.assertEqual(len(os.listdir(cache)), 3)
+
+    def test_depfile_target(self):
+        # a single rule for the stamp file, with all the inputs of generated files
+        depfile = os.path.join(self.tmp.name, 'protogen.d')
+        stamp = os.path.join(self.tmp.name, 'protogen.stamp')
+        self.protogen('out', '--depfile', depfile)
+        with open(depfile) as fil:
+            rules = fil.read()
+        self.assertIn(os.path.join(self.tmp.name, 'out', 'first_type.proto') + ' \\\n', rules)
+        self.protogen('out', '--depfile', depfile, '--depfile_target', stamp)
+        with open(depfile) as fil:
+            target, _, inputs = fil.read().replace('\\\n', ' ').partition(':')
+        self.assertEqual(target, stamp)
+        self.assertNotIn(':', inputs)
+        self.assertIn(self.fname, inputs.split())
+        self.assertIn(os.path.join(HERE, 'protogen.py'), inputs.split())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -607,6 +607,49 @@ class TestRenderType(unittest.TestCase):
         self.sut_proto.add_exception_rename('ld:global-type[@type-name="entity_position_raw"]/ld:field[@name="squad_size"]', 'squad_sz')
         self.check_rendering(XML, PROTO, CPP, IMPORTS, DFPROTO_IMPORTS)
     
+    def test_exceptions_added_after_rendering(self):
+        XML = """
+        <ld:data-definition xmlns:ld="ns">
+        <ld:global-type ld:meta="struct-type" ld:level="0" type-name="mytype">
+          <ld:field name="id" ld:level="1" ld:meta="number" ld:subtype="int16_t" ld:bits="16"/>
+          <ld:field name="skip_me" ld:level="1" ld:meta="number" ld:subtype="int16_t" ld:bits="16"/>
+        </ld:global-type>
+        </ld:data-definition>
+        """
+        xml = etree.fromstring(XML)[0]
+        out = self.sut_proto.render_type(xml)
+        self.assertIn('skip_me', out)
+        self.sut_proto.add_exception_ignore('ld:global-type[@type-name="mytype"]/ld:field[@name="skip_me"]')
+        self.sut_proto.add_exception_rename('ld:global-type[@type-name="mytype"]/ld:field[@name="id"]', 'my_id')
+        out = self.sut_proto.render_type(xml)
+        self.assertStructEqual(out, """
+        message mytype {
+          required int32 my_id = 1;
+          /* ignored field skip_me */
+        }
+        """)
+
+    def test_export_inherited(self):
+        XML = """
+        <ld:data-definition xmlns:ld="ns">
+        <ld:global-type ld:meta="struct-type" ld:level="0" type-name="mytype">
+          <ld:field ld:level="1" ld:meta="compound" name="sub" export="true">
+            <ld:field name="a" ld:level="2" ld:meta="number" ld:subtype="int16_t" ld:bits="16"/>
+            <ld:field name="b" ld:level="2" ld:meta="number" ld:subtype="int16_t" ld:bits="16" export="false"/>
+          </ld:field>
+          <ld:field name="c" ld:level="1" ld:meta="number" ld:subtype="int16_t" ld:bits="16"/>
+        </ld:global-type>
+        </ld:data-definition>
+        """
+        xml = etree.fromstring(XML)[0]
+        before = etree.tostring(xml)
+        out = self.sut_proto.set_ignore_no_export(True).render_type(xml)
+        # sub-elements of the exported field are exported, the tree is unchanged
+        self.assertIn('int32 a = 1;', out)
+        self.assertIn('int32 b = 2;', out)
+        self.assertIn('/* ignored field c */', out)
+        self.assertEqual(etree.tostring(xml), before)
+
     def test_index_field(self):
         XML = """
         <ld:data-definition xmlns:ld="ns">
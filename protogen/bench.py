@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+# Benchmark the code generation pipeline on a synthetic corpus:
+# merge.py, dependencies.py, dag.py, xslt lowering, proto/cpp rendering and file writes.
+# Each stage runs in its own process, to measure its peak memory.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import corpus
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEGACY = os.path.join(HERE, '..', 'protogen.legacy')
+
+
+def run(cmd, stdout=None):
+    # run a command, return (seconds, peak memory in KB, return code, error message)
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=stdout or subprocess.DEVNULL, stderr=err)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            maxrss = usage.ru_maxrss
+        else:
+            proc.wait()
+            maxrss = 0
+        elapsed = time.perf_counter() - start
+        err.seek(0)
+        lines = err.read().decode(errors='replace').strip().splitlines()
+    return elapsed, maxrss, proc.returncode, lines[-1] if lines else ''
+
+
+def run_stage(stage, files, workdir):
+    # run a rendering stage in a child process, return its own timing and peak memory
+    report = os.path.join(workdir, stage + '.json')
+    with open(report, 'w') as out:
+        _, maxrss, rc, error = run([sys.executable, __file__, '--stage', stage, '--workdir', workdir] + files, out)
+    if rc:
+        return None, maxrss, error
+    with open(report) as fil:
+        return json.load(fil), maxrss, None
+
+
+#
+# stages run in child processes
+#
+
+def stage_lower(files, workdir, transforms):
+    from lxml import etree
+    xslts = [etree.XSLT(etree.parse(f)) for f in transforms]
+    start = time.perf_counter()
+    for f in files:
+        xml = etree.parse(f)
+        for t in xslts:
+            xml = t(xml)
+        xml.write(f + '.lowered')
+    return time.perf_counter() - start, len(files)
+
+def stage_render(stage, files, workdir):
+    sys.path.insert(0, LEGACY)
+    from lxml import etree
+    from global_type_renderer import GlobalTypeRenderer, write_if_changed
+    outdir = tempfile.mkdtemp(dir=workdir)
+    elapsed = 0
+    count = 0
+    for f in files:
+        root = etree.parse(f).getroot()
+        ns = root.tag[1:root.tag.index('}')]
+        for item in root:
+            if item.get('export') != 'true' or 'global-type' not in item.tag:
+                continue
+            rdr = GlobalTypeRenderer(item, ns)
+            count += 1
+            start = time.perf_counter()
+            if stage == 'proto':
+                rdr.render_proto()
+            elif stage == 'cpp':
+                rdr.render_cpp()
+                rdr.render_h()
+            else:
+                # only time writes of rendered code
+                outputs = [rdr.render_proto(), rdr.render_cpp(), rdr.render_h()]
+                start = time.perf_counter()
+                for ext, out in zip(['proto', 'cpp', 'h'], outputs):
+                    write_if_changed(os.path.join(outdir, rdr.get_type_name() + '.' + ext), out)
+            elapsed += time.perf_counter() - start
+    return elapsed, count
+
+def run_child(args):
+    if args.stage == 'lower':
+        elapsed, count = stage_lower(args.inputs, args.workdir, args.transform)
+    else:
+        elapsed, count = stage_render(args.stage, args.inputs, args.workdir)
+    json.dump({'seconds': elapsed, 'types': count}, sys.stdout)
+
+
+#
+# pipeline
+#
+
+def bench(args, workdir):
+    results = []
+    def record(stage, seconds, types, maxrss, error=None):
+        results.append({
+            'stage': stage, 'seconds': seconds, 'types': types,
+            'types_per_s': types / seconds if seconds else None,
+            'peak_kb': maxrss, 'error': error
+        })
+        if not args.quiet:
+            if error:
+                sys.stdout.write('%-14s skipped: %s\n' % (stage, error))
+            else:
+                sys.stdout.write('%-14s %9.3f s %10.1f types/s %8.1f MB\n' % (
+                    stage, seconds, results[-1]['types_per_s'] or 0, maxrss / 1024))
+
+    crp = corpus.from_arguments(args)
+    crp.write(workdir)
+    names = crp.files()
+    ntypes = len(crp.types)
+    exported = [t.name for t in crp.types if t.exported]
+    if not args.quiet:
+        sys.stdout.write('corpus: %d types in %d files, %d exported\n' % (ntypes, len(names), len(exported)))
+
+    # merge .export specs
+    merged = []
+    seconds, peak, error = 0, 0, None
+    for name in names:
+        merged.append(os.path.join(workdir, 'df.%s.merged.xml' % (name)))
+        with open(merged[-1], 'w') as out:
+            elapsed, maxrss, rc, msg = run([sys.executable, os.path.join(HERE, 'merge.py'),
+                                            os.path.join(workdir, 'df.%s.xml' % (name)),
+                                            os.path.join(workdir, '%s.export' % (name))], out)
+        seconds += elapsed
+        peak = max(peak, maxrss)
+        if rc:
+            error = msg
+    record('merge', seconds, ntypes, peak, error)
+
+    # dependencies between types, with the lxml parser and the reference ANTLR parser
+    outputs = {}
+    for parser in ['lxml', 'antlr']:
+        outputs[parser] = os.path.join(workdir, 'dependencies.%s' % (parser))
+        with open(outputs[parser], 'w') as out:
+            elapsed, maxrss, rc, msg = run([sys.executable, os.path.join(HERE, 'dependencies.py'),
+                                            '--plain', '--parser', parser] + merged, out)
+        if not rc and parser != 'lxml':
+            with open(outputs['lxml']) as lxml, open(outputs[parser]) as other:
+                if lxml.read() != other.read():
+                    rc, msg = 1, 'output differs from lxml parser'
+        record('dependencies' if parser == 'lxml' else 'deps ' + parser, elapsed, ntypes, maxrss, msg if rc else None)
+
+    # graph queries, as done by cmake
+    dag = os.path.join(workdir, 'df-structures.dag')
+    seconds, peak, error = 0, 0, None
+    for query in [['--ancestors'] + exported, ['--sources'] + exported]:
+        elapsed, maxrss, rc, msg = run([sys.executable, os.path.join(HERE, 'dag.py'), dag, '--plain'] + query)
+        seconds += elapsed
+        peak = max(peak, maxrss)
+        if rc:
+            error = msg
+    record('dag', seconds, len(exported), peak, error)
+
+    # xslt lowering
+    if args.transform:
+        report, maxrss, error = run_stage('lower', merged, workdir)
+        record('lower', report and report['seconds'], ntypes, maxrss, error)
+    else:
+        record('lower', None, ntypes, 0, 'no --transform given')
+
+    # rendering of the lowered corpus
+    lowered = [os.path.join(workdir, 'df.%s.lowered.xml' % (name)) for name in names]
+    for stage in ['proto', 'cpp', 'write']:
+        report, maxrss, error = run_stage(stage, lowered, workdir)
+        record(stage, report and report['seconds'], report and report['types'], maxrss, error)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the code generation pipeline on a synthetic corpus.')
+    corpus.add_arguments(parser)
+    parser.add_argument('--transform', metavar='XSLT', type=str, action='append', default=[],
+                        help='xslt transforms of the lowering stage (default=<none>, stage skipped)')
+    parser.add_argument('--workdir', metavar='DIR', type=str, default=None,
+                        help='keep corpus and outputs in DIR (default=temporary directory)')
+    parser.add_argument('--json', metavar='FILE', type=str, default=None,
+                        help='write results to FILE')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                        help='no output (default: False)')
+    parser.add_argument('--stage', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('inputs', type=str, nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        return run_child(args)
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = bench(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = bench(args, workdir)
+    if args.json:
+        with open(args.json, 'w') as fil:
+            json.dump(results, fil, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+# Compare the graph engine of dag.py with networkx on a large synthetic DAG:
+# import time, loading, queries and memory, and check that results agree.
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import importlib.util
+import subprocess
+import tracemalloc
+
+from graph import Graph
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_dag(fname, nodes, degree, files, seed):
+    # each node depends on earlier nodes and on the file defining it, like df-structures.dag
+    rnd = random.Random(seed)
+    with open(fname, 'w') as fil:
+        for i in range(nodes):
+            deps = {'t%d' % (rnd.randrange(i)) for _ in range(rnd.randint(0, 2 * degree))} if i else set()
+            deps.add('df.f%d.xml' % (i % files))
+            fil.write('t%d %s\n' % (i, ' '.join(sorted(deps))))
+
+def load_networkx(fname):
+    import networkx as nx
+    G = nx.DiGraph()
+    with open(fname) as fil:
+        for line in fil:
+            tokens = line.split()
+            for dep in tokens[1:]:
+                G.add_edge(dep, tokens[0])
+    return G
+
+def queries_networkx(G, targets):
+    import networkx as nx
+    ancestors = set(targets)
+    for t in targets:
+        ancestors.update(nx.ancestors(G, t))
+    nodes = set()
+    for t in targets:
+        nodes.update(nx.ancestors(G, t))
+    sources = {n for n, d in G.in_degree(list(nodes)) if d == 0}
+    sinks = {n for n, d in G.out_degree() if d == 0}
+    successors = set(G.successors('df.f0.xml'))
+    return ancestors, sources, sinks, successors
+
+def queries_graph(G, targets):
+    ancestors = set(targets)
+    for t in targets:
+        ancestors.update(G.ancestors(t))
+    nodes = set()
+    for t in targets:
+        nodes.update(G.ancestors(t))
+    return ancestors, G.sources(nodes), G.sinks(), G.successors('df.f0.xml')
+
+def import_time(module, repeat):
+    # best wall time of a python process importing module
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True, cwd=HERE)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure(load, queries, fname, targets):
+    start = time.perf_counter()
+    G = load(fname)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    result = queries(G, targets)
+    queried = time.perf_counter() - start
+    # memory of the loaded graph, measured apart since tracing slows down loading
+    del G
+    tracemalloc.start()
+    _ = load(fname)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, queried, size, peak, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the graph engine of dag.py with networkx.')
+    parser.add_argument('--nodes', metavar='N', type=int, default=100000,
+                        help='number of nodes (default=100000)')
+    parser.add_argument('--degree', metavar='N', type=int, default=3,
+                        help='average number of dependencies per node (default=3)')
+    parser.add_argument('--files', metavar='N', type=int, default=100,
+                        help='number of structure files (default=100)')
+    parser.add_argument('--queries', metavar='N', type=int, default=20,
+                        help='number of nodes queried (default=20)')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='keep best time of N process startups (default=3)')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='random seed (default=0)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'bench.dag')
+        make_dag(fname, args.nodes, args.degree, args.files, args.seed)
+        rnd = random.Random(args.seed)
+        targets = ['t%d' % (rnd.randrange(args.nodes)) for _ in range(args.queries)]
+
+        # graph parsed from the dag file, or loaded from its binary index
+        index = fname + '.idx'
+        Graph.load([fname], index)
+        engines = [
+            ('graph', 'graph', lambda f: Graph.from_files([f]), queries_graph),
+            ('graph idx', 'graph', lambda f: Graph.load([f], index)[0], queries_graph),
+        ]
+        if importlib.util.find_spec('networkx'):
+            engines.append(('networkx', 'networkx', load_networkx, queries_networkx))
+        else:
+            sys.stdout.write('networkx not installed, comparison skipped\n')
+
+        sys.stdout.write('%d nodes, %d queries\n' % (args.nodes, args.queries))
+        sys.stdout.write('%-10s %10s %10s %10s %10s %10s\n' % ('engine', 'import ms', 'load ms', 'query ms', 'size MB', 'peak MB'))
+        results = []
+        for name, module, load, queries in engines:
+            imported = import_time(module, args.repeat)
+            loaded, queried, size, peak, result = measure(load, queries, fname, targets)
+            results.append(result)
+            sys.stdout.write('%-10s %10.1f %10.1f %10.1f %10.1f %10.1f\n' % (
+                name, imported*1000, loaded*1000, queried*1000, size/1024/1024, peak/1024/1024))
+        if len(results) > 1:
+            sys.stdout.write('results %s\n' % ('agree' if all(r == results[0] for r in results) else 'DIFFER'))
+
+        # startup of dag.py as invoked by cmake
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(HERE, 'dag.py'), fname, '--plain', '--ancestors'] + targets,
+                       check=True, stdout=subprocess.DEVNULL)
+        sys.stdout.write('dag.py --ancestors: %.1f ms\n' % ((time.perf_counter() - start)*1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+# Compare the indexed lookups of merge.py with xpath lookups on a large
+# synthetic structure file and export spec, and check that merged trees agree.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+from lxml import etree
+
+import corpus
+import merge
+
+
+class XPathIndex:
+    """Lookups of merge.py before indexing, one linear scan per export line."""
+
+    def __init__(self, xml):
+        self.xml = xml
+
+    def find_types(self, tname):
+        return self.xml.findall('./*[@type-name="%s"]' % (tname))
+
+    def find_fields(self, xml, fname):
+        return xml.findall('./*[@name="%s"]' % (fname))
+
+    def find_methods(self, xml, method):
+        return xml.findall('./virtual-methods/vmethod[@name="%s"]' % (method))
+
+
+def measure(fname, export, make_index):
+    xml = etree.parse(fname).getroot()
+    with open(export) as fd, open(os.devnull, 'w') as null, contextlib.redirect_stderr(null):
+        start = time.perf_counter()
+        warnings = merge.parse_structure(fd, xml, make_index(xml))
+        elapsed = time.perf_counter() - start
+    return elapsed, warnings, etree.tostring(xml)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare indexed and xpath lookups of merge.py.')
+    corpus.add_arguments(parser)
+    parser.set_defaults(types=5000, files=1, exported=1.0)
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='keep best time of N runs (default=3)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        crp = corpus.from_arguments(args)
+        crp.write(tmp)
+        lines = 0
+        for name in crp.files():
+            with open(os.path.join(tmp, '%s.export' % (name))) as fil:
+                lines += sum(1 for _ in fil)
+        sys.stdout.write('%d types in %d files, %d export lines\n' % (len(crp.types), len(crp.files()), lines))
+        sys.stdout.write('%-10s %10s %10s\n' % ('lookup', 'merge ms', 'warnings'))
+        results = []
+        for name, make_index in [('index', merge.Index), ('xpath', XPathIndex)]:
+            best = 0
+            warnings = 0
+            trees = []
+            for f in crp.files():
+                times = []
+                for _ in range(args.repeat):
+                    elapsed, count, tree = measure(os.path.join(tmp, 'df.%s.xml' % (f)),
+                                                   os.path.join(tmp, '%s.export' % (f)), make_index)
+                    times.append(elapsed)
+                best += min(times)
+                warnings += count
+                trees.append(tree)
+            results.append(trees)
+            sys.stdout.write('%-10s %10.1f %10d\n' % (name, best*1000, warnings))
+        sys.stdout.write('results %s\n' % ('agree' if all(r == results[0] for r in results) else 'DIFFER'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/python3
+
+# Build driver of the code generation pipeline, as a graph of tasks run on
+# a process pool: merge.py of each structure file, graph of dependencies,
+# protogen.py of each structure file defining exported types, then protoc.
+# Tasks whose action and input files are unchanged since their last
+# successful run are skipped.
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import queue
+import hashlib
+import argparse
+import traceback
+import subprocess
+import multiprocessing
+
+import merge
+import registry
+import dependencies
+from dag import query, run_batch, write_if_changed
+from graph import Graph
+from registry import Registry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(HERE, '..'))
+LEGACY = os.path.join(ROOT, 'protogen.legacy')
+
+# part of the key of tasks, increment when tasks change
+BUILD_VERSION = 1
+
+# modules run by merge tasks: merged files and their symbols depend on them
+MERGE_SCRIPTS = [merge.__file__, registry.__file__, dependencies.__file__]
+
+# (path, size, mtime) -> sha256 of content
+_hashes = {}
+
+
+class TaskError(Exception):
+    """Failure of a task, with the output of the failed command."""
+
+
+class Task:
+    """A step of the build, action(*args) run in a worker process after its dependencies."""
+
+    def __init__(self, name, stage, action, args, inputs=(), outputs=(), deps=(), depfile=None):
+        self.name = name
+        self.stage = stage
+        self.action = action
+        self.args = args
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        # depfile written by the action, listing the files it actually generated
+        self.depfile = depfile
+
+    def key(self):
+        # hash of the action, its arguments and the content of its input files
+        h = hashlib.sha256(('%d:%s:%r\n' % (BUILD_VERSION, self.action.__name__, self.args)).encode())
+        for f in sorted(self.inputs):
+            h.update(('%s:%s\n' % (f, file_hash(f))).encode())
+        return h.hexdigest()
+
+    def generated(self):
+        # files that must exist for the task to be skipped
+        return self.outputs + (read_depfile(self.depfile) if self.depfile else [])
+
+
+def file_hash(fname):
+    # sha256 of a file, rehashed only if it was modified, '-' if missing
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return '-'
+    key = (fname, st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        with open(fname, 'rb') as fil:
+            _hashes[key] = hashlib.sha256(fil.read()).hexdigest()
+    return _hashes[key]
+
+def read_depfile(fname):
+    # targets of the rules of a make/ninja depfile, [] if missing
+    try:
+        with open(fname) as fil:
+            content = fil.read()
+    except OSError:
+        return []
+    targets = []
+    for rule in content.replace('\\\n', ' ').splitlines():
+        head = re.split(r'(?<!\\):(?:\s|$)', rule, 1)
+        if len(head) < 2:
+            continue
+        for target in re.split(r'(?<!\\)\s+', head[0].strip()):
+            if target:
+                targets.append(re.sub(r'\\(.)', r'\1', target).replace('$$', '$'))
+    return targets
+
+#
+# actions, run in worker processes
+#
+
+def run_task(action, args):
+    # return (seconds, result, error)
+    start = time.perf_counter()
+    try:
+        result = action(*args)
+        return time.perf_counter() - start, result, None
+    except TaskError as e:
+        return time.perf_counter() - start, None, str(e)
+    except Exception:
+        return time.perf_counter() - start, None, traceback.format_exc()
+
+def run_merge(xml_file, export_file, output):
+    # symbols of the merged file
+    _, warnings, _, symbols, messages, error = merge.merge_file((xml_file, export_file, output))
+    if warnings or error:
+        raise TaskError(messages + (error or ''))
+    return symbols
+
+def run_command(cmd):
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if proc.returncode:
+        raise TaskError('%s\n%s' % (' '.join(cmd), proc.stdout))
+
+def run_concat(output, head, fnames):
+    # head then content of fnames, output is kept if unchanged
+    content = head
+    for f in fnames:
+        with open(f) as fil:
+            content += fil.read()
+    write_if_changed(output, content)
+
+#
+# scheduling
+#
+
+def schedule(tasks, pool, state, timings, force=False, quiet=False):
+    # run tasks as soon as their dependencies are done, on the pool or inline,
+    # tasks with the same key as in state are skipped, state and timings are updated
+    # return results of the tasks that ran by name, None if a task failed
+    waiting = {t.name: len(t.deps) for t in tasks}
+    successors = {}
+    for t in tasks:
+        for d in t.deps:
+            successors.setdefault(d, []).append(t)
+    ready = [t for t in tasks if not t.deps]
+    done = queue.Queue()
+    results = {}
+    running = 0
+    failed = False
+
+    def finish(task):
+        for s in successors.get(task.name, []):
+            waiting[s.name] -= 1
+            if not waiting[s.name]:
+                ready.append(s)
+
+    while ready or running:
+        while ready and not failed:
+            task = ready.pop(0)
+            key = task.key()
+            if not force and state.get(task.name) == key and all(os.path.exists(f) for f in task.generated()):
+                timings.append((task.stage, task.name, None))
+                finish(task)
+                continue
+            state.pop(task.name, None)
+            if pool:
+                # errors of the pool itself, e.g. arguments or results that cannot be pickled
+                pool.apply_async(run_task, (task.action, task.args),
+                                 callback=lambda r, task=task, key=key: done.put((task, key, r)),
+                                 error_callback=lambda e, task=task, key=key: done.put(
+                                     (task, key, (0.0, None, '%s: %s\n' % (type(e).__name__, e)))))
+            else:
+                done.put((task, key, run_task(task.action, task.args)))
+            running += 1
+        if not running:
+            break
+        task, key, (seconds, result, error) = done.get()
+        running -= 1
+        timings.append((task.stage, task.name, seconds))
+        if error:
+            sys.stderr.write('%s failed\n%s' % (task.name, error))
+            failed = True
+            continue
+        if not quiet:
+            sys.stdout.write('%-40s %9.1f ms\n' % (task.name, seconds*1000))
+        state[task.name] = key
+        results[task.name] = result
+        finish(task)
+    return None if failed else results
+
+def summary(timings, elapsed, jobs, top):
+    # time per stage, total work against elapsed time, and slowest tasks
+    out = '%-10s %6s %8s %10s %10s\n' % ('stage', 'tasks', 'skipped', 'total s', 'max s')
+    stages = []
+    for stage, _, _ in timings:
+        if stage not in stages:
+            stages.append(stage)
+    for stage in stages:
+        times = [s for st, _, s in timings if st == stage]
+        ran = [s for s in times if s is not None]
+        out += '%-10s %6d %8d %10.2f %10.2f\n' % (
+            stage, len(times), len(times) - len(ran), sum(ran), max(ran, default=0))
+    ran = [(s, name) for _, name, s in timings if s is not None]
+    work = sum(s for s, _ in ran)
+    out += '%d task(s), %d skipped, %.2f s of work in %.2f s on %d process(es)' % (
+        len(timings), len(timings) - len(ran), work, elapsed, jobs)
+    out += ', speedup %.1f\n' % (work / elapsed) if elapsed else '\n'
+    for seconds, name in sorted(ran, reverse=True)[:top]:
+        out += '  %-40s %9.2f s\n' % (name, seconds)
+    return out
+
+#
+# task graph
+#
+
+def read_types(fname):
+    # whitespace separated type names, lines starting with # are comments
+    types = []
+    with open(fname) as fil:
+        for line in fil:
+            if not line.startswith('#'):
+                types.extend(line.split())
+    return types
+
+def merge_tasks(pairs, xml_build):
+    # merge tasks, and structure files of the graph of dependencies
+    tasks = []
+    structures = []
+    for xml_file, export_file in pairs:
+        if not export_file:
+            structures.append(xml_file)
+            continue
+        output = os.path.join(xml_build, os.path.basename(xml_file))
+        tasks.append(Task('merge ' + os.path.basename(xml_file), 'merge', run_merge, (xml_file, export_file, output),
+                          [xml_file, export_file] + MERGE_SCRIPTS, [output]))
+        structures.append(output)
+    return tasks, structures
+
+def generate_tasks(G, types, args, dirs):
+    # protogen, concatenation and protoc tasks of the exported types and their dependencies
+    results = run_batch(G, [
+        'TYPES ancestors --exclude=.*df\\..*\\.xml[.tmp]* ' + ' '.join(types),
+        'XMLS sources ' + ' '.join(types),
+        'PREFIXES successors --each @XMLS',
+    ])
+    proto_dir, src_dir, h_dir, cache_dir, manifest_dir = dirs
+    scripts = sorted(glob.glob(os.path.join(LEGACY, '*.py')))
+    tasks = []
+    protogen = {}
+    for xml_file in results['XMLS']:
+        fname = os.path.basename(xml_file)
+        # files of the types depend on which types are exported and ignored:
+        # they are read from the depfile of protogen
+        depfile = os.path.join(manifest_dir, fname + '.d')
+        outputs = [os.path.join(src_dir, fname + '.inc'), os.path.join(proto_dir, fname + '.rpc.proto'), depfile]
+        cmd = [sys.executable, os.path.join(LEGACY, 'protogen.py'),
+               '--proto_out', proto_dir, '--cpp_out', src_dir, '--h_out', h_dir,
+               '--methods=', '--grpc=', '--methods_out', src_dir, '--grpc_out', proto_dir,
+               '--cache', cache_dir, '--manifest_out', manifest_dir, '--depfile', depfile, '--quiet']
+        for t in args.transform:
+            cmd += ['--transform', t]
+        if args.exceptions:
+            cmd += ['--exceptions=' + args.exceptions]
+        cmd += [xml_file]
+        protogen[xml_file] = Task('protogen ' + fname, 'protogen', run_command, (cmd,),
+                                  [xml_file] + scripts + args.transform + ([args.exceptions] if args.exceptions else []),
+                                  outputs, depfile=depfile)
+        tasks.append(protogen[xml_file])
+
+    # macros and procedures of all structure files
+    incs = [os.path.join(src_dir, os.path.basename(x) + '.inc') for x in results['XMLS']]
+    rpcs = [os.path.join(proto_dir, os.path.basename(x) + '.rpc.proto') for x in results['XMLS']]
+    with open(os.path.join(ROOT, 'RemoteLegends.proto.hdr')) as fil:
+        hdr = fil.read()
+    service = os.path.join(proto_dir, 'RemoteLegends.proto')
+    tasks.append(Task('methods.inc', 'concat', run_concat,
+                      (args.methods, '/* THIS FILE WAS GENERATED. DO NOT EDIT. */\n', incs),
+                      incs, [args.methods], [t.name for t in protogen.values()]))
+    tasks.append(Task('RemoteLegends.proto', 'concat', run_concat, (service, hdr, rpcs),
+                      rpcs, [service], [t.name for t in protogen.values()]))
+
+    # protobuf code of the types of each structure file, once the protos they import are generated
+    if args.protoc:
+        protos = []
+        converted = set(results['TYPES'])
+        for xml_file in results['XMLS']:
+            prefixes = [p for p in results['PREFIXES'][xml_file] if p in converted]
+            if not prefixes:
+                continue
+            fname = os.path.basename(xml_file)
+            xml_protos = [os.path.join(proto_dir, p + '.proto') for p in prefixes]
+            protos += xml_protos
+            imports = query(G, 'ancestors', prefixes, '.*df\\..*\\.xml')
+            tasks.append(Task('protoc ' + fname, 'protoc', run_command,
+                              ([args.protoc, '-I=' + proto_dir, '--cpp_out=' + proto_dir] + xml_protos,),
+                              [os.path.join(proto_dir, t + '.proto') for t in imports],
+                              [os.path.join(proto_dir, p + ext) for p in prefixes for ext in ['.pb.cc', '.pb.h']],
+                              [protogen[x].name for x in query(G, 'sources', prefixes)]))
+        tasks.append(Task('protoc RemoteLegends', 'protoc', run_command,
+                          ([args.protoc, '-I=' + proto_dir, '--cpp_out=' + proto_dir, service],),
+                          [service] + protos,
+                          [os.path.join(proto_dir, 'RemoteLegends' + ext) for ext in ['.pb.cc', '.pb.h']],
+                          ['RemoteLegends.proto'] + [t.name for t in protogen.values()]))
+    return results['TYPES'], tasks
+
+def build(args, pool, jobs, state, timings):
+    # return 0 if all tasks succeeded
+    xml_build = os.path.join(args.output, 'protogen', 'xml')
+    dirs = [os.path.join(args.output, d) for d in ['proto', 'src', 'include']]
+    dirs += [os.path.join(xml_build, d) for d in ['cache', 'manifest']]
+    for d in [xml_build] + dirs:
+        os.makedirs(d, exist_ok=True)
+
+    # merge structure files
+    tasks, structures = merge_tasks(merge.pair_files(args.xml_dir, args.patch, args.filter), xml_build)
+    results = schedule(tasks, pool, state, timings, args.force, args.quiet)
+    if results is None:
+        return 1
+
+    # graph of dependencies, from the registry of global types
+    start = time.perf_counter()
+    registry_file = os.path.join(xml_build, 'df-structures.registry')
+    registry = Registry.load(registry_file)
+    for task in tasks:
+        if task.name in results:
+            registry.add_file(task.args[2], results[task.name])
+    registry.update(structures, jobs)
+    registry.prune(structures).save(registry_file)
+    deps = registry.dependencies(structures)
+    write_if_changed(os.path.join(xml_build, 'df-structures.dag'), ''.join(' '.join(d) + '\n' for d in deps))
+    types = read_types(args.types)
+    converted, tasks = generate_tasks(Graph.from_dependencies(deps), types, args, dirs)
+    timings.append(('dag', 'df-structures.dag', time.perf_counter() - start))
+    if not args.quiet:
+        sys.stdout.write('%d exported type(s), %d type(s) to convert, %d task(s)\n' % (
+            len(types), len(converted), len(tasks)))
+
+    # generate code
+    return 0 if schedule(tasks, pool, state, timings, args.force, args.quiet) is not None else 1
+
+
+def main():
+
+    # parse args
+    parser = argparse.ArgumentParser(description='Generate protobuf messages and conversion code of exported types, '
+                                     'running independent steps concurrently.')
+    parser.add_argument('xml_dir', metavar='XMLDIR', type=str,
+                        help='directory of DF structure xml files (dfhack/library/xml)')
+    parser.add_argument('--output', '-o', metavar='BUILDDIR', type=str, required=True,
+                        help='build directory: protogen/xml, proto, include and src, as in the cmake build')
+    parser.add_argument('--patch', metavar='EXPORTDIR', type=str, default=os.path.join(HERE, 'xml'),
+                        help='directory of descriptions of exported elements (default=protogen/xml)')
+    parser.add_argument('--filter', metavar='PATTERN', type=str, default='df.*.xml',
+                        help='structure files of XMLDIR (default=df.*.xml)')
+    parser.add_argument('--types', metavar='FILE', type=str, default=os.path.join(ROOT, 'exported.types'),
+                        help='types to be exported (default=exported.types)')
+    parser.add_argument('--transform', metavar='XSLT', type=str, action='append', default=None,
+                        help='transforms applied by protogen.py (default=XMLDIR/lower-1.xslt, XMLDIR/lower-2.xslt)')
+    parser.add_argument('--exceptions', metavar='EFILE', type=str, default=os.path.join(ROOT, 'exceptions.conf'),
+                        help='exceptions file, empty for none (default=exceptions.conf)')
+    parser.add_argument('--methods', metavar='FILE', type=str, default=os.path.join(ROOT, 'methods.inc'),
+                        help='macro file for global instance vectors (default=methods.inc)')
+    parser.add_argument('--protoc', metavar='PROTOC', type=str, default='protoc',
+                        help='protobuf compiler, empty to stop at .proto files (default=protoc)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        default=0, help='run tasks with N worker processes, 0 for all cores (default=0)')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='run all tasks, even if unchanged (default: False)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                        help='no report per task (default: False)')
+    parser.add_argument('--top', metavar='N', type=int, default=5,
+                        help='show the N slowest tasks in the summary (default=5)')
+    args = parser.parse_args()
+    if args.transform is None:
+        args.transform = [os.path.join(args.xml_dir, 'lower-1.xslt'), os.path.join(args.xml_dir, 'lower-2.xslt')]
+
+    # state of the last build: task name -> key
+    os.makedirs(os.path.join(args.output, 'protogen'), exist_ok=True)
+    state_file = os.path.join(args.output, 'protogen', 'build.state')
+    try:
+        with open(state_file) as fil:
+            state = json.load(fil)
+    except (OSError, ValueError):
+        state = {}
+
+    start = time.perf_counter()
+    timings = []
+    jobs = args.jobs or os.cpu_count()
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        rc = build(args, pool, jobs, state, timings)
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        rc = 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        tmp = '%s.%d.tmp' % (state_file, os.getpid())
+        with open(tmp, 'w') as fil:
+            json.dump(state, fil, indent=1, sort_keys=True)
+        os.replace(tmp, state_file)
+    sys.stdout.write(summary(timings, time.perf_counter() - start, jobs, args.top))
+    sys.exit(rc)
+
+
+if __name__ == '__main__':
+    main()
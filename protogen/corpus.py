@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+
+# Generate a synthetic corpus of DF structures, for benchmarks:
+# - df.<name>.xml: structures in df-structures format
+# - <name>.export: exported types and fields, for merge.py
+# - df.<name>.lowered.xml: merged and lowered structures, as protogen.py sees them
+# - df-structures.dag: dependencies between exported types, as dependencies.py outputs them
+
+import os
+import sys
+import random
+import argparse
+from xml.sax.saxutils import quoteattr
+
+LOWERED_NS = 'http://github.com/peterix/dfhack/lowered-data-definition'
+NUMBERS = ['int8_t', 'int16_t', 'int32_t', 'int64_t', 'uint8_t', 'uint16_t', 'uint32_t', 's-float', 'bool']
+
+
+class Field:
+
+    def __init__(self, kind, name, subtype=None, target=None, children=None):
+        # number | ref | enum-ref | bitfield-ref | vector | ptr-vector | compound | union
+        self.kind = kind
+        self.name = name
+        self.subtype = subtype
+        self.target = target
+        self.children = children or []
+
+
+class Type:
+
+    def __init__(self, kind, name, fname):
+        # struct | enum | bitfield
+        self.kind = kind
+        self.name = name
+        self.fname = fname
+        self.fields = []
+        self.items = []
+        self.exported = False
+
+    def dependencies(self):
+        deps = []
+        stack = list(self.fields)
+        while stack:
+            field = stack.pop(0)
+            if field.target and field.target not in deps:
+                deps.append(field.target)
+            stack.extend(field.children)
+        return deps
+
+
+class Corpus:
+
+    def __init__(self, types=200, files=4, fields=20, depth=2, containers=0.2,
+                 unions=0.05, enums=0.15, bitfields=0.1, exported=0.5, seed=0):
+        self.rng = random.Random(seed)
+        self.nfiles = files
+        self.nfields = fields
+        self.containers = containers
+        self.unions = unions
+        self.exported = exported
+        self.types = []
+        for i in range(types):
+            fname = 'bench%d' % (i * files // max(types, 1))
+            draw = self.rng.random()
+            if draw < enums:
+                self.types.append(self._make_enum('bench_enum_%d' % i, fname))
+            elif draw < enums + bitfields:
+                self.types.append(self._make_bitfield('bench_flags_%d' % i, fname))
+            else:
+                self.types.append(self._make_struct('bench_type_%d' % i, fname, depth))
+        self._export()
+
+    def files(self):
+        return sorted(set(t.fname for t in self.types))
+
+    def types_of(self, fname):
+        return [t for t in self.types if t.fname == fname]
+
+
+    # model
+
+    def _earlier(self, kind):
+        # only refer to types defined before, so that the graph is acyclic
+        return [t for t in self.types if t.kind == kind]
+
+    def _make_enum(self, name, fname):
+        typ = Type('enum', name, fname)
+        typ.items = ['item_%d' % i for i in range(self.rng.randint(2, 12))]
+        return typ
+
+    def _make_bitfield(self, name, fname):
+        typ = Type('bitfield', name, fname)
+        typ.items = ['flag_%d' % i for i in range(self.rng.randint(2, 16))]
+        return typ
+
+    def _make_fields(self, count, depth):
+        structs = self._earlier('struct')
+        enums = self._earlier('enum')
+        bitfields = self._earlier('bitfield')
+        fields = []
+        # union members are named after enum items: one union per scope
+        union = False
+        i = 0
+        while len(fields) < count:
+            name = 'field_%d' % i
+            i += 1
+            draw = self.rng.random()
+            if draw < self.containers:
+                if structs and self.rng.random() < 0.5:
+                    fields.append(Field('ptr-vector', name, target=self.rng.choice(structs).name))
+                else:
+                    fields.append(Field('vector', name, subtype=self.rng.choice(NUMBERS[:7])))
+            elif draw < self.containers + self.unions and enums and not union:
+                # union with its discriminator
+                enum = self.rng.choice(enums)
+                union = True
+                fields.append(Field('enum-ref', name+'_type', target=enum.name))
+                members = [Field('number', item, subtype='int32_t') for item in enum.items]
+                fields.append(Field('union', name, children=members))
+            elif draw < 0.6 and enums:
+                fields.append(Field('enum-ref', name, target=self.rng.choice(enums).name))
+            elif draw < 0.65 and bitfields:
+                fields.append(Field('bitfield-ref', name, target=self.rng.choice(bitfields).name))
+            elif draw < 0.7 and structs:
+                fields.append(Field('ref', name, target=self.rng.choice(structs).name))
+            elif draw < 0.8 and depth > 0:
+                children = self._make_fields(max(count // 2, 1), depth - 1)
+                fields.append(Field('compound', name, children=children))
+            else:
+                fields.append(Field('number', name, subtype=self.rng.choice(NUMBERS)))
+        return fields
+
+    def _make_struct(self, name, fname, depth):
+        typ = Type('struct', name, fname)
+        typ.fields = self._make_fields(self.nfields, depth)
+        return typ
+
+    def _export(self):
+        # export a share of the structs, and all the types they depend on
+        byname = {t.name: t for t in self.types}
+        structs = [t for t in self.types if t.kind == 'struct']
+        count = int(len(structs) * self.exported)
+        stack = self.rng.sample(structs, count) if count else []
+        while stack:
+            typ = stack.pop()
+            if typ.exported:
+                continue
+            typ.exported = True
+            stack.extend(byname[d] for d in typ.dependencies())
+
+
+    # df-structures format
+
+    def _raw_field(self, field, ident):
+        pad = '    ' * ident
+        name = quoteattr(field.name)
+        if field.kind == 'number':
+            return '%s<%s name=%s/>\n' % (pad, field.subtype, name)
+        if field.kind == 'ref':
+            return '%s<compound name=%s type-name=%s/>\n' % (pad, name, quoteattr(field.target))
+        if field.kind == 'enum-ref':
+            return '%s<enum name=%s type-name=%s base-type="int32_t"/>\n' % (pad, name, quoteattr(field.target))
+        if field.kind == 'bitfield-ref':
+            return '%s<bitfield name=%s type-name=%s/>\n' % (pad, name, quoteattr(field.target))
+        if field.kind == 'vector':
+            return '%s<stl-vector name=%s type-name=%s/>\n' % (pad, name, quoteattr(field.subtype))
+        if field.kind == 'ptr-vector':
+            return '%s<stl-vector name=%s pointer-type=%s/>\n' % (pad, name, quoteattr(field.target))
+        union = ' is-union="true"' if field.kind == 'union' else ''
+        out = '%s<compound name=%s%s>\n' % (pad, name, union)
+        for child in field.children:
+            out += self._raw_field(child, ident + 1)
+        out += '%s</compound>\n' % (pad)
+        return out
+
+    def raw_xml(self, fname):
+        out = '<data-definition>\n'
+        for typ in self.types_of(fname):
+            name = quoteattr(typ.name)
+            if typ.kind == 'enum':
+                out += '<enum-type type-name=%s base-type="int32_t">\n' % (name)
+                for item in typ.items:
+                    out += '    <enum-item name=%s/>\n' % (quoteattr(item))
+                out += '</enum-type>\n'
+            elif typ.kind == 'bitfield':
+                out += '<bitfield-type type-name=%s base-type="uint32_t">\n' % (name)
+                for item in typ.items:
+                    out += '    <flag-bit name=%s/>\n' % (quoteattr(item))
+                out += '</bitfield-type>\n'
+            else:
+                out += '<struct-type type-name=%s>\n' % (name)
+                for field in typ.fields:
+                    out += self._raw_field(field, 1)
+                out += '</struct-type>\n'
+        out += '</data-definition>\n'
+        return out
+
+    def export_spec(self, fname):
+        out = ''
+        for typ in self.types_of(fname):
+            if not typ.exported:
+                continue
+            out += typ.name + '\n'
+            for field in typ.fields:
+                out += '\t' + field.name + '\n'
+            out += '\n'
+        return out
+
+
+    # lowered format
+
+    def _lowered_field(self, field, level, export):
+        pad = '  ' * level
+        attrs = 'name=%s ld:level="%d"%s' % (quoteattr(field.name), level, export)
+        if field.kind == 'number':
+            return '%s<ld:field %s ld:meta="number" ld:subtype="%s"/>\n' % (pad, attrs, field.subtype)
+        if field.kind == 'ref':
+            return '%s<ld:field %s ld:meta="global" type-name=%s/>\n' % (pad, attrs, quoteattr(field.target))
+        if field.kind == 'enum-ref':
+            return '%s<ld:field %s ld:meta="global" ld:subtype="enum" base-type="int32_t" type-name=%s/>\n' % (
+                pad, attrs, quoteattr(field.target))
+        if field.kind == 'bitfield-ref':
+            return '%s<ld:field %s ld:meta="global" ld:subtype="bitfield" type-name=%s/>\n' % (
+                pad, attrs, quoteattr(field.target))
+        if field.kind == 'vector':
+            return ('%s<ld:field %s ld:meta="container" ld:subtype="stl-vector" type-name="%s" ld:is-container="true">\n'
+                    '%s  <ld:item ld:level="%d" ld:meta="number" ld:subtype="%s"%s/>\n'
+                    '%s</ld:field>\n') % (pad, attrs, field.subtype, pad, level+1, field.subtype, export, pad)
+        if field.kind == 'ptr-vector':
+            target = quoteattr(field.target)
+            return ('%s<ld:field %s ld:meta="container" ld:subtype="stl-vector" pointer-type=%s ld:is-container="true">\n'
+                    '%s  <ld:item ld:level="%d" ld:meta="pointer" type-name=%s ld:is-container="true"%s>\n'
+                    '%s    <ld:item ld:level="%d" ld:meta="global" type-name=%s%s/>\n'
+                    '%s  </ld:item>\n'
+                    '%s</ld:field>\n') % (pad, attrs, target, pad, level+1, target, export,
+                                          pad, level+2, target, export, pad, pad)
+        union = ' is-union="true"' if field.kind == 'union' else ''
+        out = '%s<ld:field %s ld:meta="compound" ld:typedef-name="T_%s"%s>\n' % (pad, attrs, field.name, union)
+        for child in field.children:
+            out += self._lowered_field(child, level + 1, export)
+        out += '%s</ld:field>\n' % (pad)
+        return out
+
+    def lowered_xml(self, fname):
+        out = '<ld:data-definition xmlns:ld="%s">\n' % (LOWERED_NS)
+        for typ in self.types_of(fname):
+            name = quoteattr(typ.name)
+            export = ' export="true"' if typ.exported else ''
+            if typ.kind == 'enum':
+                out += '<ld:global-type ld:meta="enum-type" ld:level="0" type-name=%s base-type="int32_t"%s>\n' % (name, export)
+                for item in typ.items:
+                    out += '  <enum-item name=%s/>\n' % (quoteattr(item))
+            elif typ.kind == 'bitfield':
+                out += '<ld:global-type ld:meta="bitfield-type" ld:level="0" type-name=%s base-type="uint32_t"%s>\n' % (name, export)
+                for item in typ.items:
+                    out += '  <ld:field name=%s ld:level="1" ld:meta="number" ld:subtype="flag-bit" ld:bits="1"/>\n' % (quoteattr(item))
+            else:
+                out += '<ld:global-type ld:meta="struct-type" ld:level="0" type-name=%s%s>\n' % (name, export)
+                for field in typ.fields:
+                    out += self._lowered_field(field, 1, export)
+            out += '</ld:global-type>\n'
+        out += '</ld:data-definition>\n'
+        return out
+
+
+    # dependencies
+
+    def dag(self, outdir='.'):
+        out = ''
+        for typ in self.types:
+            if typ.exported:
+                path = os.path.join(outdir, 'df.%s.xml' % (typ.fname))
+                out += ' '.join([typ.name] + typ.dependencies() + [path]) + '\n'
+        return out
+
+    def write(self, outdir):
+        # write all files of the corpus, return their names
+        os.makedirs(outdir, exist_ok=True)
+        fnames = []
+        for name in self.files():
+            for fname, content in [
+                    ('df.%s.xml' % (name), self.raw_xml(name)),
+                    ('%s.export' % (name), self.export_spec(name)),
+                    ('df.%s.lowered.xml' % (name), self.lowered_xml(name))]:
+                fnames.append(os.path.join(outdir, fname))
+                with open(fnames[-1], 'w') as fil:
+                    fil.write(content)
+        fnames.append(os.path.join(outdir, 'df-structures.dag'))
+        with open(fnames[-1], 'w') as fil:
+            fil.write(self.dag(outdir))
+        return fnames
+
+
+def add_arguments(parser):
+    parser.add_argument('--types', metavar='N', type=int, default=200,
+                        help='number of global types (default=200)')
+    parser.add_argument('--files', metavar='N', type=int, default=4,
+                        help='number of structure files (default=4)')
+    parser.add_argument('--fields', metavar='N', type=int, default=20,
+                        help='number of fields per struct (default=20)')
+    parser.add_argument('--depth', metavar='N', type=int, default=2,
+                        help='max nesting depth of compounds (default=2)')
+    parser.add_argument('--containers', metavar='RATIO', type=float, default=0.2,
+                        help='ratio of container fields (default=0.2)')
+    parser.add_argument('--unions', metavar='RATIO', type=float, default=0.05,
+                        help='ratio of union fields (default=0.05)')
+    parser.add_argument('--enums', metavar='RATIO', type=float, default=0.15,
+                        help='ratio of enum types (default=0.15)')
+    parser.add_argument('--bitfields', metavar='RATIO', type=float, default=0.1,
+                        help='ratio of bitfield types (default=0.1)')
+    parser.add_argument('--exported', metavar='RATIO', type=float, default=0.5,
+                        help='ratio of exported structs (default=0.5)')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='random seed (default=0)')
+
+def from_arguments(args):
+    return Corpus(args.types, args.files, args.fields, args.depth, args.containers,
+                  args.unions, args.enums, args.bitfields, args.exported, args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic corpus of DF structures.')
+    parser.add_argument('output', metavar='OUTDIR', type=str,
+                        help='output directory')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    corpus = from_arguments(args)
+    for fname in corpus.write(args.output):
+        sys.stdout.write('created %s\n' % (fname))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,227 @@
 #!/usr/bin/python3
 
-# requires:
-# $ pip install networkx
-
 import sys
 import re
+import json
 import argparse
 import traceback
-import networkx as nx
+from itertools import islice
+
+from graph import Graph
+
+COMMANDS = ['ancestors', 'successors', 'sources', 'sinks', 'path', 'levels', 'order']
+
+def closure(G, nodes):
+    # given nodes and all their ancestors, or all nodes
+    if not nodes:
+        return set(G.names)
+    deps = set(nodes)
+    for t in nodes:
+        deps.update(G.ancestors(t))
+    return deps
+
+def query(G, command, nodes, regex=None):
+    # result of a command for the given nodes, as a sorted list
+    # (a list of levels for 'levels')
+    if command in ['levels', 'order']:
+        # topological layering of the closure, excluded nodes are not scheduled
+        levels = G.levels(exclude(closure(G, nodes), regex))
+        if command == 'order':
+            return [n for level in levels for n in level]
+        return levels
+    return exclude(query_nodes(G, command, nodes), regex)
+
+def query_nodes(G, command, nodes):
+    if command == 'ancestors':
+        # all ancestors of the given nodes, including themselves
+        deps = set()
+        for t in nodes:
+            deps.update([t])
+            deps.update(G.ancestors(t))
+        return sorted(deps)
+    elif command == 'successors':
+        # direct successors of the given nodes
+        deps = set()
+        for t in nodes:
+            deps.update(G.successors(t))
+        return sorted(deps)
+    elif command == 'sinks':
+        return sorted(G.sinks())
+    elif command == 'sources':
+        # sources of the given nodes, or of the whole graph
+        deps = set()
+        for t in nodes:
+            deps.update(G.ancestors(t))
+        return sorted(G.sources(deps or None))
+    elif command == 'path':
+        if len(nodes) != 2:
+            raise Exception('path needs a source and a target')
+        return [','.join(path) for path in G.all_simple_paths(nodes[0], nodes[1])]
+    raise Exception('unknown command: ' + command)
+
+def exclude(result, regex):
+    if regex:
+        return [r for r in result if not re.match(regex, r)]
+    return result
+
+def parse_query(line):
+    # NAME COMMAND [--exclude=REGEX] [--each] NODE...
+    # return (name, command, nodes, exclude regex, each)
+    tokens = line.split()
+    if len(tokens) < 2 or tokens[1] not in COMMANDS:
+        raise Exception('invalid query: ' + line)
+    name, command, regex, each, nodes = tokens[0], tokens[1], None, False, []
+    for token in tokens[2:]:
+        if token.startswith('--exclude='):
+            regex = token[len('--exclude='):]
+        elif token == '--each':
+            each = True
+        else:
+            nodes.append(token)
+    return name, command, nodes, regex, each
+
+def run_batch(G, lines):
+    # answer all queries on the same graph
+    # @NAME in the nodes of a query is replaced by the result of query NAME,
+    # with --each the query is answered for each node separately
+    results = {}
+    for line in lines:
+        if not line.strip() or line.strip().startswith('#'):
+            continue
+        name, command, nodes, regex, each = parse_query(line)
+        expanded = []
+        for node in nodes:
+            if node.startswith('@'):
+                expanded.extend(results[node[1:]])
+            else:
+                expanded.append(node)
+        if each:
+            results[name] = {n: query(G, command, [n], regex) for n in expanded}
+        else:
+            results[name] = query(G, command, expanded, regex)
+    return results
+
+def cmake_identifier(string):
+    # same as string(MAKE_C_IDENTIFIER ...) in cmake
+    ident = re.sub(r'[^A-Za-z0-9_]', '_', string)
+    return '_' + ident if ident[:1].isdigit() else ident
+
+def cmake_list(values):
+    return '"%s"' % (';'.join(values).replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$'))
+
+def render_cmake(results):
+    # include file setting one list variable per query,
+    # and NAME_<node> variables for queries with --each
+    # and NAME_COUNT, NAME_<level> variables for levels
+    out = '# THIS FILE WAS GENERATED BY dag.py. DO NOT EDIT.\n'
+    for name, result in results.items():
+        if isinstance(result, dict):
+            for node, values in result.items():
+                out += 'set(%s_%s %s)\n' % (name, cmake_identifier(node), cmake_list(values))
+        elif result and isinstance(result[0], list):
+            out += 'set(%s_COUNT %d)\n' % (name, len(result))
+            for n, values in enumerate(result):
+                out += 'set(%s_%d %s)\n' % (name, n, cmake_list(values))
+        else:
+            out += 'set(%s %s)\n' % (name, cmake_list(result))
+    return out
+
+def write_if_changed(fname, content):
+    # keep existing file (and its mtime) if content is unchanged
+    try:
+        with open(fname, 'r') as fil:
+            if fil.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(fname, 'w') as fil:
+        fil.write(content)
+    return True
+
+def diff(old, new, types=None):
+    # changes between two versions of a graph, and nodes impacted by them:
+    # a node changed if it was added or removed or if its dependencies changed,
+    # and a node is impacted if a changed node is among its ancestors or itself
+    old_edges = set(old.edges())
+    new_edges = set(new.edges())
+    report = {
+        'added_nodes': sorted(set(new.names) - set(old.names)),
+        'removed_nodes': sorted(set(old.names) - set(new.names)),
+        'added_edges': sorted(new_edges - old_edges),
+        'removed_edges': sorted(old_edges - new_edges),
+    }
+    changed = set(report['added_nodes']) | set(report['removed_nodes'])
+    changed.update(t for _, t in new_edges ^ old_edges)
+    impacted = set()
+    for n in changed:
+        if n in new:
+            impacted.update([n])
+            impacted.update(new.descendants(n))
+        else:
+            # descendants of removed nodes that still exist
+            impacted.update(d for d in old.descendants(n) if d in new)
+    if types is not None:
+        # only nodes generated for the given types, none if no type is in the new graph
+        types = [t for t in types if t in new]
+        impacted = impacted & closure(new, types) if types else set()
+    report['changed'] = sorted(changed)
+    report['impacted'] = sorted(impacted)
+    return report
+
+def main_diff(argv):
+
+    # parse args
+    parser = argparse.ArgumentParser(prog='dag.py diff',
+                                     description='List nodes impacted by changes between two versions of a directed acyclic graph.')
+    parser.add_argument('old', metavar='OLD', type=str, help='previous DAG file')
+    parser.add_argument('new', metavar='NEW', type=str, help='current DAG file')
+    parser.add_argument('--types', metavar='TYPE', type=str, nargs='+', default=None,
+                        help='only list impacted nodes among these types and their ancestors (default: all nodes)')
+    parser.add_argument('--plain', action='store_true', default=False,
+                        help='raw output (default=false)')
+    parser.add_argument('--separator', '-s', metavar='STR', type=str,
+                        default=' ', help='separator between elements of lists (default=" ")')
+    parser.add_argument('-1', dest='one', action='store_true', default=False,
+                        help='output 1 element per line')
+    parser.add_argument('--exclude', metavar='REGEX', type=str,
+                        help='exclude nodes matching REGEX from the result')
+    parser.add_argument('--format', metavar='list|json', type=str, choices=['list', 'json'],
+                        default='list', help='list of impacted nodes, or json report of all changes (default=list)')
+    args = parser.parse_args(argv)
+
+    try:
+        report = diff(Graph.from_files([args.old]), Graph.from_files([args.new]), args.types)
+        report['impacted'] = exclude(report['impacted'], args.exclude)
+        if args.format == 'json':
+            print(json.dumps(report, indent=2))
+            exit(0)
+        if not args.plain:
+            print('%d node(s) added, %d removed, %d edge(s) added, %d removed, %d node(s) impacted' % (
+                len(report['added_nodes']), len(report['removed_nodes']),
+                len(report['added_edges']), len(report['removed_edges']), len(report['impacted'])))
+        if args.one:
+            args.separator = '\n'
+        if report['impacted']:
+            print(args.separator.join(report['impacted']), end='')
+        exit(0)
+
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        exit(1)
 
 def main():
 
+    # compare two graphs
+    if len(sys.argv) > 1 and sys.argv[1] == 'diff':
+        return main_diff(sys.argv[2:])
+
     # parse args
-    parser = argparse.ArgumentParser(description='Explore a directed acyclic graph.')
+    parser = argparse.ArgumentParser(description='Explore a directed acyclic graph.',
+                                     epilog='use "%(prog)s diff OLD NEW" to list nodes impacted by changes of the graph')
     parser.add_argument('inputs', metavar='INFILE', type=str, nargs='+',
                         help='DAG file')
+    parser.add_argument('--registry', action='store_true', default=False,
+                        help='inputs are registries of global types (registry.py) instead of DAG files')
     parser.add_argument('--plain', action='store_true', default=False,
                         help='raw output (default=false)')
     parser.add_argument('--separator', '-s', metavar='STR', type=str,
@@ -23,6 +230,8 @@ def main():
                         help='output 1 element per line')
     parser.add_argument('--exclude', metavar='REGEX', type=str,
                         help='exclude nodes matching REGEX from the result')
+    parser.add_argument('--cache', metavar='IDXFILE', type=str, default=None,
+                        help='binary index of the graph, rebuilt when inputs change (default=<none>)')
     group = parser.add_argument_group('commands').add_mutually_exclusive_group()
     group.add_argument('--ancestors', metavar='TYPE', type=str, nargs='+', default=[],
                         help='list all ancestors of given nodes, including themselves')
@@ -32,89 +241,99 @@ def main():
                         help='list all sources of given nodes (default: all nodes)')
     group.add_argument('--sinks', action='store_true', default=False,
                         help='list all sinks of the graph')
-    group.add_argument('--path', metavar='SOURCE TARGET', type=str, nargs=2, default=[],
-                        help='list all paths from SOURCE to TARGET')
+    group.add_argument('--path', metavar=('SOURCE', 'TARGET'), type=str, nargs=2, default=[],
+                        help='list all paths from SOURCE to TARGET, as they are found')
+    group.add_argument('--levels', metavar='TYPE', type=str, nargs='*', default=None,
+                        help='list nodes by topological level, for given nodes and their ancestors (default: all nodes)')
+    group.add_argument('--order', metavar='TYPE', type=str, nargs='*', default=None,
+                        help='list given nodes and their ancestors in topological order (default: all nodes)')
+    group.add_argument('--batch', metavar='QUERY', type=str, nargs='+', default=[],
+                        help='answer queries "NAME COMMAND [--exclude=REGEX] [--each] NODE..." at once, '
+                        'where COMMAND is one of: %s, and NODE may be @NAME of a previous query' % (', '.join(COMMANDS)))
+    group.add_argument('--queries', metavar='QFILE', type=str, default=None,
+                        help='answer queries of QFILE at once, one per line')
+    parser.add_argument('--shortest', metavar='K', type=int, nargs='?', const=1, default=None,
+                        help='with --path, list the K shortest paths only (default K=1)')
+    parser.add_argument('--max-paths', metavar='N', type=int, default=None,
+                        help='with --path, stop after N paths (default=<none>)')
+    parser.add_argument('--max-depth', metavar='N', type=int, default=None,
+                        help='with --path, only paths of at most N edges (default=<none>)')
+    parser.add_argument('--format', metavar='json|cmake', type=str, choices=['json', 'cmake'],
+                        default='json', help='output format of queries (default=json)')
+    parser.add_argument('--output', '-o', metavar='FILE', type=str, default=None,
+                        help='write output of queries to FILE, if changed (default=stdout)')
     args = parser.parse_args()
 
     # read graph
-    G = nx.DiGraph()
-    for f in args.inputs:
-        try:
-            fp = None
-            with open(f) as fp:
-                line = fp.readline()
-                while line:
-                    tokens = line.split()
-                    if not tokens:
-                        continue
-                    node = tokens[0]
-                    for dep in tokens[1:]:
-                        G.add_edge(dep, node)
-                    line = fp.readline()
-        except Exception as e:
-            sys.stderr.write('error parsing %s' % (f))
-            traceback.print_exc(file=sys.stderr)
-            exit(1)
-        finally:
-            if fp:
-                fp.close()
-
-    if not args.plain:
-        print('read %d file(s), %d nodes and %d edges' % (len(args.inputs), G.number_of_nodes(), G.number_of_edges()))
+    try:
+        if args.registry:
+            from registry import Registry
+            G, indexed = Graph.from_dependencies(
+                deps for f in args.inputs for deps in Registry.load(f).dependencies()), False
+        else:
+            G, indexed = Graph.load(args.inputs, args.cache)
+    except Exception as e:
+        sys.stderr.write('error parsing %s' % (' '.join(args.inputs)))
+        traceback.print_exc(file=sys.stderr)
+        exit(1)
+
+    batch = args.batch
+    if args.queries:
+        with open(args.queries) as fil:
+            batch = fil.readlines()
+    if not args.plain and not (batch and not args.output):
+        print('read %d file(s)%s, %d nodes and %d edges' % (
+            len(args.inputs), ' from %s' % (args.cache) if indexed else '', len(G), G.number_of_edges()))
     result = None
     
     try:
-        # list all ancestors of the given nodes
-        if args.ancestors:
-            deps = set()
-            for t in args.ancestors:
-                deps.update([t])
-                deps.update(nx.ancestors(G, t))
-            result = list(deps)
+        # answer all queries
+        if batch:
+            results = run_batch(G, batch)
+            if args.format == 'cmake':
+                out = render_cmake(results)
+            else:
+                out = json.dumps(results, indent=2) + '\n'
+            if not args.output:
+                sys.stdout.write(out)
+            elif write_if_changed(args.output, out) and not args.plain:
+                print('created %s' % (args.output))
+            exit(0)
 
-        # list all direct successors of the given nodes
-        elif args.successors:
-            deps = set()
-            for t in args.successors:
-                deps.update(G.successors(t))
-            result = list(deps)
+        # list paths from 'source' to 'target'
+        if args.path:
+            if args.shortest is not None:
+                paths = islice(G.all_shortest_paths(args.path[0], args.path[1], args.max_depth), args.shortest)
+            else:
+                paths = G.all_simple_paths(args.path[0], args.path[1], args.max_depth)
+            for path in islice(paths, args.max_paths):
+                print(','.join([n for n in path]), flush=True)
+            exit(0)
 
-        # list all sinks
+        # list nodes level by level, with widths and critical path
+        if args.levels is not None:
+            levels = query(G, 'levels', args.levels, args.exclude)
+            if not args.plain:
+                print('%d level(s), max width %d, critical path length %d: %s' % (
+                    len(levels), max([len(l) for l in levels], default=0), len(levels),
+                    ' -> '.join(G.critical_path(levels))))
+            for n, level in enumerate(levels):
+                if not args.plain:
+                    print('level %d (%d): ' % (n, len(level)), end='')
+                print(args.separator.join(level))
+            exit(0)
+
+        if args.ancestors:
+            result = query(G, 'ancestors', args.ancestors, args.exclude)
+        elif args.successors:
+            result = query(G, 'successors', args.successors, args.exclude)
         elif args.sinks:
-            sinks = set()
-            view = G.out_degree()
-            for node, degree in list(view):
-                if degree == 0:
-                    sinks.update([node])
-            result = list(sinks)
-
-        # list all sources of the given nodes
+            result = query(G, 'sinks', [], args.exclude)
         elif args.sources is not None:
-            sources = set()
-            nodes = set()
-            for n in args.sources:
-                nodes.update(nx.ancestors(G, n))
-            if nodes:
-                view = G.in_degree(list(nodes))
-            else:
-                view = G.in_degree()
-            for node, degree in list(view):
-                if degree == 0:
-                    sources.update([node])
-            result = list(sources)
-
-        # list all paths from 'source' to 'target'
-        elif args.path:
-            if len(args.path) != 2:
-                parser.print_help()
-                exit(1)
-            result = ''
-            for path in nx.all_simple_paths(G, source=args.path[0], target=args.path[1]):
-                print(','.join([n for n in path]))
-            exit(0)
+            result = query(G, 'sources', args.sources, args.exclude)
+        elif args.order is not None:
+            result = query(G, 'order', args.order, args.exclude)
 
-        if args.exclude:
-            result = [r for r in result if not re.match(args.exclude, r)]
         if args.one:
             args.separator = '\n'
         if result:
@@ -1,117 +1,135 @@
 #!/usr/bin/python3
 
-# requires:
-# $ pip install antlr4-python3-runtime
-
+import os
 import sys
+import json
+import hashlib
 import argparse
 import traceback
-import networkx as nx
-from antlr4 import *
-from parser.DfLexer import DfLexer
-from parser.DfParser import DfParser
-from antlr4.error.ErrorListener import ErrorListener
-from parser.DfParserVisitor import DfParserVisitor
-
-
-class ThrowingErrorListener(ErrorListener):
-    def syntaxError(self, recognizer, offendingSymbol, line, charPositionInLine, msg, e):
-        raise Exception("line %d:%d %s" % (line, charPositionInLine, msg))
-
-
-class DependenciesVisitor(DfParserVisitor):
-
-    PRIMTYPES = ['bool'
-                 , 'df-array'
-		 , 'df-flagarray'
-		 , 'df-linked-list'
-		 , 'extra-include'
-		 , 'int8_t'
-		 , 'int16_t'
-		 , 'int32_t'
-		 , 'int64_t'
-		 , 'long'
-		 , 'padding'
-		 , 'ptr-string'
-		 , 'static-string'
-		 , 'stl-bit-vector'
-		 , 'stl-string'
-		 , 'stl-fstream'
-		 , 's-float'
-		 , 'uint8_t'
-		 , 'uint16_t'
-		 , 'uint32_t'
-		 , 'uint64_t'
-    ]
-
-    def __init__(self):
-        self.imports = set()
-
-    def defaultResult(self):
-        return []
-    
-    def aggregateResult(self, aggregate, nextResult: str):
-        if nextResult:
-            return aggregate + nextResult
-        return aggregate
-    
-    def visitGtype(self, ctx:DfParser.GtypeContext):
-        # visit global type if it has attribute: export='true'
-        for attr in ctx.children[0].attribute():
-            name, value = self.readAttribute(attr)
-            if name=='export' and value=='true':
-                ch = self.visitChildren(ctx)
-                if ch:
-                    return [ch]
-
-    def visitOther_type(self, ctx:DfParser.Other_typeContext):
-        # ignore <global_object> (not a type)
-        if not ctx.other(0).GLOBAL_TYPE():
-            return self.visitChildren(ctx)
-
-    def visitField(self, ctx):
-        for attr in ctx.attribute():
-            # return type of field if it has attribute: export='true'
-            # but no attribute: export-as
-            name, value = self.readAttribute(attr)
-            if name=='export-as':
-                return
-            if name=='export' and value=='true':
-                # return type-name of this field
-                for attr in ctx.attribute():
-                    tname = DependenciesVisitor.readAttributeType(attr)
-                    if tname:
-                        return [tname]
-
-    def visitMethod(self, ctx):
-        # return type of method
-        return self.visitField(ctx)
-
-    def visitItem(self, ctx):
-        # ignore children of enum items
-        return []
-
-    def visitFlag_bit(self, ctx):
-        # ignore children of bitfield flags
-        return []
-
-    @staticmethod
-    def readAttribute(attr):
-        return str(attr.ATTRNAME() or attr.RET_TYPE()), attr.STRING().getText()[1:-1]
-
-    @staticmethod
-    def readAttributeType(attr):
-        name, _ = DependenciesVisitor.readAttribute(attr)
-        if name in ['type-name', 'pointer-type', 'inherits-from', 'index-enum', 'ret-type']:
-            tname = attr.STRING().getText()[1:-1]
-            if tname not in DependenciesVisitor.PRIMTYPES:
-                return tname
-        
-    def visitAttribute(self, ctx:DfParser.AttributeContext):
-        tname = DependenciesVisitor.readAttributeType(ctx)
-        return [tname] if tname else []
-
-    
+import multiprocessing
+from lxml import etree
+
+
+# part of the key of cached results, increment when extracted dependencies change
+EXTRACTOR_VERSION = 1
+
+PRIMTYPES = ['bool'
+             , 'df-array'
+             , 'df-flagarray'
+             , 'df-linked-list'
+             , 'extra-include'
+             , 'int8_t'
+             , 'int16_t'
+             , 'int32_t'
+             , 'int64_t'
+             , 'long'
+             , 'padding'
+             , 'ptr-string'
+             , 'static-string'
+             , 'stl-bit-vector'
+             , 'stl-string'
+             , 'stl-fstream'
+             , 's-float'
+             , 'uint8_t'
+             , 'uint16_t'
+             , 'uint32_t'
+             , 'uint64_t'
+]
+
+# attributes naming a type
+TYPE_ATTRIBUTES = ['type-name', 'pointer-type', 'inherits-from', 'index-enum', 'ret-type']
+
+# global types, <global-object> is not a type
+GLOBAL_TYPES = ['struct-type', 'class-type', 'enum-type', 'bitfield-type',
+                'df-linked-list-type', 'df-other-vectors-type']
+
+# global types with fields, children of enums and bitfields are ignored
+FIELD_TYPES = ['struct-type', 'class-type', 'df-linked-list-type', 'df-other-vectors-type']
+
+METHODS = ['virtual-methods', 'custom-methods']
+
+
+def attribute_type(name, value):
+    if name in TYPE_ATTRIBUTES and value not in PRIMTYPES:
+        return value
+
+def field_type(elem):
+    # type of a field or method with attribute: export='true'
+    # but no attribute: export-as, children are not visited
+    for name, value in elem.items():
+        if name == 'export-as':
+            return
+        if name == 'export' and value == 'true':
+            for n, v in elem.items():
+                tname = attribute_type(n, v)
+                if tname:
+                    return tname
+
+def type_dependencies(elem):
+    # dependencies of a global type element, its own type-name first,
+    # None if it is not an exported type
+    if elem.tag not in GLOBAL_TYPES or elem.get('export') != 'true':
+        return None
+    deps = [tname for tname in (attribute_type(n, v) for n, v in elem.items()) if tname]
+    if elem.tag in FIELD_TYPES:
+        for child in elem.iterchildren(etree.Element):
+            members = child.iterchildren(etree.Element) if child.tag in METHODS else [child]
+            for member in members:
+                tname = field_type(member) if member.tag != 'comment' else None
+                if tname:
+                    deps.append(tname)
+    return deps
+
+def extract(fname):
+    # dependencies of the exported global types of a structure file:
+    # one list per type, its own type-name first, same as antlr_dependencies.py
+    all_deps = []
+    depth = 0
+    for event, elem in etree.iterparse(fname, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            deps = type_dependencies(elem)
+            if deps:
+                all_deps.append(deps)
+            # drop the global type and the ones before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    return all_deps
+
+def extract_file(args):
+    # extract dependencies of a file in a worker process, or reload them from the cache
+    # return (dependencies, True if found in cache, error), errors are reported by the caller
+    parser, fname, cache_dir = args
+    try:
+        if cache_dir:
+            # key is the content of the file and the version of the extractor
+            h = hashlib.sha256(('%s-%d:' % (parser, EXTRACTOR_VERSION)).encode())
+            with open(fname, 'rb') as fil:
+                h.update(fil.read())
+            cached = os.path.join(cache_dir, h.hexdigest() + '.json')
+            if os.path.exists(cached):
+                with open(cached) as fil:
+                    return json.load(fil), True, None
+        if parser == 'antlr':
+            # requires: pip install antlr4-python3-runtime
+            from antlr_dependencies import extract as extract_antlr
+            deps = extract_antlr(fname)
+        else:
+            deps = extract(fname)
+        if cache_dir:
+            tmp = '%s.%d.tmp' % (cached, os.getpid())
+            with open(tmp, 'w') as fil:
+                json.dump(deps, fil)
+            os.replace(tmp, cached)
+        return deps, False, None
+    except Exception:
+        return None, False, traceback.format_exc()
+
+
 def main():
 
     # parse args
@@ -122,32 +140,69 @@ def main():
                         help='raw output (default=false)')
     parser.add_argument('--separator', '-s', metavar='STR', type=str,
                         default=' ', help='separator between elements of lists (default=" ")')
+    parser.add_argument('--parser', choices=['lxml', 'antlr'], default=None,
+                        help='streaming lxml parser, or ANTLR grammar parser (default=lxml)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        default=1, help='parse files with N worker processes, 0 for all cores (default=1)')
+    parser.add_argument('--cache', metavar='CACHEDIR', type=str,
+                        default=None,
+                        help='cache dependencies of unchanged files in this directory (default=<none>)')
+    parser.add_argument('--registry', metavar='FILE', type=str,
+                        default=None,
+                        help='read dependencies from the registry of global types, '
+                        'changed files are parsed and updated in the registry (default=<none>)')
     args = parser.parse_args()
+    # the registry parses changed files itself, without cache
+    if args.registry and (args.cache or args.parser):
+        parser.error('--registry cannot be used with --cache or --parser')
 
-    all_deps = []
-    for f in args.inputs:
+    if args.registry:
+        from registry import Registry
         try:
-            input_stream = FileStream(f)
-            lexer = DfLexer(input_stream)
-            stream = CommonTokenStream(lexer)
-            parser = DfParser(stream)
-            parser.addErrorListener(ThrowingErrorListener())
-            tree = parser.datadef()
-            visitor = DependenciesVisitor()
-            deps = visitor.visitDatadef(tree)
-            # add filename as a dependency fo each type
-            for d in deps:
-                d.extend([f])
-            all_deps.extend(deps)
+            registry = Registry.load(args.registry)
+            if registry.update(args.inputs, args.jobs):
+                registry.save(args.registry)
         except Exception as e:
-            sys.stderr.write('failed to parse %s' % (f))
+            sys.stderr.write('failed to update registry %s\n' % (args.registry))
             traceback.print_exc(file=sys.stderr)
             exit(1)
+        return print_dependencies(args, registry.dependencies(args.inputs))
+
+    if args.cache:
+        os.makedirs(args.cache, exist_ok=True)
+
+    jobs = min(args.jobs or os.cpu_count(), len(args.inputs))
+    work = [(args.parser or 'lxml', f, args.cache) for f in args.inputs]
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(extract_file, work, chunksize=1)
+    else:
+        results = map(extract_file, work)
 
+    # gather results in the order of inputs
+    all_deps = []
+    cache_hits = 0
+    for f, (deps, cached, error) in zip(args.inputs, results):
+        if error:
+            sys.stderr.write('failed to parse %s\n%s' % (f, error))
+            exit(1)
+        cache_hits += cached
+        # add filename as a dependency fo each type
+        for d in deps:
+            d.extend([f])
+        all_deps.extend(deps)
+
+    if args.cache:
+        # on stderr, stdout is the graph
+        sys.stderr.write('dependency cache: %d hit(s), %d miss(es)\n' % (cache_hits, len(args.inputs) - cache_hits))
+
+    print_dependencies(args, all_deps)
+
+def print_dependencies(args, all_deps):
     try:
         if not args.plain:
             print('%d file(s), %d global types found' % (len(args.inputs), len(all_deps)))
-        
+
         # output 1 line per type
         for deplist in all_deps:
             print('%s%s%s' % (
@@ -160,6 +215,6 @@ def main():
     except Exception as e:
         traceback.print_exc(file=sys.stderr)
         exit(1)
- 
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,394 @@
+# Compact directed graph with nodes interned to integer ids.
+#
+# Forward and reverse adjacency are stored in CSR form: the neighbours of
+# node i are targets[offsets[i]:offsets[i+1]], in two flat arrays.
+#
+# A graph can be saved to a binary index file, which is memory-mapped
+# when loaded: the arrays are used in place, without parsing.
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from heapq import heappush, heappop
+from itertools import accumulate, chain
+
+# index file layout:
+#   header, then for each source file: fingerprint and path,
+#   then name table (offsets are implicit, names are separated by '\0'),
+#   then out_offsets, out_targets, in_offsets, in_targets as int32,
+#   each section aligned on 4 bytes
+INDEX_MAGIC = b'DAGIDX1' + (b'L' if sys.byteorder == 'little' else b'B')
+INDEX_HEADER = struct.Struct('<8sIIII')   # magic, files, nodes, edges, size of names
+INDEX_SOURCE = struct.Struct('<QQ32sI')   # size, mtime, sha256, length of path
+
+
+class NodeNotFound(KeyError):
+
+    def __str__(self):
+        return 'node %s is not in the graph' % (self.args[0])
+
+
+class Graph:
+    """Read-only directed graph over interned node names."""
+
+    def __init__(self, names, out_offsets, out_targets, in_offsets, in_targets):
+        # names: list of node names, then adjacency arrays in CSR form
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.out_offsets = out_offsets
+        self.out_targets = out_targets
+        self.in_offsets = in_offsets
+        self.in_targets = in_targets
+
+    @staticmethod
+    def from_successors(names, successors):
+        # successors: list of sets of target ids per node
+        predecessors = [[] for _ in names]
+        for i, targets in enumerate(successors):
+            for j in targets:
+                predecessors[j].append(i)
+        return Graph(names, *Graph._csr(successors), *Graph._csr(predecessors))
+
+    @staticmethod
+    def _csr(adjacency):
+        # flatten lists of neighbours into (offsets, targets) arrays
+        offsets = array('i', [0])
+        offsets.extend(accumulate(len(a) for a in adjacency))
+        return offsets, array('i', chain.from_iterable(adjacency))
+
+    @staticmethod
+    def from_files(fnames):
+        # each line of a dag file: <node> <dependency>...
+        def lines():
+            for fname in fnames:
+                with open(fname) as fil:
+                    for line in fil:
+                        yield line.split()
+        return Graph.from_dependencies(lines())
+
+    @staticmethod
+    def from_dependencies(deplists):
+        # lists of [node, dependency...], as in a dag file
+        # only nodes with at least one edge are part of the graph
+        builder = GraphBuilder()
+        for tokens in deplists:
+            if len(tokens) > 1:
+                builder.add_dependencies(tokens[0], tokens[1:])
+        return builder.build()
+
+    @staticmethod
+    def load(fnames, index=None):
+        # graph of dag files, from index file if it is up to date,
+        # else parsed from the files and saved to the index file
+        # return (graph, True if loaded from index)
+        sources = [source_fingerprint(f, digest=False) for f in fnames]
+        if index:
+            try:
+                graph, indexed = Graph.load_index(index)
+            except (OSError, ValueError, struct.error):
+                graph, indexed = None, None
+            if indexed is not None and len(indexed) == len(sources):
+                if [f[:3] for f in indexed] == [f[:3] for f in sources]:
+                    return graph, True
+                # touched files with the same content are still indexed
+                sources = [source_fingerprint(f) for f in fnames]
+                if [(p, s, h) for p, s, _, h in indexed] == [(p, s, h) for p, s, _, h in sources]:
+                    # copy the arrays out of the old index, and unmap it before replacing it
+                    mapped = [graph.out_offsets, graph.out_targets, graph.in_offsets, graph.in_targets]
+                    graph = Graph(graph.names, *(array('i', values.tobytes()) for values in mapped))
+                    for values in mapped:
+                        values.release()
+                    graph._try_save_index(index, sources)
+                    return graph, True
+        graph = Graph.from_files(fnames)
+        if index:
+            graph._try_save_index(index, [source_fingerprint(f) for f in fnames])
+        return graph, False
+
+    def _try_save_index(self, fname, sources):
+        try:
+            self.save_index(fname, sources)
+        except OSError:
+            # index is only an optimization
+            pass
+
+    def save_index(self, fname, sources):
+        # sources: fingerprints of the dag files of this graph
+        out = bytearray(INDEX_HEADER.pack(
+            INDEX_MAGIC, len(sources), len(self.names), len(self.out_targets), 0))
+        for path, size, mtime, sha in sources:
+            encoded = path.encode()
+            out += INDEX_SOURCE.pack(size, mtime, sha or bytes(32), len(encoded)) + encoded
+        names = '\0'.join(self.names).encode()
+        out += bytes(-len(out) % 4) + names + bytes(-len(names) % 4)
+        struct.pack_into('<I', out, INDEX_HEADER.size - 4, len(names))
+        for values in [self.out_offsets, self.out_targets, self.in_offsets, self.in_targets]:
+            out += array('i', values).tobytes()
+        tmp = '%s.%d.tmp' % (fname, os.getpid())
+        with open(tmp, 'wb') as fil:
+            fil.write(out)
+        os.replace(tmp, fname)
+
+    @staticmethod
+    def load_index(fname):
+        # return (graph, fingerprints of its dag files)
+        with open(fname, 'rb') as fil:
+            view = memoryview(mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, nfiles, nodes, edges, size = INDEX_HEADER.unpack_from(view, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('%s: not a graph index' % (fname))
+        pos = INDEX_HEADER.size
+        sources = []
+        for _ in range(nfiles):
+            fsize, mtime, sha, length = INDEX_SOURCE.unpack_from(view, pos)
+            pos += INDEX_SOURCE.size
+            sources.append((bytes(view[pos:pos+length]).decode(), fsize, mtime, sha))
+            pos += length
+        pos += -pos % 4
+        names = bytes(view[pos:pos+size]).decode().split('\0') if nodes else []
+        pos += size + (-size % 4)
+        # arrays are cast in place: check their size first
+        if len(names) != nodes or pos + 4 * (2 * (nodes + 1) + 2 * edges) != len(view):
+            raise ValueError('%s: corrupted graph index' % (fname))
+        arrays = []
+        for count in [nodes + 1, edges, nodes + 1, edges]:
+            arrays.append(view[pos:pos+4*count].cast('i'))
+            pos += 4 * count
+        return Graph(names, *arrays), sources
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def number_of_edges(self):
+        return len(self.out_targets)
+
+    def node_id(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            raise NodeNotFound(name) from None
+
+    def successor_ids(self, i):
+        return self.out_targets[self.out_offsets[i]:self.out_offsets[i+1]]
+
+    def predecessor_ids(self, i):
+        return self.in_targets[self.in_offsets[i]:self.in_offsets[i+1]]
+
+    def in_degree(self, i):
+        return self.in_offsets[i+1] - self.in_offsets[i]
+
+    def out_degree(self, i):
+        return self.out_offsets[i+1] - self.out_offsets[i]
+
+    def _reach(self, starts, offsets, targets):
+        # ids reachable from starts, excluding starts unless on a cycle
+        seen = bytearray(len(self.names))
+        stack = list(starts)
+        found = []
+        while stack:
+            i = stack.pop()
+            for j in targets[offsets[i]:offsets[i+1]]:
+                if not seen[j]:
+                    seen[j] = 1
+                    found.append(j)
+                    stack.append(j)
+        return found
+
+    def ancestor_ids(self, i):
+        return [j for j in self._reach([i], self.in_offsets, self.in_targets) if j != i]
+
+    def descendant_ids(self, i):
+        return [j for j in self._reach([i], self.out_offsets, self.out_targets) if j != i]
+
+    def distances_to(self, target):
+        # number of edges from each node to target, -1 if target is not reachable
+        dist = array('i', [-1]) * len(self.names)
+        dist[target] = 0
+        level = [target]
+        d = 0
+        while level:
+            d += 1
+            next_level = []
+            for i in level:
+                for j in self.predecessor_ids(i):
+                    if dist[j] < 0:
+                        dist[j] = d
+                        next_level.append(j)
+            level = next_level
+        return dist
+
+    def simple_paths(self, source, target, max_depth=None):
+        # all paths from source to target without repeated nodes, as lists of ids,
+        # depth-first and only through nodes that reach target within max_depth edges
+        dist = self.distances_to(target)
+        limit = len(self.names) if max_depth is None else max_depth
+        if dist[source] < 0 or dist[source] > limit:
+            return
+        if source == target:
+            yield [source]
+            return
+        path = [source]
+        on_path = bytearray(len(self.names))
+        on_path[source] = 1
+        stack = [iter(self.successor_ids(source))]
+        while stack:
+            j = next(stack[-1], None)
+            if j is None:
+                stack.pop()
+                on_path[path.pop()] = 0
+            elif j == target:
+                yield path + [j]
+            elif not on_path[j] and 0 <= dist[j] <= limit - len(path):
+                path.append(j)
+                on_path[j] = 1
+                stack.append(iter(self.successor_ids(j)))
+
+    def shortest_paths(self, source, target, max_depth=None):
+        # paths from source to target without repeated nodes, by increasing length:
+        # best-first search, the distance to target being a lower bound of the rest
+        dist = self.distances_to(target)
+        limit = len(self.names) if max_depth is None else max_depth
+        if dist[source] < 0 or dist[source] > limit:
+            return
+        heap = [(dist[source], (source,))]
+        while heap:
+            _, path = heappop(heap)
+            i = path[-1]
+            if i == target:
+                yield list(path)
+                continue
+            for j in self.successor_ids(i):
+                if 0 <= dist[j] <= limit - len(path) and j not in path:
+                    heappush(heap, (len(path) + dist[j], path + (j,)))
+
+    def level_ids(self, ids):
+        # topological layering of the subgraph of ids: each node is one
+        # level above its highest predecessor in the subgraph
+        # return list of levels, as lists of ids
+        member = bytearray(len(self.names))
+        for i in ids:
+            member[i] = 1
+        pending = {i: sum(member[j] for j in self.predecessor_ids(i)) for i in ids}
+        levels = []
+        level = [i for i, count in pending.items() if count == 0]
+        while level:
+            levels.append(level)
+            next_level = []
+            for i in level:
+                for j in self.successor_ids(i):
+                    if member[j]:
+                        pending[j] -= 1
+                        if pending[j] == 0:
+                            next_level.append(j)
+            level = next_level
+        if sum(len(l) for l in levels) != len(pending):
+            placed = set(chain.from_iterable(levels))
+            cycle = sorted(self.names[i] for i in pending if i not in placed)
+            raise Exception('cycle in the graph, nodes not ordered: %s' % (' '.join(cycle)))
+        return levels
+
+    def critical_path_ids(self, levels):
+        # a longest chain of the layering, one node per level
+        if not levels:
+            return []
+        level_of = {i: n for n, level in enumerate(levels) for i in level}
+        path = [min(levels[-1], key=lambda i: self.names[i])]
+        for n in range(len(levels) - 2, -1, -1):
+            path.append(min((j for j in self.predecessor_ids(path[-1]) if level_of.get(j) == n),
+                            key=lambda j: self.names[j]))
+        return path[::-1]
+
+    # queries by name
+
+    def ancestors(self, name):
+        return {self.names[j] for j in self.ancestor_ids(self.node_id(name))}
+
+    def descendants(self, name):
+        return {self.names[j] for j in self.descendant_ids(self.node_id(name))}
+
+    def edges(self):
+        # all edges as (source name, target name)
+        for i, name in enumerate(self.names):
+            for j in self.successor_ids(i):
+                yield name, self.names[j]
+
+    def successors(self, name):
+        return {self.names[j] for j in self.successor_ids(self.node_id(name))}
+
+    def sources(self, names=None):
+        # nodes with no predecessor, among names or in the whole graph
+        ids = range(len(self.names)) if names is None else map(self.node_id, names)
+        return {self.names[i] for i in ids if self.in_degree(i) == 0}
+
+    def sinks(self):
+        return {self.names[i] for i in range(len(self.names)) if self.out_degree(i) == 0}
+
+    def levels(self, names):
+        # topological layering of names, as sorted lists of names
+        levels = self.level_ids([self.node_id(n) for n in names])
+        return [sorted(self.names[i] for i in level) for level in levels]
+
+    def critical_path(self, levels):
+        ids = [[self.node_id(n) for n in level] for level in levels]
+        return [self.names[i] for i in self.critical_path_ids(ids)]
+
+    def all_simple_paths(self, source, target, max_depth=None):
+        for path in self.simple_paths(self.node_id(source), self.node_id(target), max_depth):
+            yield [self.names[i] for i in path]
+
+    def all_shortest_paths(self, source, target, max_depth=None):
+        for path in self.shortest_paths(self.node_id(source), self.node_id(target), max_depth):
+            yield [self.names[i] for i in path]
+
+
+class GraphBuilder:
+    """Interns node names and collects edges of a Graph."""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        # set of target ids per node
+        self.successors = []
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.successors.append(set())
+        return i
+
+    def add_edge(self, source, target):
+        self.successors[self.intern(source)].add(self.intern(target))
+        return self
+
+    def add_dependencies(self, node, deps):
+        # edges from each of deps to node
+        target = self.intern(node)
+        ids = self.ids
+        successors = self.successors
+        for dep in deps:
+            i = ids.get(dep)
+            if i is None:
+                i = self.intern(dep)
+            successors[i].add(target)
+        return self
+
+    def build(self):
+        return Graph.from_successors(self.names, self.successors)
+
+
+def source_fingerprint(fname, digest=True):
+    # (path, size, mtime, sha256 of content or None) of a dag file
+    st = os.stat(fname)
+    sha = None
+    if digest:
+        with open(fname, 'rb') as fil:
+            sha = hashlib.sha256(fil.read()).digest()
+    return os.path.abspath(fname), st.st_size, st.st_mtime_ns, sha
@@ -1,29 +1,91 @@
 #!/usr/bin/python3
 
+import io
+import os
+import re
 import sys
+import glob
+import time
+import filecmp
 import argparse
+import traceback
+import contextlib
+import multiprocessing
 from lxml import etree
 
-def parse_type(xml, fd):
+from registry import Registry, symbol
+
+
+def index_children(xml, attribute):
+    # element children by value of attribute, in document order
+    index = {}
+    for child in xml.iterchildren(etree.Element):
+        value = child.get(attribute)
+        if value is not None:
+            index.setdefault(value, []).append(child)
+    return index
+
+
+class Index:
+    """Global types of a structure file by type-name, and their fields and methods by name."""
+
+    def __init__(self, xml=None):
+        self.types = index_children(xml, 'type-name') if xml is not None else {}
+        # type -> (fields, vmethods), built on first lookup
+        self.members = {}
+
+    def find_types(self, tname):
+        return self.types.get(tname, [])
+
+    def _members(self, xml):
+        members = self.members.get(xml)
+        if members is None:
+            methods = {}
+            for vmethods in xml.iterchildren('virtual-methods'):
+                for name, elts in index_children(vmethods, 'name').items():
+                    methods.setdefault(name, []).extend(e for e in elts if e.tag == 'vmethod')
+            members = self.members[xml] = (index_children(xml, 'name'), methods)
+        return members
+
+    def find_fields(self, xml, fname):
+        return self._members(xml)[0].get(fname, [])
+
+    def find_methods(self, xml, method):
+        return self._members(xml)[1].get(method, [])
+
+
+def read_spec(fd):
+    # types of an export spec and the field lines following each of them:
+    # [(type name, [lines])], in order
+    spec = []
+    lines = None
+    for line in fd:
+        if line[0] == '\t':
+            if lines is not None:
+                lines.append(line)
+            continue
+        lines = None
+        tokens = line.split()
+        if tokens and tokens[0][0] != '#':
+            lines = []
+            spec.append((tokens[0], lines))
+    return spec
+
+def parse_type(xml, lines, index):
     tname = xml.get('type-name')
     xml.set('export', 'true')
-    pos = fd.tell()
-    line = fd.readline()
     count = 0
     warnings = 0
-    while line:
-        if line[0] != '\t':
-            fd.seek(pos)
-            break
+    for line in lines:
         tokens = line.split()
         if tokens and tokens[0][0] != '#':
             # look for field with same name
             fname = tokens[0]
-            fields = xml.findall('./*[@name="%s"]' % (fname))
+            fields = index.find_fields(xml, fname)
             if not fields:
                 # look for method
                 method = 'get'+fname[0].upper()+fname[1:]
-                fields = xml.findall('./virtual-methods/vmethod[@name="%s"]' % (method))
+                fields = index.find_methods(xml, method)
             if len(fields) > 1:
                 sys.stderr.write('warning: %d elements found for field name <%s>\n' % (len(fields), fname))
                 warnings += 1
@@ -41,50 +103,224 @@ def parse_type(xml, fd):
             else:
                 sys.stderr.write('type %s: field <%s> not found\n' % (tname, fname))
                 warnings += 1
-        pos = fd.tell()
-        line = fd.readline()
     sys.stderr.write('type %s: %d field(s) exported\n' % (tname, count))
     return warnings
-    
-def parse_structure(fd, xml):
-    line = fd.readline()
+
+def check_types(tname, count):
+    # warnings about the number of global types matching a type of the export spec
+    if count > 1:
+        sys.stderr.write('warning: %d elements found for type name <%s>\n' % (count, tname))
+        return 1
+    if not count:
+        sys.stderr.write('type <%s> not found\n' % (tname))
+        return 1
+    return 0
+
+def parse_structure(fd, xml, index=None):
+    index = index or Index(xml)
     warnings = 0
-    while line:
-        tokens = line.split()
-        if tokens and tokens[0][0] != '#' and line[0] != '\t':
-            # look for type with same name
-            tname = tokens[0]
-            types = xml.findall('./*[@type-name="%s"]' % (tname))
-            if len(types) > 1:
-                sys.stderr.write('warning: %d elements found for type name <%s>\n' % (len(types), tname))
-                warnings += 1
-            if types:
-                warnings += parse_type(types[0], fd)
-            else:
-                sys.stderr.write('type <%s> not found\n' % (tname))
-                warnings += 1
-        line = fd.readline()
+    for tname, lines in read_spec(fd):
+        # look for type with same name
+        types = index.find_types(tname)
+        warnings += check_types(tname, len(types))
+        if types:
+            warnings += parse_type(types[0], lines, index)
+    return warnings
+
+def merge_stream(fname, spec, out, symbols=None):
+    # merge export spec into structure file fname, one global type at a time:
+    # a type is written to binary stream out and freed once merged, the output
+    # is the same as a pretty printed write of the tree merged by parse_structure()
+    # symbols: list of registry records of merged types, filled in the same pass
+    types = {}
+    for tname, lines in spec:
+        types.setdefault(tname, []).append(lines)
+    found = dict.fromkeys(types, 0)
+    warnings = 0
+    root = None
+    close = None
+    depth = 0
+
+    def write_head():
+        # start tag and text of the root, once its first child is reached
+        nonlocal close
+        if close is None:
+            head = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+            head.text = root.text or ''
+            head = etree.tostring(head)
+            close = head[head.rindex(b'</'):]
+            out.write(head[:-len(close)])
+
+    def write_children(last=None):
+        # write children of the root before last, their tails are complete
+        write_head()
+        while len(root) and root[0] is not last:
+            out.write(etree.tostring(root[0]))
+            del root[0]
+
+    for event, elem in etree.iterparse(fname, events=('start', 'end', 'comment', 'pi')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = elem
+            elif depth == 2:
+                write_head()
+        elif event == 'end':
+            depth -= 1
+            if depth == 1:
+                tname = elem.get('type-name')
+                if tname in found:
+                    found[tname] += 1
+                    if found[tname] == 1:
+                        for lines in types[tname]:
+                            warnings += parse_type(elem, lines, Index())
+                sym = symbol(elem) if symbols is not None else None
+                if sym:
+                    symbols.append(sym)
+                write_children(elem)
+            elif depth == 0:
+                write_children()
+                out.write(close + b'\n')
+        elif depth == 0:
+            # comments and processing instructions around the root
+            out.write(etree.tostring(elem) + b'\n')
+        elif depth == 1:
+            write_head()
+    for tname, count in found.items():
+        warnings += check_types(tname, count)
     return warnings
 
+
+def pair_files(xml_dir, export_dir, pattern='df.*.xml'):
+    # structure files of xml_dir and their export spec in export_dir: [(xml, export or None)]
+    pairs = []
+    for xml_file in sorted(glob.glob(os.path.join(xml_dir, pattern))):
+        m = re.match(r'df\.(.+)\.xml$', os.path.basename(xml_file))
+        export_file = m and os.path.join(export_dir, m.group(1) + '.export')
+        pairs.append((xml_file, export_file if export_file and os.path.exists(export_file) else None))
+    return pairs
+
+def merge_file(args):
+    # merge a structure file in a worker process, the output is only replaced if its content changed
+    # return (seconds, warnings, True if updated, symbols of merged types, messages, error)
+    xml_file, export_file, output = args
+    start = time.perf_counter()
+    messages = io.StringIO()
+    symbols = []
+    tmp = '%s.%d.tmp' % (output, os.getpid())
+    try:
+        with open(export_file, 'r') as fd:
+            spec = read_spec(fd)
+        with open(tmp, 'wb') as out, contextlib.redirect_stderr(messages):
+            warnings = merge_stream(xml_file, spec, out, symbols)
+        updated = False
+        if not warnings and not (os.path.exists(output) and filecmp.cmp(tmp, output, shallow=False)):
+            os.replace(tmp, output)
+            updated = True
+        return time.perf_counter() - start, warnings, updated, symbols, messages.getvalue(), None
+    except Exception:
+        return time.perf_counter() - start, 1, False, None, messages.getvalue(), traceback.format_exc()
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def main_batch(argv):
+
+    # parse args
+    parser = argparse.ArgumentParser(prog='merge.py batch',
+                                     description='Declare exported fields in all DF structures that have a description.')
+    parser.add_argument('xml_dir', metavar='XMLDIR', type=str,
+                        help='directory of DF structure xml files')
+    parser.add_argument('export_dir', metavar='EXPORTDIR', type=str,
+                        help='directory of descriptions of exported elements: <name>.export for df.<name>.xml')
+    parser.add_argument('outdir', metavar='OUTDIR', type=str,
+                        help='output directory of merged xml files, unchanged files are not rewritten')
+    parser.add_argument('--filter', metavar='PATTERN', type=str, default='df.*.xml',
+                        help='structure files of XMLDIR (default=df.*.xml)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        default=1, help='merge files with N worker processes, 0 for all cores (default=1)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                        help='no report per file (default: False)')
+    parser.add_argument('--registry', metavar='FILE', type=str, default=None,
+                        help='update the registry of global types of merged files, '
+                        'and of structure files without export spec (default=<none>)')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    pairs = pair_files(args.xml_dir, args.export_dir, args.filter)
+    work = [(x, e, os.path.join(args.outdir, os.path.basename(x))) for x, e in pairs if e]
+    start = time.perf_counter()
+    jobs = min(args.jobs or os.cpu_count(), len(work))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(merge_file, work)
+    else:
+        pool = None
+        results = map(merge_file, work)
+
+    # report in the order of files
+    rc = 0
+    updated = 0
+    registry = Registry.load(args.registry) if args.registry else None
+    for (xml_file, _, output), (seconds, warnings, changed, symbols, messages, error) in zip(work, results):
+        if warnings or error:
+            sys.stderr.write(messages + (error or ''))
+            rc = 1
+        elif registry:
+            registry.add_file(output, symbols)
+        updated += changed
+        if not args.quiet:
+            status = 'failed' if warnings or error else 'updated' if changed else 'unchanged'
+            sys.stdout.write('%-40s %9.1f ms  %s\n' % (os.path.basename(xml_file), seconds*1000, status))
+    if pool:
+        pool.close()
+        pool.join()
+    if registry:
+        # structure files used as they are
+        registry.update([x for x, e in pairs if not e], args.jobs)
+        registry.save(args.registry)
+    if not args.quiet:
+        sys.stdout.write('%d file(s) merged, %d updated, %d without export spec, %.1f ms\n' % (
+            len(work), updated, len(pairs) - len(work), (time.perf_counter() - start)*1000))
+    sys.exit(rc)
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        return main_batch(sys.argv[2:])
+
     # parse args
     parser = argparse.ArgumentParser(description='Declare exported fields in DF structure.')
     parser.add_argument('input1', metavar='FILE1', type=str,
                         help='DF structure xml file')
     parser.add_argument('input2', metavar='FILE2', type=str,
                         help='description of exported elements')
+    parser.add_argument('--output', '-o', metavar='FILE', type=str, default=None,
+                        help='write merged xml to FILE, left unchanged on warnings (default=stdout, nothing written on warnings)')
     args = parser.parse_args()
-    
-    # parse xml and add export attributes
-    xml = etree.parse(args.input1).getroot()
+
     with open(args.input2, 'r') as fd:
-        warnings = parse_structure(fd, xml)
+        spec = read_spec(fd)
+
+    # stream xml with export attributes added
+    if args.output:
+        tmp = '%s.%d.tmp' % (args.output, os.getpid())
+        try:
+            with open(tmp, 'wb') as out:
+                warnings = merge_stream(args.input1, spec, out)
+            if not warnings:
+                os.replace(tmp, args.output)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    else:
+        # buffered, so that nothing is written on warnings either
+        out = io.BytesIO()
+        warnings = merge_stream(args.input1, spec, out)
+        if not warnings:
+            sys.stdout.buffer.write(out.getvalue())
 
     if warnings > 0:
         sys.exit(1)
 
-    # reexport base tree
-    etree.ElementTree(xml).write(sys.stdout.buffer, pretty_print=True)
-
 if __name__ == "__main__":
     main()
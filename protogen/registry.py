@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# Symbol table of the global types of DF structure files, parsed once and
+# shared by merge.py, dependencies.py, dag.py and protogen.py instead of
+# parsing the same files again.
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import multiprocessing
+from lxml import etree
+
+from dependencies import type_dependencies
+
+# part of the registry file, increment when symbols change
+REGISTRY_VERSION = 1
+
+
+def symbol(elem):
+    # record of a global type element, None if it has no type-name
+    tname = elem.get('type-name')
+    if tname is None or elem.tag == 'global-object':
+        return None
+    key = elem.get('key-field')
+    if key is None and elem.find('./*[@name="id"]') is not None:
+        key = 'id'
+    return {
+        'name': tname,
+        'meta': elem.tag,
+        'export': elem.get('export'),
+        'instance-vector': elem.get('instance-vector'),
+        'key-field': key,
+        'inherits-from': elem.get('inherits-from'),
+        'dependencies': type_dependencies(elem),
+    }
+
+def scan(fname):
+    # symbols of a structure file, parsed one global type at a time
+    symbols = []
+    depth = 0
+    for event, elem in etree.iterparse(fname, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            sym = symbol(elem)
+            if sym:
+                symbols.append(sym)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    return symbols
+
+def fingerprint(fname):
+    # [size, mtime, sha256 of content] of a structure file
+    st = os.stat(fname)
+    with open(fname, 'rb') as fil:
+        sha = hashlib.sha256(fil.read()).hexdigest()
+    return [st.st_size, st.st_mtime_ns, sha]
+
+def scan_file(fname):
+    # worker process: (fingerprint, symbols) of a structure file
+    return fingerprint(fname), scan(fname)
+
+
+class Registry:
+    """Global types of structure files, by file in document order and by name."""
+
+    def __init__(self):
+        # absolute path -> {'fingerprint': [size, mtime, sha256], 'types': [symbols]}
+        self.files = {}
+        self._types = None
+
+    @property
+    def types(self):
+        # name -> symbol with its file, types defined twice belong to the first file
+        if self._types is None:
+            self._types = {}
+            for path, entry in self.files.items():
+                for sym in entry['types']:
+                    self._types.setdefault(sym['name'], dict(sym, file=path))
+        return self._types
+
+    def add_file(self, fname, symbols, fprint=None):
+        self.files[os.path.abspath(fname)] = {'fingerprint': fprint or fingerprint(fname), 'types': symbols}
+        self._types = None
+        return self
+
+    def is_current(self, fname):
+        # True if the file is unchanged since it was scanned, even if touched
+        entry = self.files.get(os.path.abspath(fname))
+        if entry is None:
+            return False
+        try:
+            st = os.stat(fname)
+            if entry['fingerprint'][:2] == [st.st_size, st.st_mtime_ns]:
+                return True
+            fprint = fingerprint(fname)
+        except OSError:
+            return False
+        if fprint[0] == entry['fingerprint'][0] and fprint[2] == entry['fingerprint'][2]:
+            entry['fingerprint'] = fprint
+            return True
+        return False
+
+    def update(self, fnames, jobs=1):
+        # scan structure files that are new or changed
+        # return number of scanned files
+        changed = [f for f in fnames if not self.is_current(f)]
+        jobs = min(jobs or os.cpu_count(), len(changed))
+        if jobs > 1:
+            with multiprocessing.Pool(jobs) as pool:
+                results = pool.map(scan_file, changed, chunksize=1)
+        else:
+            results = map(scan_file, changed)
+        for fname, (fprint, symbols) in zip(changed, results):
+            self.add_file(fname, symbols, fprint)
+        return len(changed)
+
+    def prune(self, fnames):
+        # forget files other than fnames, keep the order of fnames
+        self.files = {os.path.abspath(f): self.files[os.path.abspath(f)] for f in fnames
+                      if os.path.abspath(f) in self.files}
+        self._types = None
+        return self
+
+    def symbols(self, fname):
+        # symbols of a structure file, in document order
+        entry = self.files.get(os.path.abspath(fname))
+        return entry['types'] if entry else []
+
+    def find(self, tname):
+        return self.types.get(tname)
+
+    def exported(self, fname=None):
+        # names of exported types, of a file or of all files
+        syms = self.symbols(fname) if fname else self.types.values()
+        return [s['name'] for s in syms if s['export'] == 'true']
+
+    def dependencies(self, fnames=None):
+        # dependencies of exported types as listed by dependencies.py:
+        # [type, dependencies..., fname] in the order of fnames (default: all files)
+        return [sym['dependencies'] + [f] for f in fnames or self.files
+                for sym in self.symbols(f) if sym['dependencies']]
+
+    @staticmethod
+    def load(fname):
+        # registry saved in fname, empty if missing or from another version
+        registry = Registry()
+        try:
+            with open(fname) as fil:
+                data = json.load(fil)
+        except (OSError, ValueError):
+            return registry
+        if data.get('version') == REGISTRY_VERSION:
+            registry.files = data['files']
+        return registry
+
+    def save(self, fname):
+        tmp = '%s.%d.tmp' % (fname, os.getpid())
+        with open(tmp, 'w') as fil:
+            json.dump({'version': REGISTRY_VERSION, 'files': self.files}, fil, separators=(',', ':'))
+        os.replace(tmp, fname)
+
+
+def main():
+
+    # parse args
+    parser = argparse.ArgumentParser(description='Build the registry of global types of DFHack structure files.')
+    parser.add_argument('inputs', metavar='INFILE', type=str, nargs='+',
+                        help='DFHack structure XML file')
+    parser.add_argument('--output', '-o', metavar='FILE', type=str, required=True,
+                        help='registry file, only changed structure files are parsed again, other files are removed')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int,
+                        default=1, help='parse files with N worker processes, 0 for all cores (default=1)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                        help='no output (default: False)')
+    args = parser.parse_args()
+
+    registry = Registry.load(args.output)
+    scanned = registry.update(args.inputs, args.jobs)
+    registry.prune(args.inputs).save(args.output)
+    if not args.quiet:
+        sys.stdout.write('%d file(s), %d parsed, %d global types, %d exported\n' % (
+            len(args.inputs), scanned, len(registry.types), len(registry.exported())))
+
+
+if __name__ == '__main__':
+    main()
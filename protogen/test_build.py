@@ -0,0 +1,165 @@
+#!/bin/python3
+
+import io
+import os
+import re
+import sys
+import tempfile
+import unittest
+import contextlib
+import subprocess
+import multiprocessing
+
+import build
+import corpus
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def append(fname, text):
+    with open(fname, 'a') as fil:
+        fil.write(text)
+
+
+def generate(depfile, fnames):
+    # write fnames, and a depfile listing them as generated
+    for fname in fnames:
+        append(fname, 'generated')
+    with open(depfile, 'w') as fil:
+        fil.write(' \\\n'.join(f.replace(' ', '\\ ') for f in fnames) + ': \\\n  input\n')
+
+
+class TestBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def task(self, name, deps=()):
+        # task appending its name to its output file
+        output = os.path.join(self.tmp.name, name)
+        return build.Task(name, 'test', append, (output, name), [], [output], deps)
+
+    def run_tasks(self, tasks, state, force=False):
+        timings = []
+        results = build.schedule(tasks, None, state, timings, force, quiet=True)
+        return results, [name for _, name, seconds in timings if seconds is not None]
+
+    def test_schedule(self):
+        tasks = [self.task('c', ['a', 'b']), self.task('b', ['a']), self.task('a')]
+        state = {}
+        results, ran = self.run_tasks(tasks, state)
+        self.assertListEqual(ran, ['a', 'b', 'c'])
+        self.assertSetEqual(set(results), {'a', 'b', 'c'})
+        # unchanged tasks are skipped, unless forced or an output is missing
+        self.assertListEqual(self.run_tasks(tasks, state)[1], [])
+        self.assertListEqual(self.run_tasks(tasks, state, force=True)[1], ['a', 'b', 'c'])
+        os.remove(os.path.join(self.tmp.name, 'b'))
+        self.assertListEqual(self.run_tasks(tasks, state)[1], ['b'])
+
+    def test_inputs(self):
+        source = os.path.join(self.tmp.name, 'source')
+        append(source, 'v1')
+        task = self.task('a')
+        task.inputs = [source]
+        state = {}
+        self.assertListEqual(self.run_tasks([task], state)[1], ['a'])
+        os.utime(source, (0, 0))
+        self.assertListEqual(self.run_tasks([task], state)[1], [])
+        append(source, 'v2')
+        self.assertListEqual(self.run_tasks([task], state)[1], ['a'])
+
+    def test_depfile(self):
+        # generated files are only known from the depfile of the task
+        depfile = os.path.join(self.tmp.name, 'a.d')
+        generated = [os.path.join(self.tmp.name, f) for f in ['x', 'y z']]
+        task = build.Task('a', 'test', generate, (depfile, generated), [], [depfile], depfile=depfile)
+        state = {}
+        self.assertListEqual(self.run_tasks([task], state)[1], ['a'])
+        self.assertListEqual(task.generated(), [depfile] + generated)
+        self.assertListEqual(self.run_tasks([task], state)[1], [])
+        os.remove(generated[1])
+        self.assertListEqual(self.run_tasks([task], state)[1], ['a'])
+        os.remove(depfile)
+        self.assertListEqual(self.run_tasks([task], state)[1], ['a'])
+
+    def test_merge_tasks(self):
+        # merged files depend on the modules producing them and their symbols
+        tasks, structures = build.merge_tasks([('df.a.xml', 'a.export'), ('df.b.xml', None)], self.tmp.name)
+        self.assertListEqual(structures, [os.path.join(self.tmp.name, 'df.a.xml'), 'df.b.xml'])
+        self.assertListEqual([os.path.basename(f) for f in tasks[0].inputs],
+                             ['df.a.xml', 'a.export', 'merge.py', 'registry.py', 'dependencies.py'])
+
+    def test_failure(self):
+        # dependents of a failed task are not run, and it is run again next time
+        tasks = [self.task('a'), self.task('b', ['a']), self.task('c')]
+        tasks[0].args = (os.path.join(self.tmp.name, 'missing', 'a'), 'a')
+        state = {}
+        with contextlib.redirect_stderr(io.StringIO()) as err:
+            results, ran = self.run_tasks(tasks, state)
+        self.assertIn('a failed', err.getvalue())
+        self.assertIsNone(results)
+        self.assertListEqual(ran, ['a', 'c'])
+        self.assertNotIn('a', state)
+
+    def test_pool_failure(self):
+        # arguments that cannot be sent to the pool fail the task instead of blocking the build
+        tasks = [self.task('a'), self.task('b', ['a'])]
+        tasks[0].args = (os.path.join(self.tmp.name, 'a'), lambda: 'a')
+        with multiprocessing.Pool(1) as pool, contextlib.redirect_stderr(io.StringIO()) as err:
+            results = build.schedule(tasks, pool, {}, [], quiet=True)
+        self.assertIsNone(results)
+        self.assertRegex(err.getvalue(), r"^a failed\n.*Can't pickle")
+
+    def test_main(self):
+        crp = corpus.Corpus(types=100, files=3, seed=5)
+        crp.write(self.tmp.name)
+        # stands in for the lowering transforms of dfhack: the lowered corpus file
+        # of the structure file, identified by its first type
+        xslt = os.path.join(self.tmp.name, 'lower.xslt')
+        with open(xslt, 'w') as fil:
+            fil.write('<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">'
+                      '<xsl:template match="/"><xsl:choose>')
+            for name in crp.files():
+                fil.write('<xsl:when test="/*/*[1]/@type-name=\'%s\'"><xsl:copy-of select="document(\'%s\')"/></xsl:when>' % (
+                    crp.types_of(name)[0].name, os.path.join(self.tmp.name, 'df.%s.lowered.xml' % (name))))
+            fil.write('</xsl:choose></xsl:template></xsl:stylesheet>')
+        types = os.path.join(self.tmp.name, 'exported.types')
+        exported = [t.name for t in crp.types if t.exported and t.kind == 'struct']
+        with open(types, 'w') as fil:
+            fil.write('# comment\n%s\n' % (' '.join(exported[-3:])))
+        # a type without generated files, in the structure file of an exported type
+        fname = [f for f in crp.files() if exported[-1] in [t.name for t in crp.types_of(f)]][0]
+        ignored = [t.name for t in crp.types_of(fname) if t.exported and t.name not in exported[-3:]][0]
+        exceptions = os.path.join(self.tmp.name, 'exceptions.conf')
+        with open(exceptions, 'w') as fil:
+            fil.write('ignore /ld:data-definition/ld:global-type[@type-name="%s"]\n' % (ignored))
+        out = os.path.join(self.tmp.name, 'out')
+        cmd = [sys.executable, os.path.join(HERE, 'build.py'), self.tmp.name, '-o', out,
+               '--patch', self.tmp.name, '--filter', 'df.bench?.xml', '--types', types, '--transform', xslt,
+               '--exceptions', exceptions, '--methods', os.path.join(out, 'methods.inc'), '--protoc=', '-j', '2', '-q']
+        first = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertRegex(first, r'merge +3 +0 ')
+        self.assertRegex(first, r'protogen +[1-3] +0 ')
+        for tname in exported[-3:]:
+            self.assertTrue(os.path.exists(os.path.join(out, 'proto', tname + '.proto')))
+            self.assertTrue(os.path.exists(os.path.join(out, 'src', tname + '.cpp')))
+        self.assertFalse(os.path.exists(os.path.join(out, 'proto', ignored + '.proto')))
+        with open(os.path.join(out, 'proto', 'RemoteLegends.proto')) as fil:
+            self.assertIn('package RemoteLegends', fil.read())
+        second = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertRegex(second, r'merge +3 +3 ')
+        self.assertRegex(second, r'concat +2 +2 ')
+        protogen = int(re.search(r'protogen +([1-3]) ', first).group(1))
+        self.assertRegex(second, r'protogen +%d +%d ' % (protogen, protogen))
+        # a deleted generated file is generated again
+        os.remove(os.path.join(out, 'proto', exported[-1] + '.proto'))
+        third = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertRegex(third, r'protogen +%d +%d ' % (protogen, protogen - 1))
+        self.assertTrue(os.path.exists(os.path.join(out, 'proto', exported[-1] + '.proto')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+#!/bin/python3
+
+import os
+import sys
+import random
+import json
+import tempfile
+import unittest
+import subprocess
+from array import array
+
+import dag
+from graph import Graph, GraphBuilder, NodeNotFound
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def brute_force_paths(G, source, target, path=None):
+    # all paths from source to target without repeated nodes
+    path = path or [source]
+    if source == target:
+        yield path
+        return
+    for n in sorted(G.successors(source)):
+        if n not in path:
+            yield from brute_force_paths(G, n, target, path + [n])
+
+
+class TestDag(unittest.TestCase):
+
+    # each line: node, then the nodes it depends on
+    DAG = """b a
+c a
+d b c
+e d
+f a e
+g d
+"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, 'test.dag')
+        with open(self.fname, 'w') as fil:
+            fil.write(self.DAG)
+        self.G = Graph.from_files([self.fname])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def dag(self, *args):
+        # output of dag.py on the test graph
+        cmd = [sys.executable, os.path.join(HERE, 'dag.py'), self.fname] + list(args)
+        return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+    def test_csr(self):
+        # a -> b, a -> c, b -> d, c -> d
+        G = Graph(['a', 'b', 'c', 'd'],
+                  array('i', [0, 2, 3, 4, 4]), array('i', [1, 2, 3, 3]),
+                  array('i', [0, 0, 1, 2, 4]), array('i', [0, 0, 1, 2]))
+        self.assertEqual(G.number_of_edges(), 4)
+        self.assertSetEqual(G.ancestors('d'), {'a', 'b', 'c'})
+        self.assertSetEqual(G.ancestors('a'), set())
+        self.assertSetEqual(G.descendants('a'), {'b', 'c', 'd'})
+        self.assertSetEqual(G.successors('a'), {'b', 'c'})
+        self.assertSetEqual(G.sources(), {'a'})
+        self.assertSetEqual(G.sources(['b', 'c']), set())
+        self.assertSetEqual(G.sinks(), {'d'})
+        self.assertSetEqual(set(G.edges()), {('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')})
+        self.assertRaises(NodeNotFound, G.ancestors, 'z')
+
+    def test_from_files(self):
+        self.assertEqual(len(self.G), 7)
+        self.assertSetEqual(self.G.ancestors('f'), {'a', 'b', 'c', 'd', 'e'})
+        self.assertSetEqual(self.G.descendants('d'), {'e', 'f', 'g'})
+        self.assertSetEqual(self.G.successors('a'), {'b', 'c', 'f'})
+        self.assertSetEqual(self.G.sinks(), {'f', 'g'})
+        self.assertListEqual(dag.query(self.G, 'ancestors', ['e', 'g']), ['a', 'b', 'c', 'd', 'e', 'g'])
+        self.assertListEqual(dag.query(self.G, 'sources', ['g']), ['a'])
+        self.assertListEqual(dag.query(self.G, 'sources', []), ['a'])
+
+    def test_exclude(self):
+        self.assertListEqual(dag.query(self.G, 'ancestors', ['e'], '[bc]'), ['a', 'd', 'e'])
+        self.assertEqual(self.dag('--ancestors', 'e', '--exclude', '[bc]', '--plain'), 'a d e')
+        self.assertEqual(self.dag('--successors', 'a', 'd', '--exclude', 'f', '--plain', '-1'), 'b\nc\ne\ng')
+        self.assertEqual(self.dag('--sinks', '--exclude', 'g', '--plain'), 'f')
+
+    def test_index(self):
+        index = os.path.join(self.tmp.name, 'test.dag.idx')
+        self.assertFalse(Graph.load([self.fname], index)[1])
+        G, indexed = Graph.load([self.fname], index)
+        self.assertTrue(indexed)
+        self.assertSetEqual(set(G.edges()), set(self.G.edges()))
+        # truncated index, in the middle of the arrays: rebuilt from the dag file
+        size = os.stat(index).st_size
+        for length in [size - 6, size - 4, 10, 0]:
+            with open(index, 'r+b') as fil:
+                fil.truncate(length)
+            G, indexed = Graph.load([self.fname], index)
+            self.assertFalse(indexed)
+            self.assertSetEqual(set(G.edges()), set(self.G.edges()))
+            self.assertEqual(os.stat(index).st_size, size)
+        self.assertTrue(Graph.load([self.fname], index)[1])
+        # touched dag file: same graph, index saved again with the new mtime
+        os.utime(self.fname, (0, 0))
+        G, indexed = Graph.load([self.fname], index)
+        self.assertTrue(indexed)
+        self.assertSetEqual(set(G.edges()), set(self.G.edges()))
+        self.assertEqual(Graph.load_index(index)[1][0][2], 0)
+        # index that cannot be saved again is ignored
+        os.utime(self.fname, (1, 1))
+        os.mkdir('%s.%d.tmp' % (index, os.getpid()))
+        G, indexed = Graph.load([self.fname], index)
+        self.assertTrue(indexed)
+        self.assertSetEqual(set(G.edges()), set(self.G.edges()))
+
+    def test_cache(self):
+        # no index unless asked for
+        self.dag('--sinks')
+        self.assertListEqual(os.listdir(self.tmp.name), ['test.dag'])
+        index = os.path.join(self.tmp.name, 'graph.idx')
+        self.assertEqual(self.dag('--sinks', '--cache', index), 'read 1 file(s), 7 nodes and 8 edges\nf g')
+        self.assertEqual(self.dag('--sinks', '--cache', index), 'read 1 file(s) from %s, 7 nodes and 8 edges\nf g' % (index))
+
+    def test_levels(self):
+        levels = self.G.levels(self.G.names)
+        self.assertListEqual(levels, [['a'], ['b', 'c'], ['d'], ['e', 'g'], ['f']])
+        # each node is one level above its highest predecessor
+        level_of = {n: i for i, level in enumerate(levels) for n in level}
+        for source, target in self.G.edges():
+            self.assertLess(level_of[source], level_of[target])
+        self.assertListEqual(self.G.critical_path(levels), ['a', 'b', 'd', 'e', 'f'])
+        self.assertListEqual(self.G.critical_path([]), [])
+        # levels of a subgraph only count its own edges
+        self.assertListEqual(self.G.levels(['c', 'e', 'f']), [['c', 'e'], ['f']])
+        self.assertListEqual(dag.query(self.G, 'levels', ['e'], 'd'), [['a', 'e'], ['b', 'c']])
+        self.assertListEqual(dag.query(self.G, 'order', ['g']), ['a', 'b', 'c', 'd', 'g'])
+
+    def test_cycle(self):
+        G = Graph.from_dependencies([['x', 'y', 'w'], ['y', 'x'], ['z', 'x'], ['v', 'w']])
+        with self.assertRaisesRegex(Exception, 'cycle in the graph, nodes not ordered: x y z$'):
+            G.levels(G.names)
+        self.assertListEqual(G.levels(['w', 'v', 'z']), [['w', 'z'], ['v']])
+
+    def test_main_levels(self):
+        self.assertEqual(self.dag('--levels'),
+                         'read 1 file(s), 7 nodes and 8 edges\n'
+                         '5 level(s), max width 2, critical path length 5: a -> b -> d -> e -> f\n'
+                         'level 0 (1): a\nlevel 1 (2): b c\nlevel 2 (1): d\nlevel 3 (2): e g\nlevel 4 (1): f\n')
+        self.assertEqual(self.dag('--levels', 'g', '--plain', '-s', ','), 'a\nb,c\nd\ng\n')
+        self.assertEqual(self.dag('--order', '--plain', '-1'), 'a\nb\nc\nd\ne\ng\nf')
+        self.assertEqual(self.dag('--order', 'e', '--exclude', '[bc]', '--plain'), 'a d e')
+        with open(self.fname, 'a') as fil:
+            fil.write('a f\n')
+        cmd = [sys.executable, os.path.join(HERE, 'dag.py'), self.fname, '--order']
+        err = subprocess.run(cmd, capture_output=True, text=True)
+        self.assertEqual(err.returncode, 1)
+        self.assertIn('cycle in the graph, nodes not ordered: a b c d e f g', err.stderr)
+
+    def test_paths(self):
+        # random graphs, with cycles
+        rnd = random.Random(3)
+        for _ in range(5):
+            builder = GraphBuilder()
+            for i in range(10):
+                builder.intern(str(i))
+            for _ in range(25):
+                builder.add_edge(str(rnd.randrange(10)), str(rnd.randrange(10)))
+            G = builder.build()
+            for source in G.names:
+                for target in G.names:
+                    expected = sorted(brute_force_paths(G, source, target))
+                    for max_depth in [None, 0, 1, 2, 3]:
+                        bounded = [p for p in expected if max_depth is None or len(p) - 1 <= max_depth]
+                        self.assertListEqual(sorted(G.all_simple_paths(source, target, max_depth)), bounded)
+                        shortest = list(G.all_shortest_paths(source, target, max_depth))
+                        self.assertListEqual(sorted(shortest), bounded)
+                        # by increasing length
+                        self.assertListEqual([len(p) for p in shortest], sorted(len(p) for p in bounded))
+
+    def test_main_paths(self):
+        paths = ['a,b,d,e,f', 'a,c,d,e,f', 'a,f']
+        self.assertListEqual(sorted(self.dag('--plain', '--path', 'a', 'f').split()), paths)
+        self.assertEqual(self.dag('--plain', '--path', 'a', 'f', '--shortest'), 'a,f\n')
+        output = self.dag('--plain', '--path', 'a', 'f', '--shortest', '2').split()
+        self.assertEqual(output[0], 'a,f')
+        self.assertIn(output[1], paths[:2])
+        self.assertEqual(len(output), 2)
+        self.assertEqual(len(self.dag('--plain', '--path', 'a', 'f', '--shortest', '5').split()), 3)
+        self.assertEqual(self.dag('--plain', '--path', 'a', 'f', '--max-depth', '3'), 'a,f\n')
+        self.assertEqual(self.dag('--plain', '--path', 'a', 'e', '--max-depth', '2'), '')
+        self.assertEqual(len(self.dag('--plain', '--path', 'a', 'f', '--max-paths', '2').split()), 2)
+        self.assertEqual(self.dag('--plain', '--path', 'b', 'c'), '')
+
+    def test_batch(self):
+        results = dag.run_batch(self.G, [
+            '# comment',
+            'TOP ancestors --exclude=[bc] e',
+            '',
+            'SOURCES sources e g',
+            'NEXT successors --each @SOURCES d',
+            'ORDER order --exclude=c @TOP',
+        ])
+        self.assertDictEqual(results, {
+            'TOP': ['a', 'd', 'e'],
+            'SOURCES': ['a'],
+            'NEXT': {'a': ['b', 'c', 'f'], 'd': ['e', 'g']},
+            'ORDER': ['a', 'b', 'd', 'e'],
+        })
+        self.assertRaises(Exception, dag.run_batch, self.G, ['BAD unknown a'])
+        self.assertRaises(KeyError, dag.run_batch, self.G, ['X ancestors @MISSING'])
+
+    def test_render_cmake(self):
+        results = dag.run_batch(self.G, ['XS ancestors d', 'EACH successors --each b c', 'LEVELS levels d'])
+        results['QUOTED'] = ['a;b', 'c"d', '$e\\']
+        results['EACH']['df.x-y.xml'] = []
+        self.assertEqual(dag.render_cmake(results).splitlines(), [
+            '# THIS FILE WAS GENERATED BY dag.py. DO NOT EDIT.',
+            'set(XS "a;b;c;d")',
+            'set(EACH_b "d")',
+            'set(EACH_c "d")',
+            'set(EACH_df_x_y_xml "")',
+            'set(LEVELS_COUNT 3)',
+            'set(LEVELS_0 "a")',
+            'set(LEVELS_1 "b;c")',
+            'set(LEVELS_2 "d")',
+            'set(QUOTED "a;b;c\\"d;\\$e\\\\")',
+        ])
+        self.assertEqual(dag.cmake_identifier('1.x'), '_1_x')
+
+    def test_queries(self):
+        queries = os.path.join(self.tmp.name, 'dag.queries')
+        with open(queries, 'w') as fil:
+            fil.write('XS sources f\nIMPORTS ancestors --each @XS g\n')
+        output = os.path.join(self.tmp.name, 'dag.cmake')
+        self.assertEqual(self.dag('--queries', queries, '--format=cmake', '--output', output),
+                         'read 1 file(s), 7 nodes and 8 edges\ncreated %s\n' % (output))
+        with open(output) as fil:
+            self.assertEqual(fil.read(), '# THIS FILE WAS GENERATED BY dag.py. DO NOT EDIT.\n'
+                             'set(XS "a")\nset(IMPORTS_a "a")\nset(IMPORTS_g "a;b;c;d;g")\n')
+        # unchanged output is not written again
+        os.utime(output, (0, 0))
+        self.assertEqual(self.dag('--queries', queries, '--format=cmake', '--output', output, '--plain'), '')
+        self.assertEqual(os.stat(output).st_mtime, 0)
+        self.assertEqual(self.dag('--batch', 'XS sources f', 'N successors @XS'),
+                         '{\n  "XS": [\n    "a"\n  ],\n  "N": [\n    "b",\n    "c",\n    "f"\n  ]\n}\n')
+
+    # b removed, edge c -> g added, edge a -> f removed, node h added
+    NEW_DAG = """c a
+d c
+e d
+f e
+g d c
+h g
+"""
+
+    def test_diff(self):
+        report = dag.diff(self.G, Graph.from_dependencies(l.split() for l in self.NEW_DAG.splitlines()))
+        self.assertDictEqual(report, {
+            'added_nodes': ['h'],
+            'removed_nodes': ['b'],
+            'added_edges': [('c', 'g'), ('g', 'h')],
+            'removed_edges': [('a', 'b'), ('a', 'f'), ('b', 'd')],
+            'changed': ['b', 'd', 'f', 'g', 'h'],
+            'impacted': ['d', 'e', 'f', 'g', 'h'],
+        })
+        # no change
+        self.assertListEqual(dag.diff(self.G, self.G)['impacted'], [])
+        # removed or unknown types only: nothing impacted
+        new = Graph.from_dependencies(l.split() for l in self.NEW_DAG.splitlines())
+        self.assertListEqual(dag.diff(self.G, new, types=['b', 'z'])['impacted'], [])
+        self.assertListEqual(dag.diff(self.G, new, types=[])['impacted'], [])
+
+    def test_main_diff(self):
+        new = os.path.join(self.tmp.name, 'new.dag')
+        with open(new, 'w') as fil:
+            fil.write(self.NEW_DAG)
+        def diff(*args):
+            cmd = [sys.executable, os.path.join(HERE, 'dag.py'), 'diff', self.fname, new] + list(args)
+            return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertEqual(diff(), '1 node(s) added, 1 removed, 2 edge(s) added, 3 removed, 5 node(s) impacted\n'
+                         'd e f g h')
+        self.assertEqual(diff('--plain', '-1', '--exclude', '[gh]'), 'd\ne\nf')
+        # only impacted ancestors of given types, unknown types are ignored
+        self.assertEqual(diff('--plain', '--types', 'f', 'z'), 'd e f')
+        self.assertEqual(diff('--plain', '--types', 'c'), '')
+        self.assertEqual(diff('--plain', '--types', 'b'), '')
+        self.assertEqual(diff('--plain', '--types', 'z'), '')
+        report = json.loads(diff('--format', 'json', '--types', 'h'))
+        self.assertListEqual(report['added_edges'], [['c', 'g'], ['g', 'h']])
+        self.assertListEqual(report['removed_nodes'], ['b'])
+        self.assertListEqual(report['impacted'], ['d', 'g', 'h'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/bin/python3
+
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+import corpus
+import dependencies
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestDependencies(unittest.TestCase):
+
+    XML = """<data-definition>
+    <!-- a comment -->
+    <enum-type type-name="my_enum" base-type="int16_t" export="true">
+        <enum-item name="a"><item-attr name="type" type-name="ignored"/></enum-item>
+    </enum-type>
+    <bitfield-type type-name="my_flags" base-type="uint32_t" export="true">
+        <flag-bit name="b"/>
+    </bitfield-type>
+    <struct-type type-name="not_exported">
+        <pointer name="p" type-name="my_enum" export="true"/>
+    </struct-type>
+    <global-object name="my_global" type-name="my_struct" export="true"/>
+    <struct-type type-name="my_struct" inherits-from="my_base" export="true">
+        <enum name="e" type-name="my_enum" export="true"/>
+        <int32_t name="i" export="true"/>
+        <stl-vector name="v" pointer-type="item" export="true"/>
+        <stl-vector name="w" type-name="int16_t" pointer-type="building" export="true"/>
+        <compound name="c" type-name="my_compound" export="true">
+            <pointer name="nested" type-name="unit" export="true"/>
+        </compound>
+        <compound name="anon" export="true">
+            <pointer name="nested" type-name="unit" export="true"/>
+        </compound>
+        <pointer name="hidden" type-name="job"/>
+        <pointer name="renamed" type-name="job" export-as="other" export="true"/>
+        <pointer name="after" export="true" type-name="plant" export-as="other"/>
+        <static-array name="a" count="2" index-enum="my_enum" type-name="my_enum" export="true"/>
+        <comment>type-name="job"</comment>
+        <code-helper name="describe">type-name</code-helper>
+        <virtual-methods>
+            <vmethod name="getType" ret-type="my_enum" export="true"/>
+            <vmethod name="getName" export="true"><ret-type><pointer type-name="unit"/></ret-type></vmethod>
+            <vmethod name="getItem" ret-type="item"/>
+        </virtual-methods>
+    </struct-type>
+    <df-linked-list-type type-name="my_list" item-type="my_link" export="true">
+        <pointer name="link" type-name="my_link" export="true"/>
+    </df-linked-list-type>
+    <df-other-vectors-type type-name="my_vectors" index-enum="my_enum" item-type="item" export="true"/>
+</data-definition>
+"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, 'df.test.xml')
+        with open(self.fname, 'w') as fil:
+            fil.write(self.XML)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_extract(self):
+        self.assertListEqual(dependencies.extract(self.fname), [
+            ['my_enum'],
+            ['my_flags'],
+            ['my_struct', 'my_base', 'my_enum', 'item', 'building', 'my_compound', 'plant', 'my_enum', 'my_enum'],
+            ['my_list', 'my_link'],
+            ['my_vectors', 'my_enum'],
+        ])
+
+    def test_main(self):
+        out = subprocess.run([sys.executable, os.path.join(HERE, 'dependencies.py'), '--plain', '-s;', self.fname],
+                             check=True, capture_output=True, text=True).stdout
+        self.assertIn('my_list;my_link;%s\n' % (self.fname), out)
+        self.assertEqual(len(out.splitlines()), 5)
+
+    def test_jobs(self):
+        fnames = []
+        for i in range(4):
+            fnames.append(os.path.join(self.tmp.name, 'df.test%d.xml' % (i)))
+            with open(fnames[-1], 'w') as fil:
+                fil.write(self.XML.replace('my_', 'my%d_' % (i)))
+        cmd = [sys.executable, os.path.join(HERE, 'dependencies.py')] + fnames
+        serial = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        parallel = subprocess.run(cmd + ['--jobs', '3'], check=True, capture_output=True, text=True).stdout
+        self.assertEqual(serial, parallel)
+        self.assertIn('4 file(s), 20 global types found', serial)
+
+    def test_cache(self):
+        other = os.path.join(self.tmp.name, 'df.other.xml')
+        with open(other, 'w') as fil:
+            fil.write(self.XML.replace('my_', 'other_'))
+        cmd = [sys.executable, os.path.join(HERE, 'dependencies.py'), self.fname, other,
+               '--cache', os.path.join(self.tmp.name, 'cache')]
+        first = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn('0 hit(s), 2 miss(es)', first.stderr)
+        second = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn('2 hit(s), 0 miss(es)', second.stderr)
+        self.assertEqual(first.stdout, second.stdout)
+        # same content under another name is a hit, changed content a miss
+        with open(other, 'w') as fil:
+            fil.write(self.XML.replace('my_base', 'new_base'))
+        third = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn('1 hit(s), 1 miss(es)', third.stderr)
+        self.assertIn('my_struct: my_base', third.stdout)
+        self.assertIn('my_struct: new_base', third.stdout)
+
+    def test_antlr_equivalence(self):
+        try:
+            import antlr_dependencies
+        except ImportError as e:
+            self.skipTest('ANTLR parser not available: %s' % (e))
+        fnames = [self.fname]
+        crp = corpus.Corpus(types=200, files=2, seed=3)
+        crp.write(self.tmp.name)
+        for name in crp.files():
+            fnames.append(os.path.join(self.tmp.name, 'df.%s.merged.xml' % (name)))
+            with open(fnames[-1], 'w') as out:
+                subprocess.run([sys.executable, os.path.join(HERE, 'merge.py'),
+                                os.path.join(self.tmp.name, 'df.%s.xml' % (name)),
+                                os.path.join(self.tmp.name, '%s.export' % (name))],
+                               check=True, stdout=out, stderr=subprocess.DEVNULL)
+        for fname in fnames:
+            self.assertListEqual(dependencies.extract(fname), antlr_dependencies.extract(fname), fname)
+
+
+if __name__ == '__main__':
+    unittest.main()
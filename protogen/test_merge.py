@@ -0,0 +1,165 @@
+#!/bin/python3
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+import contextlib
+import subprocess
+
+from lxml import etree
+
+import merge
+from bench_merge import XPathIndex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestMerge(unittest.TestCase):
+
+    XML = """<?xml version="1.0"?>
+<!-- head -->
+<data-definition>
+  <!-- first -->
+  <struct-type type-name="my_struct">
+    <int32_t name="id"/>
+    <compound name="data"><pointer name="unit" type-name="unit"/></compound>
+    <pointer name="item" type-name="item"/>
+    <virtual-methods>
+      <vmethod name="getType"><ret-type><enum type-name="my_enum"/></ret-type></vmethod>
+    </virtual-methods>
+  </struct-type>
+  <enum-type type-name="my_enum" comment="&lt;é&gt;"/>
+  <struct-type type-name="other"/>
+  <!-- last -->
+</data-definition>
+"""
+
+    EXPORT = """# comment
+my_struct
+\tid
+\tdata
+\titem as item_id
+\ttype
+my_enum
+"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.xml = os.path.join(self.tmp.name, 'df.test.xml')
+        self.export = os.path.join(self.tmp.name, 'test.export')
+        with open(self.xml, 'w') as fil:
+            fil.write(self.XML)
+        with open(self.export, 'w') as fil:
+            fil.write(self.EXPORT)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def merge_tree(self):
+        xml = etree.parse(self.xml).getroot()
+        with open(self.export) as fd, contextlib.redirect_stderr(io.StringIO()):
+            warnings = merge.parse_structure(fd, xml)
+        out = io.BytesIO()
+        etree.ElementTree(xml).write(out, pretty_print=True)
+        return warnings, out.getvalue()
+
+    def merge_stream(self):
+        with open(self.export) as fd:
+            spec = merge.read_spec(fd)
+        out = io.BytesIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            warnings = merge.merge_stream(self.xml, spec, out)
+        return warnings, out.getvalue()
+
+    def test_merge(self):
+        warnings, out = self.merge_tree()
+        self.assertEqual(warnings, 0)
+        self.assertIn(b'<struct-type type-name="my_struct" export="true">', out)
+        self.assertIn(b'<compound name="data" export="true"><pointer name="unit" type-name="unit" export="true"/></compound>', out)
+        self.assertIn(b'<pointer name="item" type-name="item" export-as="item_id"/>', out)
+        self.assertIn(b'<vmethod name="getType" export="true"><ret-type export="true">', out)
+        self.assertIn(b'<struct-type type-name="other"/>', out)
+
+    def test_index(self):
+        # same lookups as the linear search, with duplicate and missing names
+        xml = etree.fromstring("""<data-definition>
+  <struct-type type-name="dup"><int32_t name="a"/><!-- a --><int8_t name="a"/><int16_t name="b"/>
+    <virtual-methods><vmethod name="m"/><vmethod/><comment name="m"/></virtual-methods>
+    <virtual-methods><vmethod name="m"/><vmethod name="n"/></virtual-methods>
+  </struct-type>
+  <enum-type type-name="dup"><enum-item name="a"/></enum-type>
+  <class-type type-name="single"><virtual-methods/></class-type>
+  <global-object name="dup"/>
+</data-definition>
+""")
+        index, xpath = merge.Index(xml), XPathIndex(xml)
+        for tname in ['dup', 'single', 'missing', 'a']:
+            types = index.find_types(tname)
+            self.assertListEqual(types, xpath.find_types(tname))
+            for t in types:
+                for name in ['a', 'b', 'm', 'n', 'missing', 'dup']:
+                    self.assertListEqual(index.find_fields(t, name), xpath.find_fields(t, name))
+                    self.assertListEqual(index.find_methods(t, name), xpath.find_methods(t, name))
+        self.assertEqual(len(index.find_types('dup')), 2)
+        self.assertEqual(len(index.find_fields(index.find_types('dup')[0], 'a')), 2)
+        self.assertEqual(len(index.find_methods(index.find_types('dup')[0], 'm')), 2)
+        # same merged tree
+        with open(self.export) as fd:
+            lines = fd.readlines()
+        trees = []
+        for make_index in [merge.Index, XPathIndex]:
+            xml = etree.parse(self.xml).getroot()
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(merge.parse_structure(iter(lines), xml, make_index(xml)), 0)
+            trees.append(etree.tostring(xml))
+        self.assertEqual(trees[0], trees[1])
+
+    def test_stream(self):
+        self.assertEqual(self.merge_stream(), self.merge_tree())
+
+    def test_batch(self):
+        # df.test.xml has an export spec, df.other.xml has none
+        with open(os.path.join(self.tmp.name, 'df.other.xml'), 'w') as fil:
+            fil.write(self.XML)
+        outdir = os.path.join(self.tmp.name, 'out')
+        output = os.path.join(outdir, 'df.test.xml')
+        cmd = [sys.executable, os.path.join(HERE, 'merge.py'), 'batch', self.tmp.name, self.tmp.name, outdir, '-j', '2']
+        proc = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertRegex(proc.stdout, r'df.test.xml +[0-9.]+ ms  updated')
+        self.assertIn('1 file(s) merged, 1 updated, 1 without export spec', proc.stdout)
+        self.assertListEqual(os.listdir(outdir), ['df.test.xml'])
+        with open(output, 'rb') as fil:
+            self.assertEqual(fil.read(), self.merge_tree()[1])
+        # unchanged output is not rewritten
+        os.utime(output, (0, 0))
+        proc = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertRegex(proc.stdout, r'df.test.xml +[0-9.]+ ms  unchanged')
+        self.assertEqual(os.stat(output).st_mtime, 0)
+
+    def test_warnings(self):
+        with open(self.export, 'a') as fil:
+            fil.write('other\n\tmissing\nunknown\n')
+        self.assertEqual(self.merge_stream()[0], 2)
+        output = os.path.join(self.tmp.name, 'out.xml')
+        proc = subprocess.run([sys.executable, os.path.join(HERE, 'merge.py'), self.xml, self.export, '-o', output],
+                              capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn('type other: field <missing> not found', proc.stderr)
+        self.assertIn('type <unknown> not found', proc.stderr)
+        self.assertFalse(os.path.exists(output))
+        # nothing on stdout either
+        proc = subprocess.run([sys.executable, os.path.join(HERE, 'merge.py'), self.xml, self.export],
+                              capture_output=True)
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(proc.stdout, b'')
+
+    def test_stdout(self):
+        proc = subprocess.run([sys.executable, os.path.join(HERE, 'merge.py'), self.xml, self.export],
+                              check=True, capture_output=True)
+        self.assertEqual(proc.stdout, self.merge_tree()[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
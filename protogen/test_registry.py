@@ -0,0 +1,91 @@
+#!/bin/python3
+
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+import dependencies
+from registry import Registry, scan
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestRegistry(unittest.TestCase):
+
+    XML = """<data-definition>
+    <enum-type type-name="my_enum" base-type="int16_t" export="true">
+        <enum-item name="a"/>
+    </enum-type>
+    <global-object name="my_global" type-name="my_struct" export="true"/>
+    <struct-type type-name="my_struct" inherits-from="my_base" instance-vector="$global.world.my_structs" export="true">
+        <int32_t name="id" export="true"/>
+        <pointer name="p" type-name="unit" export="true"/>
+    </struct-type>
+    <class-type type-name="my_class" key-field="code">
+        <stl-string name="code"/>
+    </class-type>
+</data-definition>
+"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, 'df.test.xml')
+        with open(self.fname, 'w') as fil:
+            fil.write(self.XML)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_scan(self):
+        symbols = scan(self.fname)
+        self.assertListEqual([s['name'] for s in symbols], ['my_enum', 'my_struct', 'my_class'])
+        self.assertDictEqual(symbols[1], {
+            'name': 'my_struct',
+            'meta': 'struct-type',
+            'export': 'true',
+            'instance-vector': '$global.world.my_structs',
+            'key-field': 'id',
+            'inherits-from': 'my_base',
+            'dependencies': ['my_struct', 'my_base', 'unit'],
+        })
+        self.assertEqual(symbols[2]['key-field'], 'code')
+        self.assertIsNone(symbols[2]['dependencies'])
+
+    def test_update(self):
+        registry = Registry()
+        self.assertEqual(registry.update([self.fname]), 1)
+        self.assertListEqual(registry.exported(), ['my_enum', 'my_struct'])
+        self.assertEqual(registry.find('my_class')['file'], self.fname)
+        self.assertListEqual(registry.dependencies(),
+                             [deps + [self.fname] for deps in dependencies.extract(self.fname)])
+        # touched files are not parsed again, changed files are
+        os.utime(self.fname, (0, 0))
+        self.assertEqual(registry.update([self.fname]), 0)
+        with open(self.fname, 'w') as fil:
+            fil.write(self.XML.replace('my_base', 'new_base'))
+        self.assertEqual(registry.update([self.fname]), 1)
+        self.assertEqual(registry.find('my_struct')['inherits-from'], 'new_base')
+
+    def test_main(self):
+        output = os.path.join(self.tmp.name, 'registry.json')
+        cmd = [sys.executable, os.path.join(HERE, 'registry.py'), self.fname, '-o', output]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertEqual(out, '1 file(s), 1 parsed, 3 global types, 2 exported\n')
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        self.assertEqual(out, '1 file(s), 0 parsed, 3 global types, 2 exported\n')
+        self.assertListEqual(Registry.load(output).exported(self.fname), ['my_enum', 'my_struct'])
+        # dependencies.py lists the same graph from the registry
+        cmd = [sys.executable, os.path.join(HERE, 'dependencies.py'), self.fname]
+        self.assertEqual(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout,
+                         subprocess.run(cmd + ['--registry', output], check=True, capture_output=True, text=True).stdout)
+        # options of the parsing path are rejected with the registry
+        for options in [['--cache', self.tmp.name], ['--parser', 'lxml']]:
+            result = subprocess.run(cmd + ['--registry', output] + options, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 2)
+            self.assertIn('--registry cannot be used with --cache or --parser', result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()